@@ -0,0 +1,213 @@
+import hashlib
+import os
+import shutil
+import string
+import threading
+import time
+import uuid
+
+
+class _Upload:
+    """
+    Um upload em andamento: arquivo temporário aberto, hash incremental e próximo offset.
+    'closed' (alterado sob 'lock') marca o upload já concluído ou descartado: um 'write' que o
+    achou antes disso não pode mais gravar no arquivo.
+    """
+    __slots__ = ("owner", "name", "size", "sha256", "path", "file", "hash", "offset", "last_seen", "lock",
+                 "closed")
+
+    def __init__(self, owner, name, size, sha256, path):
+        self.owner = owner
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.file = open(path, "wb")
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def close(self):
+        """Fecha o arquivo temporário (chamado com 'lock')."""
+        self.closed = True
+        self.file.close()
+
+
+class AttachmentStore:
+    """
+    Anexos endereçados pelo conteúdo (SHA-256), gravados em disco pedaço a pedaço.
+    1. 'begin' abre um upload. Se o cliente informou o hash e esse conteúdo já existe, o upload
+       nem começa (dedup) e a referência volta na hora; senão, retorna um 'upload_id'.
+    2. 'write' grava um pedaço (até 'chunk_size' bytes) no offset esperado, direto no arquivo
+       temporário, e atualiza o hash incremental: a memória por transferência é de um pedaço.
+       Um pedaço repetido (offset já gravado, ex: reenvio após timeout) é ignorado.
+    3. 'finish' confere o tamanho (e o hash informado) e move o arquivo para 'objects/<hash>';
+       se o conteúdo já existia, o temporário é apagado (dedup por hash).
+    4. 'read' devolve até 'chunk_size' bytes a partir de um offset (download em pedaços).
+    5. Uploads parados há mais de 'upload_ttl' segundos são descartados por uma thread; cada
+       usuário tem no máximo 'max_uploads' uploads abertos e cada anexo até 'max_size' bytes.
+    6. 'write' e 'finish' só aceitam o dono do upload (quem o abriu com 'begin'); para os demais
+       o upload é desconhecido.
+    Os erros são devolvidos como {"ok": False, "error": ...}, como nas demais chamadas do servidor.
+    """
+    def __init__(self, directory: str = "attachments", chunk_size: int = 256 * 1024,
+                 max_size: int = 64 * 1024 * 1024, max_uploads: int = 4, upload_ttl: float = 600.0):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.max_uploads = max_uploads
+        self.upload_ttl = upload_ttl
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dedup_hits = 0
+        self.completed = 0
+        self.expired = 0
+        self._tmp = os.path.join(directory, "tmp")
+        # uploads interrompidos por uma queda não têm como continuar: os temporários são apagados
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        os.makedirs(self._tmp, exist_ok=True)
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        threading.Thread(target=self._purge_loop, name="attachments-purge", daemon=True).start()
+
+    def _path(self, digest: str):
+        """Arquivo do conteúdo 'digest' (None se 'digest' não é um SHA-256 em hexadecimal)."""
+        if not isinstance(digest, str) or len(digest) != 64 or not set(digest) <= set(string.hexdigits):
+            return None
+        digest = digest.lower()
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def size(self, digest: str):
+        """Tamanho do conteúdo 'digest', ou None se ele não existe."""
+        path = self._path(digest)
+        try:
+            return os.path.getsize(path) if path else None
+        except OSError:
+            return None
+
+    def ref(self, attachment):
+        """
+        Referência normalizada {"id", "name", "size"} para um anexo já armazenado
+        ('attachment' é um id ou uma referência {"id", "name"}); None se o conteúdo não existe.
+        """
+        if isinstance(attachment, dict):
+            digest, name = attachment.get("id"), attachment.get("name")
+        else:
+            digest, name = attachment, None
+        size = self.size(digest)
+        if size is None:
+            return None
+        return {"id": digest.lower(), "name": os.path.basename(str(name or digest[:12])), "size": size}
+
+    def begin(self, owner: str, name: str, size: int, sha256: str = None):
+        if not isinstance(size, int) or size < 0:
+            return {"ok": False, "error": "tamanho_invalido"}
+        if size > self.max_size:
+            return {"ok": False, "error": "arquivo_grande_demais", "max_size": self.max_size}
+        if sha256 is not None:
+            if self._path(sha256) is None:
+                return {"ok": False, "error": "hash_invalido"}
+            ref = self.ref({"id": sha256, "name": name})
+            if ref is not None and ref["size"] == size:
+                self.dedup_hits += 1
+                return {"ok": True, "attachment": ref}
+        with self._lock:
+            if sum(1 for u in self._uploads.values() if u.owner == owner) >= self.max_uploads:
+                return {"ok": False, "error": "uploads_demais"}
+            upload_id = uuid.uuid4().hex
+            self._uploads[upload_id] = _Upload(owner, os.path.basename(str(name)), size,
+                                               sha256.lower() if sha256 else None,
+                                               os.path.join(self._tmp, upload_id + ".part"))
+        return {"ok": True, "upload_id": upload_id, "chunk_size": self.chunk_size}
+
+    def write(self, owner: str, upload_id: str, offset: int, data: bytes):
+        upload = self._uploads.get(upload_id)
+        if upload is None or upload.owner != owner:
+            return {"ok": False, "error": "upload_desconhecido"}
+        if len(data) > self.chunk_size:
+            return {"ok": False, "error": "pedaco_grande_demais", "chunk_size": self.chunk_size}
+        with upload.lock:
+            if upload.closed:
+                # 'finish' ou a limpeza de uploads parados venceu a corrida
+                return {"ok": False, "error": "upload_desconhecido"}
+            upload.last_seen = time.monotonic()
+            if offset + len(data) <= upload.offset:
+                # pedaço já gravado (reenvio): confirma sem gravar de novo
+                return {"ok": True, "offset": upload.offset}
+            if offset != upload.offset:
+                return {"ok": False, "error": "offset_invalido", "offset": upload.offset}
+            if upload.offset + len(data) > upload.size:
+                return {"ok": False, "error": "tamanho_excedido"}
+            upload.file.write(data)
+            upload.hash.update(data)
+            upload.offset += len(data)
+            self.bytes_in += len(data)
+            return {"ok": True, "offset": upload.offset}
+
+    def finish(self, owner: str, upload_id: str):
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None or upload.owner != owner:
+                return {"ok": False, "error": "upload_desconhecido"}
+            del self._uploads[upload_id]
+        with upload.lock:
+            upload.close()
+            digest = upload.hash.hexdigest()
+            if upload.offset != upload.size:
+                error = {"ok": False, "error": "tamanho_incorreto", "offset": upload.offset}
+            elif upload.sha256 is not None and upload.sha256 != digest:
+                error = {"ok": False, "error": "hash_incorreto"}
+            else:
+                error = None
+            if error is not None:
+                os.remove(upload.path)
+                return error
+            path = self._path(digest)
+            if os.path.exists(path):
+                os.remove(upload.path)
+                self.dedup_hits += 1
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(upload.path, path)
+        self.completed += 1
+        return {"ok": True, "attachment": {"id": digest, "name": upload.name, "size": upload.size}}
+
+    def read(self, digest: str, offset: int = 0, length: int = None):
+        """Até 'length' (no máximo 'chunk_size') bytes do conteúdo, a partir de 'offset'."""
+        path = self._path(digest)
+        length = self.chunk_size if length is None else max(0, min(length, self.chunk_size))
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                f.seek(offset)
+                data = f.read(length)
+        except (OSError, TypeError):
+            return {"ok": False, "error": "anexo_nao_encontrado"}
+        self.bytes_out += len(data)
+        return {"ok": True, "data": data, "offset": offset + len(data), "size": size}
+
+    def purge_expired(self):
+        """Descarta os uploads sem pedaço novo há mais de 'upload_ttl' segundos."""
+        limit = time.monotonic() - self.upload_ttl
+        with self._lock:
+            stale = [uid for uid, u in self._uploads.items() if u.last_seen < limit]
+            uploads = [self._uploads.pop(uid) for uid in stale]
+        for upload in uploads:
+            with upload.lock:
+                upload.close()
+                os.remove(upload.path)
+            self.expired += 1
+
+    def _purge_loop(self):
+        while True:
+            time.sleep(min(60.0, self.upload_ttl))
+            self.purge_expired()
+
+    def stats(self):
+        with self._lock:
+            uploads = len(self._uploads)
+        return {"uploads": uploads, "completed": self.completed, "dedup_hits": self.dedup_hits,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out, "expired": self.expired}
@@ -0,0 +1,55 @@
+"""
+Benchmark: custo de CPU por broadcast em função do tamanho da sala.
+Mede apenas o trabalho de serialização que o servidor faz para entregar UM broadcast
+a N destinatários (o mesmo que o Pyro5 executa dentro de cada chamada de callback):
+  antes  -> serpent serializa o dicionário 'msg' de novo para cada destinatário ('receive')
+  depois -> a mensagem é codificada uma vez e os bytes são reaproveitados ('receive_encoded' via marshal)
+
+Uso: python bench_broadcast.py [tamanho_do_texto]
+"""
+import sys
+import time
+from Pyro5.serializers import serializers
+from codec import encode_message, CALLBACK_SERIALIZER
+
+ROOM_SIZES = (10, 100, 1000, 5000)
+
+
+def broadcast_before(msg, n):
+    ser = serializers["serpent"]
+    for i in range(n):
+        ser.dumpsCall(f"obj_{i}", "receive", (msg,), {})
+
+
+def broadcast_after(msg, n):
+    ser = serializers[CALLBACK_SERIALIZER]
+    payloads = [encode_message(msg)]
+    for i in range(n):
+        ser.dumpsCall(f"obj_{i}", "receive_encoded", (payloads,), {})
+
+
+def cpu_per_broadcast(fn, msg, n, min_time=0.5):
+    """Executa 'fn' repetidamente por pelo menos 'min_time' s de CPU e retorna a média em ms."""
+    runs = 0
+    start = time.process_time()
+    while True:
+        fn(msg, n)
+        runs += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_time:
+            return elapsed / runs * 1000
+
+
+def main():
+    text_len = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    msg = {"from": "alice", "to": "ALL", "text": "x" * text_len, "ts": time.time()}
+    print(f"texto de {text_len} caracteres")
+    print(f"{'sala':>6} {'antes (ms)':>12} {'depois (ms)':>12} {'ganho':>7}")
+    for n in ROOM_SIZES:
+        before = cpu_per_broadcast(broadcast_before, msg, n)
+        after = cpu_per_broadcast(broadcast_after, msg, n)
+        print(f"{n:>6} {before:>12.3f} {after:>12.3f} {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
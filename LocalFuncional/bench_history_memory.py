@@ -0,0 +1,59 @@
+"""
+Benchmark: bytes por mensagem do histórico em memória.
+Compara a lista de dicionários {from, to, text, ts} (formato antigo do ChatServer.history)
+com o ColumnarHistory (arrays de ts/ids + buffer de texto contíguo), medindo com tracemalloc.
+
+Uso: python bench_history_memory.py [mensagens] [usuarios]
+"""
+import random
+import sys
+import time
+import tracemalloc
+from columnar import ColumnarHistory
+
+
+def make_messages(n, users):
+    names = [f"usuario_{i}" for i in range(users)]
+    ts = time.time()
+    for i in range(n):
+        sender = random.choice(names)
+        # nomes chegam como strings novas a cada chamada remota (não compartilhadas)
+        to = "ALL" if random.random() < 0.8 else random.choice(names)
+        yield {"from": "".join(sender), "to": "".join(to),
+               "text": f"mensagem número {i} " + "x" * random.randint(10, 80), "ts": ts + i * 1e-3}
+
+
+def measure(build, n, users):
+    random.seed(1)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = build(make_messages(n, users))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / n, store
+
+
+def build_list(messages):
+    return list(messages)
+
+
+def build_columnar(messages):
+    store = ColumnarHistory()
+    for msg in messages:
+        store.append(msg)
+    return store
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    per_dict, _ = measure(build_list, n, users)
+    per_col, store = measure(build_columnar, n, users)
+    print(f"{n} mensagens, {users} usuários")
+    print(f"lista de dicts : {per_dict:8.1f} bytes/mensagem")
+    print(f"colunar        : {per_col:8.1f} bytes/mensagem ({store.nbytes() / n:.1f} nas colunas)")
+    print(f"redução        : {per_dict / per_col:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,38 @@
+import hashlib
+import json
+import os
+import sqlite3
 import threading
 import time
 from Pyro5.api import expose, Daemon, Proxy, locate_ns
+from Pyro5.errors import CommunicationError, NamingError
+from codec import CALLBACK_SERIALIZER, decode_compact, decode_message, message_from_fields, unpack_frame, wire_offer
+from sharding import SERVER_NAME, SHARD_PREFIX
+from netconfig import add_network_arguments, configure_daemon
+
+# Intervalo (s) entre heartbeats; None usa o valor sugerido pelo servidor no registro.
+HEARTBEAT_INTERVAL = None
+
+# Envio em lote: até SEND_BATCH_SIZE mensagens ou SEND_FLUSH_INTERVAL segundos por chamada 'send_messages'
+# (abaixo da rajada padrão por remetente do servidor, --rate-burst 40, para um lote cheio caber nela)
+SEND_BATCH_SIZE = 32
+SEND_FLUSH_INTERVAL = 0.02
+
+# Cache local do histórico: um arquivo SQLite por usuário nesta pasta; None desativa o cache
+LOCAL_HISTORY_DIR = "client_history"
+HISTORY_PAGE = 500  # mensagens por chamada 'get_history' na sincronização
+
+# Failover: por quanto tempo (s) o cliente procura um servidor que aceite o re-registro
+# (o standby leva alguns segundos para assumir) e o intervalo entre tentativas
+FAILOVER_TIMEOUT = 30.0
+FAILOVER_RETRY = 0.25
+
+# Pasta onde '/get' grava os anexos baixados
+DOWNLOAD_DIR = "downloads"
+
+# Formato compacto: oferece ao servidor, no registro, mensagens posicionais (marshal/msgpack)
+# com zlib acima de um limite, também nas páginas de histórico; False mantém os dicionários
+COMPACT_WIRE = True
 
 @expose
 class ClientCallback:
@@ -9,10 +41,12 @@ class ClientCallback:
     Esta classe é exposta remotamente (Pyro5) para que o SERVIDOR possa chamá-la
     e enviar mensagens de volta para o cliente.
     """
-    def __init__(self, on_receive):
+    def __init__(self, on_receive, on_presence=None):
         # on_receive: função local para exibir/armazenar mensagem
         # Armazena a função que lida com a exibição da mensagem recebida no console local.
         self.on_receive = on_receive
+        # on_presence: função local que recebe os eventos de presença (ex: Roster.on_events)
+        self.on_presence = on_presence
 
     def receive(self, msg):
         # este método será chamado pelo servidor remoto (callback)
@@ -20,12 +54,503 @@ class ClientCallback:
         # para a função local 'on_receive' para ser exibida na tela.
         self.on_receive(msg)
 
-def interactive_loop(server_proxy, my_name, callback_uri):
+    def receive_batch(self, msgs):
+        # chamado pelo servidor quando várias mensagens para este cliente foram agrupadas
+        # em uma única chamada remota; cada uma é repassada, em ordem, para 'on_receive'.
+        for msg in msgs:
+            self.on_receive(msg)
+
+    def receive_encoded(self, payloads):
+        # forma preferida pelo servidor: cada mensagem chega já codificada (uma única vez
+        # para todos os destinatários de um broadcast) e é decodificada aqui.
+        for payload in payloads:
+            self.on_receive(decode_message(payload))
+
+    def receive_compact(self, frames):
+        # formato compacto (negociado no registro): cada mensagem chega como um frame posicional,
+        # talvez comprimido; o cabeçalho do frame diz como decodificá-lo.
+        for frame in frames:
+            self.on_receive(decode_compact(frame))
+
+    def presence_update(self, events):
+        # chamado pelo servidor (após 'subscribe_presence') com entradas/saídas de usuários,
+        # cada evento {"epoch", "version", "name", "online"}, em ordem de versão.
+        if self.on_presence is not None:
+            self.on_presence(events)
+
+class ServerLink:
+    """
+    Ligação com o servidor de chat que sobrevive a um failover (primário -> standby).
+    1. Os métodos remotos são chamados como em um proxy ('link.send_message(...)'); cada thread
+       usa o seu próprio proxy (proxies Pyro5 pertencem à thread que os usa).
+    2. Numa falha de comunicação, 'failover' procura de novo no Name Server quem atende este
+       usuário, registra o cliente lá com a mesma URI de callback e chama 'on_reconnect(proxy)'
+       (ex: refazer a inscrição de presença); a chamada que falhou é repetida uma vez.
+    3. Várias threads podem notar a mesma falha: só a primeira refaz o registro, as outras
+       passam a usar a URI nova. Sem servidor por FAILOVER_TIMEOUT segundos, a falha é repassada.
+    4. Com 'wire' (oferta de 'codec.wire_offer'), 'register' negocia o formato compacto; com ele
+       acordado, 'get_history' busca cada página em um único frame por um proxy marshal.
+    """
+    def __init__(self, name, callback_uri, ns_host=None, ns_port=None, on_reconnect=None, wire=None):
+        self.name = name
+        self.callback_uri = callback_uri
+        self.ns_host = ns_host
+        self.ns_port = ns_port
+        self.on_reconnect = on_reconnect
+        self.offer = wire
+        self.wire = None  # formato acordado com o servidor atual (None = dicionários)
+        self.uri = locate_server(locate_ns(host=ns_host, port=ns_port), name)
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _proxy(self, binary=False):
+        # 'binary': proxy com o marshal, para chamadas que devolvem bytes (sem o base64 do serpent)
+        local = self._local
+        if getattr(local, "uri", None) != self.uri:
+            for proxy in getattr(local, "proxies", {}).values():
+                proxy._pyroRelease()
+            local.proxies, local.uri = {}, self.uri
+        proxy = local.proxies.get(binary)
+        if proxy is None:
+            proxy = local.proxies[binary] = Proxy(self.uri)
+            if binary:
+                proxy._pyroSerializer = CALLBACK_SERIALIZER
+        return proxy
+
+    def _call(self, fn, binary=False):
+        uri = self.uri
+        proxy = self._proxy(binary)
+        try:
+            return fn(proxy)
+        except CommunicationError:
+            proxy._pyroRelease()
+            self.failover(uri)
+            return fn(self._proxy(binary))
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self._call(lambda proxy: getattr(proxy, method)(*args, **kwargs))
+
+    def _register(self, server):
+        """
+        Registra o cliente em 'server', oferecendo o formato compacto (se houver oferta).
+        Um servidor anterior à negociação não aceita o argumento extra (TypeError): registra sem ele.
+        """
+        if self.offer is None:
+            r = server.register_client(self.name, self.callback_uri)
+        else:
+            try:
+                r = server.register_client(self.name, self.callback_uri, self.offer)
+            except TypeError:
+                r = server.register_client(self.name, self.callback_uri)
+        if r.get("ok"):
+            self.wire = r.get("wire")
+        return r
+
+    def register(self):
+        """Registro inicial; depois de um failover, o registro é refeito automaticamente."""
+        return self._call(self._register)
+
+    def reregister(self):
+        """Refaz o registro no servidor atual (o lease expirou) e chama 'on_reconnect(proxy)'."""
+        def register_again(proxy):
+            r = self._register(proxy)
+            if r.get("ok") and self.on_reconnect is not None:
+                self.on_reconnect(proxy)
+            return r
+        return self._call(register_again)
+
+    def get_history(self, limit: int = 100, before_ts: float = None, since_ts: float = None):
+        """Página do histórico (lista de dicionários), em um único frame se o formato compacto foi acordado."""
+        if self.wire is None:
+            return self._call(lambda proxy: proxy.get_history(limit, before_ts, since_ts))
+        frame = self._call(lambda proxy: proxy.get_history_packed(self.name, limit, before_ts, since_ts),
+                           binary=True)
+        return [message_from_fields(fields) for fields in unpack_frame(frame)]
+
+    def failover(self, failed_uri):
+        """Acha o servidor atual e registra o cliente nele de novo. Retorna a URI em uso."""
+        with self._lock:
+            if self.uri != failed_uri:
+                return self.uri  # outra thread já refez a ligação
+            deadline = time.monotonic() + FAILOVER_TIMEOUT
+            while True:
+                try:
+                    uri = locate_server(locate_ns(host=self.ns_host, port=self.ns_port), self.name)
+                    with Proxy(uri) as server:
+                        r = self._register(server)
+                        if r.get("ok"):
+                            if self.on_reconnect is not None:
+                                self.on_reconnect(server)
+                            break
+                except (CommunicationError, NamingError):
+                    pass
+                if time.monotonic() > deadline:
+                    raise CommunicationError(f"nenhum servidor aceitou o registro em {FAILOVER_TIMEOUT:.0f}s")
+                time.sleep(FAILOVER_RETRY)
+            self.uri = uri
+            self.failovers += 1
+            return uri
+
+class SendPipeline:
+    """
+    Envio de mensagens em pipeline (sem esperar a resposta de cada uma).
+    1. 'send' numera a mensagem (seq), coloca-a no buffer e retorna na hora.
+    2. Uma thread de envio esvazia o buffer com uma chamada 'send_messages' pelo 'server'
+       quando junta 'batch_size' mensagens ou a mais antiga espera 'flush_interval' segundos.
+       'server' é um ServerLink (segue o servidor num failover) ou a URI do servidor.
+    3. A confirmação do servidor chega em lote ('acked' = maior seq processado); os itens que
+       falharam (ex: 'destinatario_nao_encontrado') são repassados a 'on_error(seq, item, erro)'.
+    4. Em falha de comunicação o lote volta para o início do buffer e é reenviado depois.
+    5. Itens recusados pelo controle de admissão ('rate_limited'/'overloaded') também voltam para
+       o início do buffer e são reenviados depois do 'retry_after' sugerido pelo servidor.
+    """
+    def __init__(self, server, name, on_error=None,
+                 batch_size: int = SEND_BATCH_SIZE, flush_interval: float = SEND_FLUSH_INTERVAL):
+        self.server = server
+        self.name = name
+        self.on_error = on_error
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.seq = 0
+        self.acked = 0
+        self._buffer = []
+        self._oldest = None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="send-pipeline", daemon=True)
+        self._thread.start()
+
+    def send(self, to: str, text: str, room: str = None) -> int:
+        """Enfileira a mensagem e retorna o seu número de sequência."""
+        with self._cond:
+            self.seq += 1
+            self._buffer.append([self.seq, to, text, room])
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._buffer) >= self.batch_size or len(self._buffer) == 1:
+                self._cond.notify_all()
+            return self.seq
+
+    def flush(self, timeout: float = None) -> bool:
+        """Espera até que tudo o que foi enviado esteja confirmado pelo servidor."""
+        with self._cond:
+            if self._buffer:
+                self._oldest = 0.0  # libera o buffer atual sem esperar a janela
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self.acked >= self.seq, timeout)
+
+    def close(self, timeout: float = 5.0):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                if self._buffer:
+                    wait = self._oldest + self.flush_interval - time.monotonic()
+                    if len(self._buffer) >= self.batch_size or wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+            batch = self._buffer[:self.batch_size]
+            del self._buffer[:self.batch_size]
+            self._oldest = time.monotonic() if self._buffer else None
+            return batch
+
+    def _run(self):
+        link = isinstance(self.server, ServerLink)
+        server = self.server if link else Proxy(self.server)
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                if not link:
+                    server._pyroRelease()
+                return
+            try:
+                r = server.send_messages(self.name, batch)
+            except CommunicationError:
+                # servidor indisponível (com ServerLink, nem o failover achou outro): o lote volta
+                # para o buffer e é reenviado depois; um lote processado pelo servidor cuja
+                # confirmação se perdeu pode chegar duas vezes
+                if not link:
+                    server._pyroRelease()
+                with self._cond:
+                    self._buffer[:0] = batch
+                    self._oldest = time.monotonic()
+                time.sleep(self.flush_interval)
+                continue
+            except Exception as e:
+                # erro no servidor: o lote inteiro é dado como falho, sem reenvio
+                r = {"acked": batch[-1][0], "errors": [[item[0], {"error": str(e)}] for item in batch]}
+            items = {item[0]: item for item in batch}
+            retry = []
+            retry_after = 0.0
+            for seq, error in r["errors"]:
+                if "retry_after" in error:
+                    # recusada pelo controle de admissão do servidor (limite de envio/sobrecarga)
+                    retry.append(items[seq])
+                    retry_after = max(retry_after, error["retry_after"])
+                elif self.on_error:
+                    self.on_error(seq, items[seq], error.get("error"))
+            with self._cond:
+                if retry:
+                    # só está confirmado o que vem antes do primeiro item a reenviar
+                    self._buffer[:0] = retry
+                    self._oldest = time.monotonic()
+                    self.acked = retry[0][0] - 1
+                else:
+                    self.acked = r["acked"]
+                self._cond.notify_all()
+            if retry:
+                time.sleep(retry_after)
+
+class Roster:
+    """
+    Lista local de usuários online, mantida pelos eventos de presença do servidor (sem polling).
+    1. 'load' aplica uma resposta de 'subscribe_presence'/'presence_since' (retrato completo ou delta).
+    2. 'on_events' (thread do Daemon) aplica os eventos em ordem de versão. Eventos que já estão
+       na lista são ignorados; um buraco na sequência (eventos descartados pelo servidor) ou uma
+       epoch diferente (servidor reiniciado) marca a lista como desatualizada.
+    3. 'users(server)' devolve a lista; se ela estiver desatualizada, antes pede só o delta com
+       'presence_since' (pelo proxy da thread que chama).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = set()
+        self._early = []  # eventos que chegaram antes do primeiro retrato
+        self.epoch = None
+        self.version = None
+        self.stale = True
+
+    def load(self, r):
+        with self._lock:
+            if r.get("full"):
+                self._users = set(r["users"])
+            else:
+                self._users.difference_update(r["left"])
+                self._users.update(r["joined"])
+            self.epoch, self.version = r["epoch"], r["version"]
+            self.stale = False
+            early, self._early = self._early, []
+            self._apply(early)
+
+    def on_events(self, events):
+        with self._lock:
+            if self.version is None:
+                self._early.extend(events)
+                return
+            self._apply(events)
+
+    def _apply(self, events):
+        # chamado com self._lock adquirido
+        for event in events:
+            if self.stale:
+                return
+            if event["epoch"] == self.epoch and event["version"] <= self.version:
+                continue
+            if event["epoch"] != self.epoch or event["version"] != self.version + 1:
+                self.stale = True
+                return
+            if event["online"]:
+                self._users.add(event["name"])
+            else:
+                self._users.discard(event["name"])
+            self.version = event["version"]
+
+    def users(self, server):
+        if self.stale:
+            self.load(server.presence_since(self.version, self.epoch))
+        with self._lock:
+            return sorted(self._users)
+
+
+class HistoryCache:
+    """
+    Cópia local (SQLite) de um trecho contínuo do histórico do servidor.
+    1. As mensagens ficam indexadas pelo 'ts', que é único e crescente no servidor.
+    2. 'sync' busca só o que é mais novo que a mensagem mais recente guardada
+       ('get_history(since_ts=...)', em páginas de HISTORY_PAGE); na primeira vez, só a última página.
+    3. 'last(n)' sincroniza e, se o cache tiver menos de 'n' mensagens, completa para trás
+       com 'get_history(before_ts=<mais antiga guardada>)' até chegar ao início do histórico.
+    Como o cache só cresce pelas duas pontas, ele é sempre um trecho sem buracos.
+    """
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS messages "
+                        "(ts REAL PRIMARY KEY, sender TEXT, recipient TEXT, text TEXT, attachment TEXT)")
+        if "attachment" not in [row[1] for row in self.db.execute("PRAGMA table_info(messages)")]:
+            # cache criado antes dos anexos: a referência do anexo (JSON) ganha uma coluna
+            self.db.execute("ALTER TABLE messages ADD COLUMN attachment TEXT")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+        self.fetched = 0  # mensagens baixadas do servidor nesta sessão
+
+    def _bound(self, fn):
+        return self.db.execute(f"SELECT {fn}(ts) FROM messages").fetchone()[0]
+
+    def _store(self, msgs):
+        self.db.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?)",
+                            [(m["ts"], m["from"], m["to"], m["text"],
+                              json.dumps(m["attachment"]) if "attachment" in m else None) for m in msgs])
+        self.db.commit()
+        self.fetched += len(msgs)
+
+    def _complete(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        return row is not None and row[0] == "1"
+
+    def sync(self, server):
+        """Baixa as mensagens posteriores à mais recente do cache (delta)."""
+        newest = self._bound("MAX")
+        if newest is None:
+            self._store(server.get_history(HISTORY_PAGE))
+            return
+        while True:
+            page = server.get_history(HISTORY_PAGE, since_ts=newest)
+            self._store(page)
+            if len(page) < HISTORY_PAGE:
+                return
+            newest = page[-1]["ts"]
+
+    def last(self, server, n: int):
+        """As últimas 'n' mensagens, em ordem cronológica, servidas do cache local."""
+        self.sync(server)
+        have = self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        while have < n and have > 0 and not self._complete():
+            want = min(n - have, HISTORY_PAGE)
+            page = server.get_history(want, before_ts=self._bound("MIN"))
+            self._store(page)
+            have += len(page)
+            if len(page) < want:
+                # chegou ao início do histórico do servidor: não há o que buscar para trás
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+                self.db.commit()
+        rows = self.db.execute("SELECT ts, sender, recipient, text, attachment FROM messages "
+                               "ORDER BY ts DESC LIMIT ?", (n,)).fetchall()
+        msgs = []
+        for ts, f, t, text, attachment in reversed(rows):
+            msg = {"from": f, "to": t, "text": text, "ts": ts}
+            if attachment is not None:
+                msg["attachment"] = json.loads(attachment)
+            msgs.append(msg)
+        return msgs
+
+    def close(self):
+        self.db.close()
+
+class AttachmentClient:
+    """
+    Envio e download de anexos em pedaços: a memória usada é de um pedaço por transferência.
+    1. As chamadas de anexo usam um proxy próprio com o marshal (os bytes vão crus, sem o base64
+       do serpent), sempre para o servidor atual da ligação ('server.uri').
+    2. 'upload(path)' calcula o SHA-256 lendo o arquivo aos poucos e abre o upload com ele: se o
+       servidor já tem esse conteúdo, nada é enviado (dedup). Senão envia os pedaços e conclui;
+       a resposta traz a referência {"id", "name", "size"} para 'send_message(..., attachment=...)'.
+    3. 'download(ref)' grava o anexo pedaço a pedaço num arquivo '.part', confere o SHA-256 e só
+       então dá a ele o nome final.
+    4. 'seen(msg)' guarda as referências das mensagens exibidas, para '/get' aceitar o começo do id.
+    """
+    def __init__(self, server, name):
+        self.server = server
+        self.name = name
+        self.received = {}
+
+    def _proxy(self):
+        proxy = Proxy(self.server.uri)
+        proxy._pyroSerializer = CALLBACK_SERIALIZER
+        return proxy
+
+    def upload(self, path: str):
+        size = os.path.getsize(path)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(block)
+        with self._proxy() as server:
+            r = server.begin_upload(self.name, os.path.basename(path), size, digest.hexdigest())
+            if not r.get("ok") or "attachment" in r:
+                return r
+            upload_id, chunk_size = r["upload_id"], r["chunk_size"]
+            with open(path, "rb") as f:
+                offset = 0
+                while offset < size:
+                    f.seek(offset)
+                    r = server.upload_chunk(self.name, upload_id, offset, f.read(chunk_size))
+                    # 'offset_invalido' traz o offset que o servidor espera: retoma dali
+                    if not r.get("ok") and r.get("error") != "offset_invalido":
+                        return r
+                    offset = r["offset"]
+            return server.finish_upload(self.name, upload_id)
+
+    def download(self, ref: dict, directory: str = DOWNLOAD_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, os.path.basename(ref["name"]))
+        part = path + ".part"
+        digest = hashlib.sha256()
+        with self._proxy() as server, open(part, "wb") as f:
+            offset, size = 0, None
+            while size is None or offset < size:
+                r = server.download_chunk(ref["id"], offset)
+                if not r.get("ok"):
+                    break
+                f.write(r["data"])
+                digest.update(r["data"])
+                offset, size = r["offset"], r["size"]
+        if r.get("ok") and digest.hexdigest() != ref["id"]:
+            r = {"ok": False, "error": "hash_incorreto"}
+        if not r.get("ok"):
+            os.remove(part)
+            return r
+        os.replace(part, path)
+        return {"ok": True, "path": path, "size": size}
+
+    def seen(self, msg: dict):
+        ref = msg.get("attachment")
+        if ref:
+            self.received[ref["id"]] = ref
+
+    def find(self, prefix: str):
+        """Referência do anexo cujo id começa com 'prefix' (None se não há exatamente uma)."""
+        prefix = prefix.lower()
+        matches = [ref for digest, ref in list(self.received.items()) if digest.startswith(prefix)]
+        if len(matches) == 1:
+            return matches[0]
+        if len(prefix) == 64:
+            return {"id": prefix, "name": prefix[:12]}
+        return None
+
+def describe_attachment(msg: dict) -> str:
+    """Trecho exibido após o texto de uma mensagem com anexo ('' se ela não tem anexo)."""
+    ref = msg.get("attachment")
+    if not ref:
+        return ""
+    return f" [anexo: {ref['name']}, {ref['size']} bytes, id {ref['id'][:12]}]"
+
+def interactive_loop(server_proxy, my_name, callback_uri, sender=None, history_cache=None, roster=None,
+                     attachments=None):
     """
     Loop Principal de Interação com o Usuário
     Gerencia a entrada de comandos do usuário e chama os métodos remotos do servidor.
+    Com 'sender' (SendPipeline), as mensagens seguem em pipeline e os erros chegam
+    assíncronos pelo 'on_error' do pipeline; sem ele, cada envio espera a resposta.
+    Com 'history_cache' (HistoryCache), '/hist' é servido do cache local após baixar só o delta.
+    Com 'roster' (Roster), '/list' usa a lista local mantida pelos eventos de presença.
+    Com 'attachments' (AttachmentClient), '/file' envia e '/get' baixa anexos.
+    '/quit' apenas encerra o loop; a limpeza (pipeline, desregistro) fica com quem chamou.
     """
-    print(f"Bem-vindo(a), {my_name}!\nComandos:\n  /msg <user> <texto>  -> mensagem privada\n  /all <texto>         -> broadcast\n  /list                -> lista usuários\n  /hist [n]            -> histórico (últimos n)\n  /quit                -> sair\n")
+    print(f"Bem-vindo(a), {my_name}!\nComandos:\n  /msg <user> <texto>  -> mensagem privada\n  /all <texto>         -> broadcast\n  /list                -> lista usuários\n  /hist [n]            -> histórico (últimos n)\n  /join <sala>         -> entra em uma sala\n  /leave <sala>        -> sai de uma sala\n  /room <sala> <texto> -> mensagem para a sala\n  /rooms               -> lista salas\n  /rhist <sala> [n]    -> histórico da sala\n  /search <termos>     -> busca no histórico\n  /file <user|ALL|#sala> <arquivo> [legenda] -> envia um anexo\n  /get <id> [pasta]    -> baixa um anexo\n  /quit                -> sair\n")
     
     while True:
         try:
@@ -45,6 +570,9 @@ def interactive_loop(server_proxy, my_name, callback_uri):
                 continue
             to = parts[1]
             text = parts[2]
+            if sender is not None:
+                sender.send(to, text)
+                continue
             # Chama o método remoto 'send_message' no servidor
             r = server_proxy.send_message(my_name, to, text)
             if not r.get("ok"):
@@ -54,12 +582,16 @@ def interactive_loop(server_proxy, my_name, callback_uri):
             # Envio de mensagem para todos (Broadcast)
             text = line[5:]
             # Chama o método remoto 'send_message' no servidor, usando "ALL" como destinatário
-            server_proxy.send_message(my_name, "ALL", text)
+            if sender is not None:
+                sender.send("ALL", text)
+            else:
+                server_proxy.send_message(my_name, "ALL", text)
             
         elif line == "/list":
             # Listagem de usuários
-            # Chama o método remoto 'list_clients' no servidor
-            users = server_proxy.list_clients()
+            # Com a lista local de presença não há chamada remota (salvo para buscar um delta);
+            # senão chama o método remoto 'list_clients' no servidor
+            users = roster.users(server_proxy) if roster is not None else server_proxy.list_clients()
             print("Usuários conectados:", users)
             
         elif line.startswith("/hist"):
@@ -67,71 +599,231 @@ def interactive_loop(server_proxy, my_name, callback_uri):
             parts = line.split()
             # Pega o número de mensagens a exibir (padrão é 50)
             n = int(parts[1]) if len(parts) > 1 else 50
-            # Chama o método remoto 'get_history' no servidor
-            h = server_proxy.get_history(n)
+            # Com cache local, baixa só as mensagens novas; senão chama 'get_history' no servidor
+            h = history_cache.last(server_proxy, n) if history_cache is not None else server_proxy.get_history(n)
             # Formata e exibe cada mensagem do histórico
             for m in h:
                 ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(m["ts"]))
-                print(f"[{ts}] {m['from']} -> {m['to']}: {m['text']}")
+                print(f"[{ts}] {m['from']} -> {m['to']}: {m['text']}{describe_attachment(m)}")
+                if attachments is not None:
+                    attachments.seen(m)
                 
+        elif line.startswith("/join ") or line.startswith("/leave "):
+            # Entrada/saída de sala
+            cmd, _, room = line.partition(" ")
+            room = room.strip()
+            # Chama o método remoto 'join_room' ou 'leave_room' no servidor
+            r = server_proxy.join_room(my_name, room) if cmd == "/join" else server_proxy.leave_room(my_name, room)
+            if not r.get("ok"):
+                print("Erro:", r.get("error"))
+
+        elif line.startswith("/room "):
+            # Envio de mensagem para uma sala (só os membros recebem)
+            parts = line.split(" ", 2)
+            if len(parts) < 3:
+                print("Uso: /room <sala> <texto>")
+                continue
+            if sender is not None:
+                sender.send("ALL", parts[2], room=parts[1])
+                continue
+            r = server_proxy.send_message(my_name, "ALL", parts[2], room=parts[1])
+            if not r.get("ok"):
+                print("Erro:", r.get("error"))
+
+        elif line == "/rooms":
+            # Listagem de salas e número de membros
+            print("Salas:", server_proxy.list_rooms())
+
+        elif line.startswith("/rhist "):
+            # Exibição do histórico de uma sala
+            parts = line.split()
+            n = int(parts[2]) if len(parts) > 2 else 50
+            for m in server_proxy.get_room_history(parts[1], n):
+                ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(m["ts"]))
+                print(f"[{ts}] {m['from']} ({m['to']}): {m['text']}{describe_attachment(m)}")
+                if attachments is not None:
+                    attachments.seen(m)
+
+        elif line.startswith("/search "):
+            # Busca no histórico (mais recentes primeiro); "from:<nome>" filtra o remetente
+            words = line.split()[1:]
+            sender_filter = next((w[5:] for w in words if w.startswith("from:")), None)
+            query = " ".join(w for w in words if not w.startswith("from:"))
+            r = server_proxy.search_history(query, sender=sender_filter)
+            if not r.get("ok"):
+                print("Erro:", r.get("error"))
+                continue
+            for m in r["results"]:
+                ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(m["ts"]))
+                print(f"[{ts}] {m['from']} -> {m['to']}: {m['text']}{describe_attachment(m)}")
+                if attachments is not None:
+                    attachments.seen(m)
+            if not r["results"]:
+                print("Nada encontrado.")
+
+        elif line.startswith("/file ") and attachments is not None:
+            # Envio de anexo: o arquivo sobe em pedaços e a mensagem leva só a referência
+            parts = line.split(" ", 3)
+            if len(parts) < 3 or not os.path.isfile(parts[2]):
+                print("Uso: /file <user|ALL|#sala> <arquivo> [legenda]")
+                continue
+            r = attachments.upload(parts[2])
+            if not r.get("ok"):
+                print("Erro:", r.get("error"))
+                continue
+            ref = r["attachment"]
+            text = parts[3] if len(parts) > 3 else ref["name"]
+            to, room = ("ALL", parts[1][1:]) if parts[1].startswith("#") else (parts[1], None)
+            if sender is not None:
+                sender.flush()  # mantém a ordem em relação às mensagens já em pipeline
+            r = server_proxy.send_message(my_name, to, text, room=room, attachment=ref)
+            if not r.get("ok"):
+                print("Erro:", r.get("error"))
+
+        elif line.startswith("/get ") and attachments is not None:
+            # Download de anexo, pedaço a pedaço, para a pasta indicada (padrão: DOWNLOAD_DIR)
+            parts = line.split()
+            ref = attachments.find(parts[1])
+            if ref is None:
+                print("Anexo desconhecido (use o id exibido na mensagem).")
+                continue
+            r = attachments.download(ref, parts[2] if len(parts) > 2 else DOWNLOAD_DIR)
+            if r.get("ok"):
+                print(f"Anexo salvo em {r['path']} ({r['size']} bytes).")
+            else:
+                print("Erro:", r.get("error"))
+
         elif line == "/quit":
-            # Comando de saída
+            # Comando de saída: quem chamou esvazia o pipeline e desregistra o cliente
             print("Saindo...")
-            # Chama o método remoto 'unregister_client' no servidor
-            server_proxy.unregister_client(my_name)
             break
             
         else:
             print("Comando desconhecido.")
 
-def start_client(name):
+def heartbeat_loop(server, name, interval, stop):
     """
-    Configuração e inicialização do cliente Pyro5.
+    Thread de Heartbeat
+    Renova periodicamente o lease de presença no servidor.
+    'server' é o ServerLink: esta thread usa o seu próprio proxy (proxies Pyro5 pertencem à
+    thread que os usa) e, se o servidor cair, é em geral ela quem dispara o failover.
+    Se o servidor responde que o cliente não está mais registrado (o lease expirou durante uma
+    queda curta da rede), o registro é refeito e as mensagens guardadas nesse meio-tempo chegam.
+    Servidores antigos (heartbeat oneway) retornam None.
     """
-    
-    ns = locate_ns(host = "192.168.15.3")
+    while not stop.wait(interval):
+        try:
+            r = server.heartbeat(name)
+            if isinstance(r, dict) and r.get("error") == "nao_registrado":
+                r = server.reregister()
+                if not r.get("ok"):
+                    print(f"\n[registro perdido e não refeito: {r.get('error')}]\n> ", end="", flush=True)
+        except CommunicationError:
+            # nenhum servidor disponível por enquanto: a próxima tentativa procura de novo
+            pass
+
+def locate_server(ns, name):
+    """
+    Localiza o servidor que atende 'name'.
+    Com shards registrados no Name Server, pergunta a qualquer um deles qual é o shard casa
+    do usuário (hash consistente) e retorna a URI desse shard; senão, usa o servidor único.
+    """
+    shards = ns.list(prefix=SHARD_PREFIX)
+    if not shards:
+        return ns.lookup(SERVER_NAME)
+    with Proxy(next(iter(shards.values()))) as any_shard:
+        home = any_shard.locate_shard(name)["shard"]
+    return shards.get(home) or ns.lookup(home)
 
-    # 1. Conexão ao Servidor de Nomes (Name Server)
-    # 2. Localização do Servidor de Chat
-    server_uri = ns.lookup("chat.server")
-    # 3. Criação de um Proxy para o Objeto Remoto do Servidor
-    server = Proxy(server_uri)
+def start_client(name, host="localhost", port=0, ns_host=None, ns_port=None):
+    """
+    Configuração e inicialização do cliente Pyro5.
+    'host'/'port': onde o Daemon de callback escuta (o endereço pelo qual o servidor alcança
+    este cliente); 'ns_host'/'ns_port': o Name Server (None = busca automática).
+    """
     
     # Função que será usada pela classe ClientCallback para exibir mensagens na tela.
+    # Mensagens com anexo mostram a referência; o conteúdo só é baixado com '/get'.
+    attachments = None
+
     def on_receive(msg):
         ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(msg["ts"]))
+        if attachments is not None:
+            attachments.seen(msg)
         # Exibe a mensagem de forma formatada e garante que o prompt (>) seja redesenhado.
-        if msg["to"] == "ALL":
-            print(f"\n[{ts}] {msg['from']} (ALL): {msg['text']}\n> ", end="", flush=True)
+        if msg["to"] == "ALL" or msg["to"].startswith("#"):
+            print(f"\n[{ts}] {msg['from']} ({msg['to']}): {msg['text']}{describe_attachment(msg)}\n> ", end="", flush=True)
         else:
-            print(f"\n[{ts}] {msg['from']} -> {msg['to']}: {msg['text']}\n> ", end="", flush=True)
+            print(f"\n[{ts}] {msg['from']} -> {msg['to']}: {msg['text']}{describe_attachment(msg)}\n> ", end="", flush=True)
 
     # Criação do Daemon Local para receber Callbacks
-    with Daemon(host="192.168.15.6") as daemon:
-        # 1. Cria a instância do objeto callback com a função 'on_receive'.
-        callback = ClientCallback(on_receive)
+    with Daemon(host=host, port=port) as daemon:
+        # 1. Cria a instância do objeto callback com a função 'on_receive' (e a lista local de
+        #    presença, que recebe os eventos de entrada/saída).
+        roster = Roster()
+        callback = ClientCallback(on_receive, roster.on_events)
         # 2. Registra o objeto callback no Daemon local, obtendo sua URI.
         callback_uri = daemon.register(callback)
-        
-        # 3. Registro no Servidor Remoto
-        # Envia o nome do cliente e a URI do seu objeto de callback para o servidor.
-        r = server.register_client(name, callback_uri)
+
+        # 3. Conexão ao Servidor de Nomes, localização do Servidor de Chat (ou do shard que atende
+        #    este usuário) e ligação com ele. Se o servidor cair e um standby assumir (ou o lease
+        #    expirar), a ligação registra o cliente de novo e refaz a inscrição de presença.
+        def on_reconnect(new_server):
+            print("\n[registro refeito no servidor]\n> ", end="", flush=True)
+            if roster is not None:
+                roster.load(new_server.subscribe_presence(name))
+        server = ServerLink(name, callback_uri, ns_host, ns_port, on_reconnect=on_reconnect,
+                            wire=wire_offer() if COMPACT_WIRE else None)
+
+        # 4. Registro no Servidor Remoto
+        # Envia o nome do cliente e a URI do seu objeto de callback para o servidor (com a oferta
+        # do formato compacto: mensagens posicionais e zlib acima de um limite).
+        r = server.register()
         if not r.get("ok"):
             print("Erro ao registrar:", r)
             return
             
-        # 4. Início do Daemon em uma Thread
+        # 5. Início da Thread de Heartbeat (mantém o lease de presença no servidor)
+        stop_heartbeat = threading.Event()
+        interval = HEARTBEAT_INTERVAL or r.get("heartbeat", 5.0)
+        threading.Thread(target=heartbeat_loop, args=(server, name, interval, stop_heartbeat), daemon=True).start()
+
+        # 6. Envio em pipeline: erros de mensagens já enviadas aparecem assim que o lote é confirmado
+        def on_send_error(seq, item, error):
+            print(f"\nErro na mensagem #{seq} para {item[3] and '#' + item[3] or item[1]}: {error}\n> ", end="", flush=True)
+        sender = SendPipeline(server, name, on_error=on_send_error)
+
+        # Inscrição nos eventos de presença: a lista de usuários fica local (servidores antigos ou
+        # particionados não oferecem; nesse caso '/list' continua usando 'list_clients')
+        try:
+            p = server.subscribe_presence(name)
+        except AttributeError:
+            p = {"ok": False}
+        if p.get("ok"):
+            roster.load(p)
+        else:
+            roster = None
+        history_cache = None
+        if LOCAL_HISTORY_DIR:
+            history_cache = HistoryCache(os.path.join(LOCAL_HISTORY_DIR, f"{name}.sqlite"))
+        attachments = AttachmentClient(server, name)
+
+        # 7. Início do Daemon em uma Thread
         # O loop de requisições do Daemon deve rodar em uma thread separada para que 
         # a thread principal possa executar o 'interactive_loop' (interface de usuário).
         daemon_thread = threading.Thread(target=daemon.requestLoop, daemon=True)
         daemon_thread.start()
         
         try:
-            # 5. Início do Loop Interativo (Bloqueia a Thread Principal)
-            interactive_loop(server, name, callback_uri)
+            # 8. Início do Loop Interativo (Bloqueia a Thread Principal)
+            interactive_loop(server, name, callback_uri, sender, history_cache, roster, attachments)
             
         finally:
-            # 6. Lógica de Limpeza (Executada ao sair do loop interativo ou em caso de erro)
+            # 9. Lógica de Limpeza (Executada ao sair do loop interativo ou em caso de erro)
+            stop_heartbeat.set()
+            sender.close()
+            if history_cache is not None:
+                history_cache.close()
             try:
                 # Tenta desregistrar o cliente do servidor antes de fechar
                 server.unregister_client(name)
@@ -146,10 +838,14 @@ if __name__ == "__main__":
     """
     Bloco de Execução Principal
     Verifica os argumentos da linha de comando e inicia o cliente.
+    Uso: python client.py <seu_nome> [--host IP_DESTA_MAQUINA] [--ns-host IP_DO_NAME_SERVER]
+    (ou as variáveis CHAT_CLIENT_HOST, CHAT_CLIENT_PORT, CHAT_NS_HOST, CHAT_NS_PORT).
     """
-    import sys
-    if len(sys.argv) != 2:
-        print("Uso: python client.py <seu_nome>")
-        sys.exit(1)
+    import argparse
+    parser = argparse.ArgumentParser(description="Cliente de chat (Pyro5)")
+    parser.add_argument("name", help="seu nome de usuário")
+    add_network_arguments(parser, prefix="CHAT_CLIENT_")
+    args = parser.parse_args()
+    configure_daemon(args.servertype, args.workers)
     # Inicia a aplicação cliente com o nome fornecido no argumento.
-    start_client(sys.argv[1])
\ No newline at end of file
+    start_client(args.name, args.host, args.port, args.ns_host, args.ns_port)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import json
+import marshal
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import msgpack
+except ImportError:  # opcional: sem ele o formato compacto usa o marshal
+    msgpack = None
+
+# Serializador usado nas chamadas de callback que carregam mensagens já codificadas:
+# o marshal copia 'bytes' direto para o fio, sem reescapar o conteúdo (como faz o serpent).
+CALLBACK_SERIALIZER = "marshal"
+
+# Formato compacto (negociado no 'register_client'): cada mensagem vira um frame de bytes
+# = 1 byte de cabeçalho (serializador | FRAME_COMPRESSED) + a lista posicional
+# [from, to, text, ts] (+ [id, name, size] do anexo, se houver) serializada. Corpos com mais
+# de 'threshold' bytes vão comprimidos com zlib. O cabeçalho torna cada frame autodescritivo:
+# quem decodifica não precisa lembrar o que foi negociado.
+COMPACT_SCHEMA = "compact"
+SERIALIZER_IDS = {"marshal": 1, "msgpack": 2, "json": 3}
+SERIALIZER_PREFERENCE = ("marshal", "msgpack", "json")  # ordem de escolha do servidor
+FRAME_COMPRESSED = 0x80
+COMPRESSION_ZLIB = "zlib"
+COMPRESS_THRESHOLD = 512
+
+
+def encode_message(msg: dict) -> bytes:
+    """
+    Codifica uma mensagem {from, to, text, ts} uma única vez.
+    Os bytes resultantes são reaproveitados para todos os destinatários de um broadcast.
+    """
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_message(data) -> dict:
+    """Decodifica uma mensagem produzida por 'encode_message'."""
+    if isinstance(data, str):
+        return json.loads(data)
+    return json.loads(bytes(data).decode("utf-8"))
+
+
+def field_needle(key: str, value: str) -> bytes:
+    """
+    Trecho exato que '"key": value' ocupa em uma mensagem codificada por 'encode_message'.
+    Permite descartar registros do log sem decodificá-los (filtro rápido por substring).
+    """
+    return (json.dumps(key) + ":" + json.dumps(value, ensure_ascii=False)).encode("utf-8")
+
+
+def available_serializers():
+    """Serializadores do formato compacto disponíveis neste processo."""
+    return [name for name in SERIALIZER_PREFERENCE if name != "msgpack" or msgpack is not None]
+
+
+def _dumps(serializer, obj) -> bytes:
+    if serializer == "marshal":
+        return marshal.dumps(obj)
+    if serializer == "msgpack":
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(serializer_id, body):
+    if serializer_id == SERIALIZER_IDS["marshal"]:
+        return marshal.loads(body)
+    if serializer_id == SERIALIZER_IDS["msgpack"]:
+        if msgpack is None:
+            raise ValueError("frame em msgpack, mas o msgpack não está instalado")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(bytes(body).decode("utf-8"))
+
+
+class WireFormat:
+    """
+    Formato compacto acordado com um cliente: serializador e compressão acima de 'threshold' bytes.
+    'pack' produz o frame de qualquer objeto simples (uma mensagem ou uma página de histórico).
+    """
+    __slots__ = ("serializer", "compression", "threshold", "key")
+
+    def __init__(self, serializer: str = "marshal", compression: str = None, threshold: int = COMPRESS_THRESHOLD):
+        if serializer not in available_serializers():
+            raise ValueError(f"serializador indisponível: {serializer}")
+        self.serializer = serializer
+        self.compression = compression
+        self.threshold = threshold
+        self.key = (serializer, compression, threshold)
+
+    def pack(self, obj) -> bytes:
+        body = _dumps(self.serializer, obj)
+        header = SERIALIZER_IDS[self.serializer]
+        if self.compression == COMPRESSION_ZLIB and len(body) > self.threshold:
+            compressed = zlib.compress(body, 6)
+            if len(compressed) < len(body):
+                return bytes((header | FRAME_COMPRESSED,)) + compressed
+        return bytes((header,)) + body
+
+    def spec(self) -> dict:
+        return {"schema": COMPACT_SCHEMA, "serializer": self.serializer,
+                "compression": self.compression, "threshold": self.threshold}
+
+
+def unpack_frame(frame):
+    """Objeto contido em um frame produzido por 'WireFormat.pack'."""
+    frame = bytes(frame)
+    header, body = frame[0], frame[1:]
+    if header & FRAME_COMPRESSED:
+        body = zlib.decompress(body)
+    return _loads(header & ~FRAME_COMPRESSED, body)
+
+
+def wire_offer(serializers=None, compression=(COMPRESSION_ZLIB,)):
+    """Oferta do cliente para 'register_client': o que ele sabe decodificar."""
+    return {"schema": COMPACT_SCHEMA, "serializers": list(serializers or available_serializers()),
+            "compression": list(compression)}
+
+
+def negotiate(offer, threshold: int = COMPRESS_THRESHOLD):
+    """
+    Escolhe o formato compacto a partir da oferta do cliente (None = formato antigo, dicionários).
+    O serializador é o primeiro de SERIALIZER_PREFERENCE que os dois lados têm; a compressão,
+    zlib se o cliente a aceita.
+    """
+    if not isinstance(offer, dict) or offer.get("schema") != COMPACT_SCHEMA:
+        return None
+    offered = offer.get("serializers") or ()
+    serializer = next((s for s in available_serializers() if s in offered), None)
+    if serializer is None:
+        return None
+    compression = COMPRESSION_ZLIB if COMPRESSION_ZLIB in (offer.get("compression") or ()) else None
+    return WireFormat(serializer, compression, threshold)
+
+
+def message_fields(msg: dict) -> list:
+    """Forma posicional de uma mensagem: [from, to, text, ts] ou [from, to, text, ts, [id, name, size]]."""
+    fields = [msg["from"], msg["to"], msg["text"], msg["ts"]]
+    ref = msg.get("attachment")
+    if ref:
+        fields.append([ref["id"], ref["name"], ref["size"]])
+    return fields
+
+
+def message_from_fields(fields) -> dict:
+    """Dicionário {from, to, text, ts[, attachment]} a partir da forma posicional."""
+    msg = {"from": fields[0], "to": fields[1], "text": fields[2], "ts": fields[3]}
+    if len(fields) > 4:
+        digest, name, size = fields[4]
+        msg["attachment"] = {"id": digest, "name": name, "size": size}
+    return msg
+
+
+def decode_compact(frame) -> dict:
+    """Decodifica o frame de uma mensagem ('receive_compact')."""
+    return message_from_fields(unpack_frame(frame))
+
+
+class FrameCache:
+    """
+    Frames compactos já montados, por (formato, payload): num broadcast, cada mensagem é
+    codificada uma vez por formato em uso, não uma vez por destinatário. LRU: guarda os
+    'max_entries' usados mais recentemente (as filas de entrega costumam ser curtas).
+    'fields' dá a forma posicional da mensagem (padrão: 'message_fields'; a variante raiz
+    passa os registros de protocolo.py).
+    """
+    def __init__(self, max_entries: int = 4096, fields=message_fields):
+        self.max_entries = max_entries
+        self.fields = fields
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fmt: WireFormat, msg: dict, payload: bytes) -> bytes:
+        key = (fmt.key, payload)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+        # monta fora do lock; duas threads que erram juntas montam o mesmo frame, sem prejuízo
+        frame = fmt.pack(self.fields(msg))
+        with self._lock:
+            self._frames[key] = frame
+            if len(self._frames) > self.max_entries:
+                self._frames.popitem(last=False)
+        return frame
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._frames), "hits": self.hits, "misses": self.misses}
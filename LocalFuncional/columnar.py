@@ -0,0 +1,115 @@
+import bisect
+from array import array
+
+_COLUMNS = ("from", "to", "text", "ts")
+
+
+class ColumnarHistory:
+    """
+    Armazenamento compacto (em colunas) de mensagens {from, to, text, ts} em memória.
+    1. Os timestamps ficam em um array('d') (8 bytes por mensagem).
+    2. Remetente e destinatário são internados: cada nome vira um id inteiro guardado em array('I').
+    3. Os textos ficam concatenados em um único bytearray (UTF-8), com os offsets em array('Q').
+    4. Dicionários só são montados na saída ('get'/'slice'), ou seja, na fronteira do 'get_history'.
+    5. Chaves além dessas quatro (ex: 'attachment') são raras: ficam num dicionário esparso
+       posição -> {chave: valor}, sem custo para as mensagens que não as têm.
+    Com 'max_messages', funciona como janela das mensagens mais recentes: as mais antigas saem
+    pelo início e o espaço é compactado de forma amortizada, tabela de nomes incluída (só ficam
+    os nomes que a janela ainda usa).
+    Os timestamps devem ser crescentes (o HistoryLog garante isso), o que permite busca binária.
+    """
+    def __init__(self, max_messages: int = None):
+        self.max_messages = max_messages
+        self._names = {}
+        self._name_list = []
+        self._ts = array("d")
+        self._from = array("I")
+        self._to = array("I")
+        self._text_off = array("Q")
+        self._text = bytearray()
+        # mensagens removidas do início ainda não compactadas
+        self._start = 0
+        self._extra = {}
+
+    def _intern(self, name: str) -> int:
+        i = self._names.get(name)
+        if i is None:
+            i = self._names[name] = len(self._name_list)
+            self._name_list.append(name)
+        return i
+
+    def __len__(self):
+        return len(self._ts) - self._start
+
+    def append(self, msg: dict):
+        self._ts.append(msg["ts"])
+        self._from.append(self._intern(msg["from"]))
+        self._to.append(self._intern(msg["to"]))
+        self._text_off.append(len(self._text))
+        self._text += msg["text"].encode("utf-8")
+        if len(msg) > 4:
+            self._extra[len(self._ts) - 1] = {k: v for k, v in msg.items() if k not in _COLUMNS}
+        if self.max_messages is not None and len(self) > self.max_messages:
+            self._start += 1
+            if self._start >= max(1024, len(self)):
+                self._compact()
+
+    def _compact(self):
+        """Descarta de fato as mensagens que já saíram da janela."""
+        s = self._start
+        base = self._text_off[s]
+        del self._ts[:s]
+        del self._from[:s]
+        del self._to[:s]
+        del self._text[:base]
+        self._text_off = array("Q", (off - base for off in self._text_off[s:]))
+        self._extra = {j - s: extra for j, extra in self._extra.items() if j >= s}
+        self._start = 0
+        # refaz a tabela de nomes com os ids ainda usados, na ordem antiga
+        used = sorted(set(self._from) | set(self._to))
+        if len(used) < len(self._name_list):
+            remap = {old: new for new, old in enumerate(used)}
+            self._name_list = [self._name_list[old] for old in used]
+            self._names = {name: i for i, name in enumerate(self._name_list)}
+            self._from = array("I", map(remap.__getitem__, self._from))
+            self._to = array("I", map(remap.__getitem__, self._to))
+
+    def ts(self, i: int) -> float:
+        return self._ts[self._start + i]
+
+    def get(self, i: int) -> dict:
+        """Monta o dicionário da i-ésima mensagem da janela (0 = a mais antiga)."""
+        j = self._start + i
+        end = self._text_off[j + 1] if j + 1 < len(self._text_off) else len(self._text)
+        msg = {
+            "from": self._name_list[self._from[j]],
+            "to": self._name_list[self._to[j]],
+            "text": self._text[self._text_off[j]:end].decode("utf-8"),
+            "ts": self._ts[j],
+        }
+        extra = self._extra.get(j)
+        if extra:
+            msg.update(extra)
+        return msg
+
+    def slice(self, lo: int, hi: int):
+        """Lista de dicionários das mensagens [lo, hi) da janela."""
+        return [self.get(i) for i in range(max(lo, 0), min(hi, len(self)))]
+
+    def index_after(self, ts: float) -> int:
+        """Posição da primeira mensagem com timestamp > ts."""
+        return bisect.bisect_right(self._ts, ts, self._start) - self._start
+
+    def index_before(self, ts: float) -> int:
+        """Posição da primeira mensagem com timestamp >= ts (fim exclusivo de 'antes de ts')."""
+        return bisect.bisect_left(self._ts, ts, self._start) - self._start
+
+    def names(self) -> int:
+        """Nomes na tabela de internação."""
+        return len(self._name_list)
+
+    def nbytes(self) -> int:
+        """Bytes ocupados pelas colunas (sem contar a tabela de nomes)."""
+        return (self._ts.itemsize * len(self._ts) + self._from.itemsize * len(self._from)
+                + self._to.itemsize * len(self._to) + self._text_off.itemsize * len(self._text_off)
+                + len(self._text))
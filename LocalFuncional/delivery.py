@@ -0,0 +1,198 @@
+import logging
+import threading
+import queue
+import heapq
+import time
+from collections import deque
+
+log = logging.getLogger("chat.delivery")
+
+# políticas para quando a fila de um destinatário passa do limite (high-water mark)
+DROP_NEW = "drop_new"        # descarta a mensagem que está chegando
+DROP_OLDEST = "drop_oldest"  # descarta a mensagem mais antiga da fila
+DISCONNECT = "disconnect"    # descarta a fila e desconecta o destinatário
+OVERFLOW_POLICIES = (DROP_NEW, DROP_OLDEST, DISCONNECT)
+
+
+class DeliveryEngine:
+    """
+    Motor de entrega com um pool fixo de threads e uma fila ordenada por destinatário.
+    1. 'enqueue' coloca a mensagem na fila do destinatário e retorna imediatamente.
+    2. Um destinatário com mensagens pendentes entra na fila de "prontos"; só um worker
+       o atende por vez, o que preserva a ordem das mensagens de cada destinatário.
+    3. O worker retira até 'batch_size' mensagens, entrega-as de uma vez (chamando
+       'handler(key, items)') e, se ainda houver mensagens, devolve o destinatário ao fim
+       da fila de prontos (justiça entre clientes).
+    4. Com 'batch_window' > 0, um destinatário que acabou de receber a primeira mensagem
+       espera até 'batch_window' segundos (ou até juntar 'batch_size' mensagens) antes de
+       ficar pronto, para que rajadas sejam agrupadas em uma única chamada remota.
+    5. Se a fila de um destinatário atingir 'high_water', aplica a política de overflow;
+       em DISCONNECT, 'on_overflow(key)' é chamado fora dos locks internos.
+    6. 'set_batch_size(key, n)' muda o tamanho do lote de um destinatário específico (ex: lotes
+       maiores para um cliente lento); com None ele volta ao 'batch_size' padrão.
+    """
+    def __init__(self, handler, workers: int = 8, high_water: int = 1000,
+                 overflow: str = DROP_NEW, on_overflow=None,
+                 batch_size: int = 1, batch_window: float = 0.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"política de overflow inválida: {overflow}")
+        self.handler = handler
+        self.high_water = high_water
+        self.overflow = overflow
+        self.on_overflow = on_overflow
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        # destinatário -> tamanho de lote próprio (quem não está aqui usa 'batch_size')
+        self._batch_sizes = {}
+        # destinatário -> deque de mensagens pendentes
+        self._queues = {}
+        # total de mensagens nas filas (lido sem lock pelo controle de admissão do servidor)
+        self.pending = 0
+        # destinatários atualmente na fila de prontos ou sendo atendidos
+        self._scheduled = set()
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        # destinatários aguardando o fim da janela de agrupamento: heap de (prazo, key)
+        self._delayed = set()
+        self._timers = []
+        self._timer_cond = threading.Condition(self._lock)
+        self.dropped = 0
+        self.batches = 0
+        self._workers = []
+        self._stopped = False
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name=f"delivery-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        if self.batch_window > 0:
+            threading.Thread(target=self._timer_loop, name="delivery-timer", daemon=True).start()
+
+    def enqueue(self, key, item):
+        """Enfileira 'item' para 'key'. Retorna False se a mensagem foi descartada."""
+        overflowed = False
+        with self._lock:
+            q = self._queues.setdefault(key, deque())
+            if len(q) >= self.high_water:
+                if self.overflow == DROP_NEW:
+                    self.dropped += 1
+                    return False
+                if self.overflow == DROP_OLDEST:
+                    q.popleft()
+                    self.dropped += 1
+                    self.pending -= 1
+                else:
+                    self.dropped += len(q) + 1
+                    self.pending -= len(q)
+                    q.clear()
+                    overflowed = True
+            if not overflowed:
+                q.append(item)
+                self.pending += 1
+                if key not in self._scheduled:
+                    self._scheduled.add(key)
+                    if self.batch_window > 0 and len(q) < self.batch_size:
+                        self._delay(key)
+                    else:
+                        self._ready.put(key)
+                elif key in self._delayed and len(q) >= self.batch_size:
+                    # o lote já está cheio: não precisa esperar o fim da janela
+                    self._delayed.discard(key)
+                    self._ready.put(key)
+        if overflowed:
+            if self.on_overflow:
+                self.on_overflow(key)
+            return False
+        return True
+
+    def discard(self, key):
+        """Descarta as mensagens pendentes de 'key' (ex: cliente saiu do chat) e as devolve."""
+        with self._lock:
+            q = self._queues.pop(key, None)
+            if q:
+                self.dropped += len(q)
+                self.pending -= len(q)
+            return list(q) if q else []
+
+    def set_batch_size(self, key, size=None):
+        """Define (ou, com None, remove) o tamanho de lote próprio de 'key'."""
+        with self._lock:
+            if size is None:
+                self._batch_sizes.pop(key, None)
+            else:
+                self._batch_sizes[key] = max(1, size)
+
+    def batch_limit(self, key) -> int:
+        """Tamanho máximo de lote usado para 'key'."""
+        return self._batch_sizes.get(key, self.batch_size)
+
+    def depth(self, key=None):
+        """Tamanho da fila de 'key', ou o total de mensagens pendentes se 'key' for None."""
+        with self._lock:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return self.pending
+
+    def deepest(self, n: int = 5):
+        """As 'n' maiores filas pendentes, como [(key, tamanho), ...] em ordem decrescente."""
+        with self._lock:
+            sizes = [(key, len(q)) for key, q in self._queues.items() if q]
+        return heapq.nlargest(n, sizes, key=lambda kv: kv[1])
+
+    def _delay(self, key):
+        # chamado com self._lock adquirido
+        self._delayed.add(key)
+        heapq.heappush(self._timers, (time.monotonic() + self.batch_window, key))
+        self._timer_cond.notify()
+
+    def _timer_loop(self):
+        """Libera para os workers os destinatários cuja janela de agrupamento terminou."""
+        with self._lock:
+            while not self._stopped:
+                if not self._timers:
+                    self._timer_cond.wait()
+                    continue
+                due, key = self._timers[0]
+                now = time.monotonic()
+                if due > now:
+                    self._timer_cond.wait(due - now)
+                    continue
+                heapq.heappop(self._timers)
+                # entradas antigas do heap (lote já liberado por tamanho) são ignoradas
+                if key in self._delayed:
+                    self._delayed.discard(key)
+                    self._ready.put(key)
+
+    def _run(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                q = self._queues.get(key)
+                items = []
+                limit = self._batch_sizes.get(key, self.batch_size)
+                while q and len(items) < limit:
+                    items.append(q.popleft())
+                if items:
+                    self.batches += 1
+                    self.pending -= len(items)
+            if items:
+                try:
+                    self.handler(key, items)
+                except Exception as e:
+                    log.exception("erro inesperado ao entregar para %s: %s", key, e)
+            with self._lock:
+                q = self._queues.get(key)
+                if q:
+                    self._ready.put(key)
+                else:
+                    self._queues.pop(key, None)
+                    self._scheduled.discard(key)
+
+    def stop(self):
+        """Encerra as threads do pool (mensagens pendentes são abandonadas)."""
+        with self._lock:
+            self._stopped = True
+            self._timer_cond.notify()
+        for _ in self._workers:
+            self._ready.put(None)
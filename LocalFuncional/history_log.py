@@ -0,0 +1,442 @@
+import os
+import mmap
+import struct
+import bisect
+import threading
+import time
+from codec import encode_message, decode_message, field_needle
+from columnar import ColumnarHistory
+
+# registro no segmento: cabeçalho (ts, tamanho do payload) + payload (mensagem codificada)
+RECORD_HEADER = struct.Struct("<dI")
+# entrada do índice esparso (arquivo .idx): ts, offset no segmento, número de sequência global
+INDEX_ENTRY = struct.Struct("<dQQ")
+# checkpoint do índice de busca, gravado ao lado dos segmentos
+SEARCH_CHECKPOINT = "search_index.ckpt"
+
+
+class _Segment:
+    """
+    Um segmento do log: arquivo '<seq>.log' com os registros e '<seq>.idx' com o índice esparso.
+    O índice guarda uma entrada a cada 'index_every' registros (sempre incluindo o primeiro),
+    o que permite achar por ts ou por seq o bloco certo sem varrer o segmento inteiro.
+    """
+    def __init__(self, directory, first_seq):
+        base = os.path.join(directory, f"{first_seq:020d}")
+        self.log_path = base + ".log"
+        self.idx_path = base + ".idx"
+        self.first_seq = first_seq
+        self.index_ts = []
+        self.index_off = []
+        self.index_seq = []
+        self.size = 0
+        self.count = 0
+        self.last_ts = None
+        self._map = None
+        self._map_size = 0
+
+    def block_end(self, i, size):
+        """Offset final do bloco 'i' do índice (início do próximo bloco ou fim do segmento)."""
+        return self.index_off[i + 1] if i + 1 < len(self.index_off) else size
+
+    def view(self, size):
+        """Retorna um mmap do segmento cobrindo pelo menos 'size' bytes (remapeia se o arquivo cresceu)."""
+        if self._map is None or self._map_size < size:
+            with open(self.log_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_size = len(self._map)
+        return self._map
+
+    def close_view(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+
+
+class HistoryLog:
+    """
+    Histórico durável: log append-only em segmentos no disco, com índice esparso e cache em RAM.
+    1. 'append' grava a mensagem no segmento ativo (um novo segmento é aberto a cada 'segment_bytes').
+    2. A cada 'index_every' registros é gravada uma entrada (ts, offset, seq) no índice do segmento.
+    3. As leituras usam mmap dos segmentos e o índice para pular direto ao bloco desejado.
+    4. As últimas 'cache_size' mensagens ficam também em memória, em formato colunar compacto
+       (ColumnarHistory), e atendem as consultas mais comuns.
+    5. Ao reiniciar, carrega só os índices e relê o último bloco do segmento ativo (sem varrer tudo).
+    6. Com 'index' (ex: InvertedIndex), cada mensagem gravada é passada a 'index.add(seq, msg)'
+       sob o lock do log, em ordem de seq. O índice é salvo em SEARCH_CHECKPOINT a cada
+       'index_checkpoint' segundos (se mudou) e no 'close'; ao reiniciar, é restaurado de lá e só
+       as mensagens gravadas depois do checkpoint são relidas (no máximo 'index.max_messages').
+    7. Com 'on_append', cada mensagem gravada é passada também a 'on_append(seq, msg, payload)',
+       sob o lock do log e em ordem de seq (ex: replicação para um servidor standby).
+    Os timestamps são estritamente crescentes: servem de cursor exato para a paginação.
+    """
+    def __init__(self, directory: str = "history", cache_size: int = 10000,
+                 segment_bytes: int = 16 * 1024 * 1024, index_every: int = 64, fsync: bool = False,
+                 index=None, on_append=None, index_checkpoint: float = 60.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_every = index_every
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._segments = []
+        self._cache = ColumnarHistory(max_messages=cache_size)
+        self._count = 0
+        self._last_ts = 0.0
+        self.index = index
+        self.on_append = on_append
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._checkpoint_path = os.path.join(directory, SEARCH_CHECKPOINT)
+        self._checkpoint_seq = None
+        self._checkpoint_lock = threading.Lock()
+        if index is not None:
+            self._recover_index()
+        self._log_file = open(self._active.log_path, "ab")
+        self._idx_file = open(self._active.idx_path, "ab")
+        if index is not None and index_checkpoint:
+            threading.Thread(target=self._checkpoint_loop, args=(index_checkpoint,),
+                             name="search-checkpoint", daemon=True).start()
+
+    # ---------------------------------------------------------------- recuperação
+
+    def _recover(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".log"))
+        for name in names:
+            seg = _Segment(self.directory, int(name[:-4]))
+            seg.size = os.path.getsize(seg.log_path)
+            if os.path.exists(seg.idx_path):
+                with open(seg.idx_path, "rb") as f:
+                    data = f.read()
+                usable = len(data) - len(data) % INDEX_ENTRY.size
+                for ts, off, seq in INDEX_ENTRY.iter_unpack(data[:usable]):
+                    if off >= seg.size:
+                        break  # entrada gravada sem o registro correspondente (queda no meio do append)
+                    seg.index_ts.append(ts)
+                    seg.index_off.append(off)
+                    seg.index_seq.append(seq)
+                if usable != len(data) or len(seg.index_off) != usable // INDEX_ENTRY.size:
+                    self._rewrite_index(seg)
+            self._segments.append(seg)
+        if not self._segments:
+            self._segments.append(_Segment(self.directory, 0))
+            open(self._segments[0].log_path, "ab").close()
+            open(self._segments[0].idx_path, "ab").close()
+        # segmentos selados: a quantidade de registros vem do primeiro seq do segmento seguinte
+        for seg, nxt in zip(self._segments, self._segments[1:]):
+            seg.count = nxt.first_seq - seg.first_seq
+        self._recover_tail(self._active)
+        self._count = self._active.first_seq + self._active.count
+        self._last_ts = self._active.last_ts or 0.0
+        if len(self._segments) > 1 and self._active.last_ts is None:
+            prev = self._segments[-2]
+            self._last_ts = self._scan_last_ts(prev)
+        self._fill_cache()
+
+    def _recover_index(self):
+        """
+        Restaura o índice de busca do checkpoint e indexa só as mensagens gravadas depois dele.
+        Sem checkpoint, com um checkpoint à frente do log (cauda perdida numa queda) ou antigo
+        demais para a janela do índice, indexa só as últimas 'index.max_messages' mensagens.
+        """
+        limit = getattr(self.index, "max_messages", None)
+        start = max(0, self._count - limit) if limit else 0
+        next_seq = None
+        if os.path.exists(self._checkpoint_path):
+            with open(self._checkpoint_path, "rb") as f:
+                next_seq = self.index.load(f.read())
+        if next_seq is None or not start <= next_seq <= self._count:
+            self.index.reset()
+            next_seq = start
+        self._checkpoint_seq = next_seq
+        for seq, ts, msg in self._read_from_seq(next_seq):
+            self.index.add(seq, msg)
+
+    def checkpoint_index(self):
+        """Grava o índice de busca em SEARCH_CHECKPOINT (arquivo temporário + rename)."""
+        with self._checkpoint_lock:
+            next_seq = self.index.next_seq
+            if next_seq is None or next_seq == self._checkpoint_seq:
+                return
+            tmp = self._checkpoint_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(self.index.dump())
+            os.replace(tmp, self._checkpoint_path)
+            self._checkpoint_seq = next_seq
+
+    def _checkpoint_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.checkpoint_index()
+
+    def _rewrite_index(self, seg):
+        with open(seg.idx_path, "wb") as f:
+            for entry in zip(seg.index_ts, seg.index_off, seg.index_seq):
+                f.write(INDEX_ENTRY.pack(*entry))
+
+    def _recover_tail(self, seg):
+        """Relê o segmento ativo a partir da última entrada do índice e corta um registro incompleto."""
+        if seg.size == 0:
+            return
+        i = len(seg.index_off) - 1
+        off = seg.index_off[i] if i >= 0 else 0
+        count = seg.index_seq[i] - seg.first_seq if i >= 0 else 0
+        last_ts = None
+        view = seg.view(seg.size)
+        while off + RECORD_HEADER.size <= seg.size:
+            ts, length = RECORD_HEADER.unpack_from(view, off)
+            if off + RECORD_HEADER.size + length > seg.size:
+                break
+            if (count % self.index_every == 0) and (i < 0 or off > seg.index_off[i]):
+                # registro que deveria estar no índice mas a entrada se perdeu
+                seg.index_ts.append(ts)
+                seg.index_off.append(off)
+                seg.index_seq.append(seg.first_seq + count)
+                self._rewrite_index(seg)
+            off += RECORD_HEADER.size + length
+            count += 1
+            last_ts = ts
+        if off != seg.size:
+            seg.close_view()
+            with open(seg.log_path, "r+b") as f:
+                f.truncate(off)
+            seg.size = off
+        seg.count = count
+        seg.last_ts = last_ts
+
+    def _scan_last_ts(self, seg):
+        last = None
+        for _, ts, _ in self._scan(seg, len(seg.index_off) - 1, seg.size, decode=False):
+            last = ts
+        return last or 0.0
+
+    def _fill_cache(self):
+        if self._cache.max_messages:
+            start = max(0, self._count - self._cache.max_messages)
+            for seq, ts, msg in self._read_from_seq(start):
+                self._cache.append(msg)
+
+    @property
+    def _active(self):
+        return self._segments[-1]
+
+    # ---------------------------------------------------------------- escrita
+
+    def append(self, msg: dict) -> bytes:
+        """
+        Acrescenta 'msg' ao log e retorna o payload codificado (reutilizável na entrega).
+        Se o 'ts' da mensagem não for maior que o da anterior, ele é ajustado para que
+        os timestamps do histórico sejam únicos e crescentes.
+        """
+        with self._lock:
+            if msg["ts"] <= self._last_ts:
+                msg["ts"] = self._last_ts + 1e-6
+            payload = encode_message(msg)
+            seg = self._active
+            if seg.size >= self.segment_bytes:
+                seg = self._roll()
+            if seg.count % self.index_every == 0:
+                entry = (msg["ts"], seg.size, self._count)
+                seg.index_ts.append(entry[0])
+                seg.index_off.append(entry[1])
+                seg.index_seq.append(entry[2])
+                self._idx_file.write(INDEX_ENTRY.pack(*entry))
+                self._idx_file.flush()
+            self._log_file.write(RECORD_HEADER.pack(msg["ts"], len(payload)) + payload)
+            self._log_file.flush()
+            if self.fsync:
+                os.fsync(self._log_file.fileno())
+            seg.size += RECORD_HEADER.size + len(payload)
+            seg.count += 1
+            seg.last_ts = msg["ts"]
+            self._cache.append(msg)
+            if self.index is not None:
+                self.index.add(self._count, msg)
+            if self.on_append is not None:
+                self.on_append(self._count, msg, payload)
+            self._count += 1
+            self._last_ts = msg["ts"]
+            return payload
+
+    def _roll(self):
+        """Sela o segmento ativo e abre um novo (chamado com o lock adquirido)."""
+        self._log_file.close()
+        self._idx_file.close()
+        seg = _Segment(self.directory, self._count)
+        self._segments.append(seg)
+        self._log_file = open(seg.log_path, "ab")
+        self._idx_file = open(seg.idx_path, "ab")
+        return seg
+
+    # ---------------------------------------------------------------- leitura
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def last_ts(self) -> float:
+        """Timestamp da mensagem mais recente gravada (0.0 se o histórico está vazio)."""
+        return self._last_ts
+
+    def _scan(self, seg, block, size, decode=True, needle=None):
+        """
+        Gera (seq, ts, msg) do bloco 'block' do segmento até o offset 'size'.
+        Com 'needle', registros cujo payload não contém esses bytes são pulados sem decodificar.
+        """
+        if block < 0 or size == 0:
+            return
+        view = seg.view(size)
+        off = seg.index_off[block]
+        seq = seg.index_seq[block]
+        while off < size:
+            ts, length = RECORD_HEADER.unpack_from(view, off)
+            start = off + RECORD_HEADER.size
+            off = start + length
+            if needle is None or view.find(needle, start, off) >= 0:
+                yield seq, ts, (decode_message(view[start:off]) if decode else None)
+            seq += 1
+
+    def _snapshot(self):
+        """Lista de (segmento, tamanho visível) para ler sem segurar o lock durante a varredura."""
+        with self._lock:
+            return [(seg, seg.size) for seg in self._segments]
+
+    def _read_from_seq(self, start_seq):
+        """Gera (seq, ts, msg) a partir do número de sequência 'start_seq' até o fim."""
+        segments = self._snapshot()
+        firsts = [seg.first_seq for seg, _ in segments]
+        s = max(0, bisect.bisect_right(firsts, start_seq) - 1)
+        for seg, size in segments[s:]:
+            b = max(0, bisect.bisect_right(seg.index_seq, start_seq) - 1)
+            for block in range(b, len(seg.index_off)):
+                for seq, ts, msg in self._scan(seg, block, seg.block_end(block, size)):
+                    if seq >= start_seq:
+                        yield seq, ts, msg
+
+    def read(self, seqs):
+        """
+        Mensagens com os números de sequência 'seqs', na ordem pedida.
+        As que ainda estão no cache saem da memória; as demais, do bloco do índice que as contém.
+        """
+        found = {}
+        with self._lock:
+            first_cached = self._count - len(self._cache)
+            for seq in seqs:
+                if first_cached <= seq < self._count:
+                    found[seq] = self._cache.get(seq - first_cached)
+        missing = sorted(seq for seq in seqs if seq not in found)
+        if missing:
+            segments = self._snapshot()
+            firsts = [seg.first_seq for seg, _ in segments]
+            scanned = set()
+            for seq in missing:
+                if seq in found:
+                    continue
+                seg, size = segments[max(0, bisect.bisect_right(firsts, seq) - 1)]
+                block = max(0, bisect.bisect_right(seg.index_seq, seq) - 1)
+                if (seg.first_seq, block) in scanned:
+                    continue
+                scanned.add((seg.first_seq, block))
+                for s, ts, msg in self._scan(seg, block, seg.block_end(block, size)):
+                    found[s] = msg
+        return [found[seq] for seq in seqs if seq in found]
+
+    def _read_after(self, since_ts, before_ts, limit, to=None):
+        """As primeiras 'limit' mensagens com since_ts < ts < before_ts (paginação para frente)."""
+        out = []
+        needle = field_needle("to", to) if to is not None else None
+        segments = self._snapshot()
+        firsts = [seg.index_ts[0] if seg.index_ts else float("inf") for seg, _ in segments]
+        s = max(0, bisect.bisect_right(firsts, since_ts) - 1)
+        for seg, size in segments[s:]:
+            b = max(0, bisect.bisect_right(seg.index_ts, since_ts) - 1)
+            for block in range(b, len(seg.index_off)):
+                for _, ts, msg in self._scan(seg, block, seg.block_end(block, size), needle=needle):
+                    if before_ts is not None and ts >= before_ts:
+                        return out
+                    if ts > since_ts and (to is None or msg["to"] == to):
+                        out.append(msg)
+                        if len(out) >= limit:
+                            return out
+        return out
+
+    def _read_before(self, before_ts, since_ts, limit, to=None):
+        """As últimas 'limit' mensagens com since_ts < ts < before_ts (paginação para trás)."""
+        blocks = []
+        found = 0
+        needle = field_needle("to", to) if to is not None else None
+        segments = self._snapshot()
+        for seg, size in reversed(segments):
+            if not seg.index_ts:
+                continue
+            if before_ts is None:
+                b = len(seg.index_ts) - 1
+            else:
+                b = bisect.bisect_left(seg.index_ts, before_ts) - 1
+            while b >= 0:
+                chunk = [msg for _, ts, msg in self._scan(seg, b, seg.block_end(b, size), needle=needle)
+                         if (before_ts is None or ts < before_ts) and (since_ts is None or ts > since_ts)
+                         and (to is None or msg["to"] == to)]
+                blocks.append(chunk)
+                found += len(chunk)
+                if found >= limit or (since_ts is not None and seg.index_ts[b] <= since_ts):
+                    return self._tail(blocks, limit)
+                b -= 1
+        return self._tail(blocks, limit)
+
+    @staticmethod
+    def _tail(blocks, limit):
+        out = []
+        for chunk in reversed(blocks):
+            out.extend(chunk)
+        return out[-limit:] if limit > 0 else []
+
+    def query(self, limit: int = 100, before_ts: float = None, since_ts: float = None, to: str = None):
+        """
+        Consulta paginada do histórico, em ordem cronológica.
+        - Sem cursores: as últimas 'limit' mensagens.
+        - 'before_ts': as últimas 'limit' mensagens anteriores a esse ts (página anterior).
+        - 'since_ts': as primeiras 'limit' mensagens posteriores a esse ts (sincronização para frente).
+        - 'to': só mensagens com esse destinatário (varre o disco; usado quando um índice
+          próprio, como o histórico por sala, não cobre a consulta).
+        Tenta primeiro o cache em RAM; só vai ao disco quando o cache não cobre a consulta.
+        """
+        if limit <= 0:
+            return []
+        if to is not None:
+            if since_ts is not None and before_ts is None:
+                return self._read_after(since_ts, None, limit, to)
+            return self._read_before(before_ts, since_ts, limit, to)
+        with self._lock:
+            cache = self._cache
+            n = len(cache)
+            cache_complete = n == self._count
+            oldest_ts = cache.ts(0) if n else None
+            head = []
+            if since_ts is not None and before_ts is None:
+                if cache_complete or (oldest_ts is not None and since_ts >= oldest_ts):
+                    lo = cache.index_after(since_ts)
+                    return cache.slice(lo, lo + limit)
+            else:
+                hi = n if before_ts is None else cache.index_before(before_ts)
+                lo = 0 if since_ts is None else cache.index_after(since_ts)
+                lo = max(lo, hi - limit)
+                head = cache.slice(lo, hi)
+                # lo > 0: o limite ou o 'since_ts' caiu dentro do cache, nada mais antigo interessa
+                if lo > 0 or len(head) >= limit or cache_complete:
+                    return head
+                if oldest_ts is not None:
+                    # o cache cobre só o fim da janela; o disco fornece o restante
+                    before_ts = oldest_ts if before_ts is None else min(before_ts, oldest_ts)
+        if since_ts is not None and before_ts is None:
+            return self._read_after(since_ts, None, limit)
+        return self._read_before(before_ts, since_ts, limit - len(head)) + head
+
+    def close(self):
+        if self.index is not None:
+            self.checkpoint_index()
+        with self._lock:
+            self._log_file.close()
+            self._idx_file.close()
+            for seg in self._segments:
+                seg.close_view()
@@ -0,0 +1,43 @@
+import logging
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limita mensagens de log repetidas: cada modelo de mensagem (ex: "falha ao enviar para %s")
+    passa no máximo 'burst' vezes a cada 'period' segundos. As suprimidas são contadas e
+    informadas na próxima mensagem do mesmo modelo que passar.
+    """
+    def __init__(self, burst: int = 10, period: float = 10.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.period:
+                start, count = now, 0
+            if count >= self.burst:
+                self._windows[key] = (start, count, suppressed + 1)
+                return False
+            self._windows[key] = (start, count + 1, 0)
+        if suppressed:
+            record.msg = f"{record.msg} [+{suppressed} mensagens semelhantes suprimidas]"
+        return True
+
+
+def configure_logging(level: str = "INFO", burst: int = 10, period: float = 10.0):
+    """Configura o log do servidor: nível, formato com horário e limite de repetição."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    handler.addFilter(RateLimitFilter(burst, period))
+    root = logging.getLogger("chat")
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    root.propagate = False
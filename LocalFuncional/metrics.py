@@ -0,0 +1,111 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+
+class Counter:
+    """Contador monotônico (thread-safe)."""
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+
+class Histogram:
+    """
+    Histograma de durações (segundos) com baldes em escala logarítmica: 10 µs, 20 µs, 40 µs ... ~20 s.
+    'observe' custa uma busca binária e um incremento; os percentis são estimados pelo limite
+    superior do balde onde caem (limitado ao máximo observado).
+    """
+    BOUNDS = [1e-5 * 2 ** k for k in range(22)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.BOUNDS, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, p: float):
+        target = self.count * p / 100
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if c and acc >= target:
+                return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            ms = lambda v: None if v is None else round(v * 1000, 3)
+            return {
+                "count": self.count,
+                "mean_ms": ms(self.total / self.count) if self.count else None,
+                "p50_ms": ms(self.percentile(50)),
+                "p95_ms": ms(self.percentile(95)),
+                "p99_ms": ms(self.percentile(99)),
+                "max_ms": ms(self.max) if self.count else None,
+            }
+
+
+class Metrics:
+    """
+    Registro de métricas do servidor.
+    1. Contadores e histogramas são atualizados no caminho quente (custo de um lock curto).
+    2. Medidores (gauges) são funções avaliadas só quando alguém pede um 'snapshot',
+       então não custam nada enquanto ninguém olha.
+    3. 'start_dump' grava periodicamente o snapshot em um arquivo JSON (opcional).
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def counter(self, name: str) -> Counter:
+        return self.counters.setdefault(name, Counter())
+
+    def histogram(self, name: str) -> Histogram:
+        return self.histograms.setdefault(name, Histogram())
+
+    def gauge(self, name: str, fn):
+        self.gauges[name] = fn
+
+    def snapshot(self):
+        gauges = {}
+        for name, fn in self.gauges.items():
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = f"erro: {e}"
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": {name: c.value for name, c in self.counters.items()},
+            "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+            "gauges": gauges,
+        }
+
+    def start_dump(self, path: str, interval: float = 10.0):
+        """Grava o snapshot em 'path' a cada 'interval' segundos (substituição atômica do arquivo)."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.snapshot(), f, indent=2)
+                os.replace(tmp, path)
+        threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
@@ -0,0 +1,50 @@
+import os
+from Pyro5 import config
+
+# tipos de servidor do Daemon Pyro5
+THREAD = "thread"        # uma thread do pool por conexão aberta (simples; cada cliente ocioso ocupa uma thread)
+MULTIPLEX = "multiplex"  # um único laço de eventos (select/poll) atende todas as conexões
+SERVER_TYPES = (THREAD, MULTIPLEX)
+
+
+def env(name, default, cast=str):
+    """Valor da variável de ambiente 'name' convertido por 'cast', ou 'default' se não existir."""
+    value = os.environ.get(name)
+    return default if value in (None, "") else cast(value)
+
+
+def add_network_arguments(parser, prefix: str = "CHAT_", host: str = "localhost", port: int = 0):
+    """
+    Acrescenta ao 'parser' as opções de rede do Daemon e do Name Server.
+    Cada opção tem como padrão uma variável de ambiente ('prefix' + HOST, PORT, SERVERTYPE, WORKERS;
+    o Name Server usa sempre CHAT_NS_HOST/CHAT_NS_PORT), e a linha de comando tem precedência.
+    """
+    parser.add_argument("--host", default=env(prefix + "HOST", host),
+                        help=f"endereço onde o Daemon escuta (env {prefix}HOST)")
+    parser.add_argument("--port", type=int, default=env(prefix + "PORT", port, int),
+                        help=f"porta do Daemon; 0 = escolhida pelo sistema (env {prefix}PORT)")
+    parser.add_argument("--servertype", choices=SERVER_TYPES, default=env(prefix + "SERVERTYPE", THREAD),
+                        help=f"'thread' (uma thread por conexão) ou 'multiplex' (laço de eventos) (env {prefix}SERVERTYPE)")
+    parser.add_argument("--workers", type=int, default=env(prefix + "WORKERS", config.THREADPOOL_SIZE, int),
+                        help=f"máximo de threads do Daemon no modo 'thread' (env {prefix}WORKERS)")
+    parser.add_argument("--ns-host", default=env("CHAT_NS_HOST", None),
+                        help="endereço do Name Server; padrão: busca automática (env CHAT_NS_HOST)")
+    parser.add_argument("--ns-port", type=int, default=env("CHAT_NS_PORT", None, int),
+                        help="porta do Name Server (env CHAT_NS_PORT)")
+
+
+def configure_daemon(servertype: str = THREAD, workers: int = None):
+    """
+    Ajusta a configuração global do Pyro5 antes de criar o Daemon.
+    No modo 'thread', cada conexão aberta ocupa uma thread do pool enquanto durar (no máximo
+    'workers'; as seguintes são recusadas). No modo 'multiplex', uma única thread atende
+    todas as conexões, então clientes ociosos não custam threads; em troca, nenhum método
+    remoto pode bloquear (as entregas por callback já correm nos pools de entrega). O modo
+    particionado (shards) repassa chamadas de forma síncrona e só funciona no modo 'thread'.
+    """
+    if servertype not in SERVER_TYPES:
+        raise ValueError(f"tipo de servidor inválido: {servertype}")
+    config.SERVERTYPE = servertype
+    if workers:
+        config.THREADPOOL_SIZE = workers
+        config.THREADPOOL_SIZE_MIN = min(config.THREADPOOL_SIZE_MIN, workers)
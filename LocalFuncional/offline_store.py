@@ -0,0 +1,168 @@
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+# registro no arquivo de um usuário: (instante em que foi guardada, tamanho) + payload codificado
+RECORD = struct.Struct("<dI")
+
+
+class _Box:
+    """Mensagens guardadas de um usuário: as mais antigas em memória, o excedente em disco."""
+    __slots__ = ("memory", "disk_count", "last_put")
+
+    def __init__(self):
+        self.memory = deque()
+        self.disk_count = 0
+        self.last_put = 0.0
+
+    def __len__(self):
+        return len(self.memory) + self.disk_count
+
+
+class OfflineStore:
+    """
+    Caixa de saída durável por usuário (store-and-forward) para quem não pôde receber.
+    1. 'put' guarda payloads já codificados: até 'memory_limit' por usuário ficam em memória;
+       o excedente vai para o arquivo do usuário em 'directory' (um arquivo por usuário).
+       Depois que algo foi para o disco, as mensagens seguintes também vão, preservando a ordem.
+    2. Cada usuário guarda no máximo 'max_messages'; as que chegam depois disso são descartadas.
+    3. 'take' devolve tudo, em ordem (memória e depois disco), e esvazia a caixa; mensagens
+       guardadas há mais de 'ttl' segundos são descartadas na entrega.
+    4. Uma thread apaga periodicamente as caixas sem mensagem nova há mais de 'ttl' segundos.
+    5. Ao reiniciar, os arquivos existentes são recarregados (a parte em memória se perde).
+    """
+    def __init__(self, directory: str = "offline", memory_limit: int = 256,
+                 max_messages: int = 10000, ttl: float = 24 * 3600.0):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._boxes = {}
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.expired = 0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        threading.Thread(target=self._purge_loop, name="offline-purge", daemon=True).start()
+
+    def _path(self, key: str) -> str:
+        # nomes de usuário viram hexadecimal: qualquer nome é um nome de arquivo válido
+        return os.path.join(self.directory, key.encode("utf-8").hex() + ".q")
+
+    def _recover(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".q"):
+                continue
+            try:
+                key = bytes.fromhex(name[:-2]).decode("utf-8")
+            except ValueError:
+                continue
+            box = _Box()
+            for stored_at, _ in self._read_file(self._path(key)):
+                box.disk_count += 1
+                box.last_put = stored_at
+            if box.disk_count:
+                self._boxes[key] = box
+
+    @staticmethod
+    def _read_file(path):
+        """Gera (instante, payload) do arquivo; um registro incompleto no fim (queda) é ignorado."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        off = 0
+        while off + RECORD.size <= len(data):
+            stored_at, length = RECORD.unpack_from(data, off)
+            start = off + RECORD.size
+            if start + length > len(data):
+                return
+            yield stored_at, data[start:start + length]
+            off = start + length
+
+    def put(self, key: str, payloads):
+        """Guarda os payloads para 'key', em ordem. Retorna quantos foram aceitos."""
+        now = time.time()
+        accepted = 0
+        with self._lock:
+            box = self._boxes.get(key)
+            if box is None:
+                box = self._boxes[key] = _Box()
+            spill = []
+            for payload in payloads:
+                if len(box) + len(spill) >= self.max_messages:
+                    self.dropped += 1
+                    continue
+                if box.disk_count or spill or len(box.memory) >= self.memory_limit:
+                    spill.append(RECORD.pack(now, len(payload)) + payload)
+                else:
+                    box.memory.append((now, payload))
+                accepted += 1
+            if spill:
+                with open(self._path(key), "ab") as f:
+                    f.write(b"".join(spill))
+                box.disk_count += len(spill)
+                self.spilled += len(spill)
+            box.last_put = now
+            self.stored += accepted
+        return accepted
+
+    def take(self, key: str):
+        """Retira e devolve, em ordem, os payloads guardados para 'key' (sem os expirados)."""
+        with self._lock:
+            box = self._boxes.pop(key, None)
+            if box is None:
+                return []
+            items = list(box.memory)
+            if box.disk_count:
+                path = self._path(key)
+                items.extend(self._read_file(path))
+                os.remove(path)
+        limit = time.time() - self.ttl
+        out = [payload for stored_at, payload in items if stored_at >= limit]
+        self.expired += len(items) - len(out)
+        return out
+
+    def pending(self, key: str = None) -> int:
+        """Mensagens guardadas para 'key', ou o total se 'key' for None."""
+        with self._lock:
+            if key is not None:
+                box = self._boxes.get(key)
+                return len(box) if box else 0
+            return sum(len(box) for box in self._boxes.values())
+
+    def __contains__(self, key):
+        return key in self._boxes
+
+    def keys(self):
+        """Usuários com mensagens guardadas."""
+        with self._lock:
+            return list(self._boxes)
+
+    def purge_expired(self):
+        """Apaga as caixas cuja mensagem mais nova foi guardada há mais de 'ttl' segundos."""
+        limit = time.time() - self.ttl
+        with self._lock:
+            for key in [k for k, box in self._boxes.items() if box.last_put < limit]:
+                box = self._boxes.pop(key)
+                self.expired += len(box)
+                if box.disk_count:
+                    os.remove(self._path(key))
+
+    def _purge_loop(self):
+        while True:
+            time.sleep(min(60.0, self.ttl))
+            self.purge_expired()
+
+    def stats(self):
+        with self._lock:
+            users = len(self._boxes)
+            in_memory = sum(len(box.memory) for box in self._boxes.values())
+            on_disk = sum(box.disk_count for box in self._boxes.values())
+        return {"users": users, "in_memory": in_memory, "on_disk": on_disk, "stored": self.stored,
+                "spilled": self.spilled, "dropped": self.dropped, "expired": self.expired}
@@ -0,0 +1,88 @@
+import logging
+import math
+import threading
+import time
+
+log = logging.getLogger("chat.presence")
+
+
+class LeaseManager:
+    """
+    Controle de presença por lease (concessão com prazo), expirada por uma roda de tempo (timing wheel).
+    1. 'grant' concede um lease de 'lease' segundos e agenda o cliente no slot do seu prazo.
+    2. 'renew' (chamado a cada heartbeat) só atualiza o prazo: custo O(1), sem mexer na roda.
+    3. A cada 'tick' segundos a thread da roda processa apenas o slot atual:
+       a. se o prazo do cliente já passou, o lease expirou e 'on_expire(key)' é chamado;
+       b. se o cliente renovou nesse meio tempo, ele é reagendado no slot do novo prazo.
+    4. 'revoke' retira o cliente (ex: saiu do chat); entradas antigas na roda são ignoradas.
+    A roda tem slots suficientes para cobrir um lease inteiro, então nenhum prazo dá "mais de uma volta".
+    """
+    def __init__(self, on_expire, lease: float = 15.0, tick: float = 1.0):
+        self.on_expire = on_expire
+        self.lease = lease
+        self.tick = tick
+        self._slots = [set() for _ in range(int(math.ceil(lease / tick)) + 2)]
+        self._deadlines = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.expired = 0
+        self._thread = threading.Thread(target=self._run, name="lease-wheel", daemon=True)
+        self._thread.start()
+
+    def _slot(self, deadline):
+        return self._slots[int(deadline / self.tick) % len(self._slots)]
+
+    def grant(self, key):
+        deadline = time.monotonic() + self.lease
+        with self._lock:
+            self._deadlines[key] = deadline
+            self._slot(deadline).add(key)
+
+    def renew(self, key) -> bool:
+        """Renova o lease de 'key'. Retorna False se 'key' não tem lease (expirado ou desconhecido)."""
+        with self._lock:
+            if key not in self._deadlines:
+                return False
+            self._deadlines[key] = time.monotonic() + self.lease
+            return True
+
+    def revoke(self, key):
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def remaining(self, key):
+        """Segundos até o lease de 'key' expirar (None se não houver lease)."""
+        with self._lock:
+            deadline = self._deadlines.get(key)
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _run(self):
+        current = int(time.monotonic() / self.tick)
+        while not self._stopped.wait(max(0.0, (current + 1) * self.tick - time.monotonic())):
+            now = time.monotonic()
+            expired = []
+            with self._lock:
+                # processa todos os slots que já terminaram (mais de um se a thread atrasou)
+                while (current + 1) * self.tick <= now:
+                    slot = self._slots[current % len(self._slots)]
+                    for key in list(slot):
+                        deadline = self._deadlines.get(key)
+                        if deadline is None:
+                            slot.discard(key)
+                        elif deadline <= now:
+                            slot.discard(key)
+                            del self._deadlines[key]
+                            expired.append(key)
+                        elif self._slot(deadline) is not slot:
+                            slot.discard(key)
+                            self._slot(deadline).add(key)
+                    current += 1
+            for key in expired:
+                self.expired += 1
+                try:
+                    self.on_expire(key)
+                except Exception as e:
+                    log.exception("erro ao expirar %s: %s", key, e)
+
+    def stop(self):
+        self._stopped.set()
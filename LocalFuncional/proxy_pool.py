@@ -0,0 +1,107 @@
+import threading
+from Pyro5.api import Proxy
+from Pyro5.errors import CommunicationError
+
+
+class _PoolEntry:
+    """Um proxy aquecido para uma URI de callback e o lock que garante uso exclusivo."""
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.lock = threading.Lock()
+        # removido do pool enquanto uma chamada estava em curso: quem chama fecha a conexão ao terminar
+        self.closed = False
+
+
+class ProxyPool:
+    """
+    Pool de proxies persistentes, indexado pela URI de callback do cliente.
+    Em vez de abrir uma conexão TCP nova para cada mensagem, cada cliente registrado
+    mantém um proxy já conectado, reutilizado por todas as threads de entrega.
+    1. 'call' obtém (ou cria, na primeira vez) o proxy da URI e o usa sob o lock da entrada.
+    2. Antes de cada chamada a thread atual reivindica a posse do proxy (regra do Pyro5).
+    3. Em 'CommunicationError' a conexão é liberada; a próxima chamada reconecta sozinha.
+    4. 'evict' fecha e remove o proxy quando o cliente sai do chat, sem esperar uma entrega
+       em curso para ele (quem está chamando fecha a conexão ao terminar).
+    """
+    def __init__(self, timeout: float = 5, serializer: str = None):
+        self.timeout = timeout
+        # serializador dos proxies do pool (None = o padrão global do Pyro5)
+        self.serializer = serializer
+        self._entries = {}
+        self._lock = threading.Lock()
+        # contadores de acerto/erro do pool (lidos por 'stats')
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    def _entry(self, uri):
+        with self._lock:
+            entry = self._entries.get(uri)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            proxy = Proxy(uri)
+            proxy._pyroTimeout = self.timeout  # tempo de espera curto para evitar travar o servidor
+            if self.serializer:
+                proxy._pyroSerializer = self.serializer
+            entry = self._entries[uri] = _PoolEntry(proxy)
+            return entry
+
+    def call(self, uri, method: str, *args):
+        """
+        Chama 'method(*args)' no objeto remoto da 'uri' usando o proxy do pool.
+        Se a comunicação falhar, a conexão é descartada e a exceção é repassada;
+        a reconexão acontece de forma preguiçosa na próxima chamada.
+        """
+        entry = self._entry(uri)
+        with entry.lock:
+            proxy = entry.proxy
+            proxy._pyroClaimOwnership()
+            try:
+                return getattr(proxy, method)(*args)
+            except CommunicationError:
+                # o lock da entrada é por URI: o contador do pool é protegido pelo lock do pool
+                with self._lock:
+                    self.reconnects += 1
+                proxy._pyroRelease()
+                raise
+            finally:
+                if entry.closed:
+                    proxy._pyroRelease()
+
+    def evict(self, uri):
+        """Remove e fecha o proxy associado à 'uri' (se existir)."""
+        with self._lock:
+            entry = self._entries.pop(uri, None)
+            if entry is None:
+                return
+            self.evictions += 1
+        entry.closed = True
+        # sem bloquear: quem chama 'evict' pode ser o laço de eventos do Daemon (modo multiplex)
+        # e uma entrega lenta em curso seguraria o lock por até 'timeout' segundos
+        if entry.lock.acquire(blocking=False):
+            try:
+                entry.proxy._pyroClaimOwnership()
+                entry.proxy._pyroRelease()
+            finally:
+                entry.lock.release()
+
+    def stats(self):
+        """Retorna os contadores do pool e o número de proxies aquecidos."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reconnects": self.reconnects,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        """Fecha todos os proxies do pool."""
+        with self._lock:
+            uris = list(self._entries)
+        for uri in uris:
+            self.evict(uri)
@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Balde de fichas: enche 'rate' fichas por segundo até 'capacity'.
+    Um custo maior que a capacidade (ex: broadcast para mais usuários que o balde comporta)
+    é aceito com o balde cheio e o deixa negativo: o remetente espera proporcionalmente.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float, now: float = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic() if now is None else now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Segundos até o balde poder pagar 'cost' (0 = pode agora). Atualiza o saldo."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        missing = min(cost, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, cost: float):
+        self.tokens -= cost
+
+
+class SenderLimiter:
+    """
+    Limite de envio por remetente, com dois baldes por usuário:
+    1. 'messages': toda mensagem custa 1 ficha ('rate' por segundo, rajadas de até 'burst').
+    2. 'fanout': broadcasts e mensagens de sala custam o número de destinatários no momento
+       do envio ('fanout_rate' entregas por segundo, até 'fanout_burst'), então um flood para
+       "ALL" se esgota muito antes de um flood de mensagens privadas.
+    'admit' só cobra se os dois baldes puderem pagar; senão devolve em quantos segundos o
+    remetente pode tentar de novo. Os baldes são criados no primeiro envio e apagados em 'forget'.
+    """
+    def __init__(self, rate: float = 20.0, burst: float = 40.0,
+                 fanout_rate: float = 2000.0, fanout_burst: float = 5000.0):
+        self.rate = rate
+        self.burst = burst
+        self.fanout_rate = fanout_rate
+        self.fanout_burst = fanout_burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def admit(self, sender: str, fanout: int = 0) -> float:
+        """Cobra a mensagem de 'sender' (e 'fanout' entregas, se > 0). Retorna 0 ou o retry_after."""
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._buckets.get(sender)
+            if buckets is None:
+                buckets = self._buckets[sender] = (TokenBucket(self.rate, self.burst, now),
+                                                   TokenBucket(self.fanout_rate, self.fanout_burst, now))
+            messages, deliveries = buckets
+            wait = messages.wait_time(1, now)
+            if fanout > 0:
+                wait = max(wait, deliveries.wait_time(fanout, now))
+            if wait > 0:
+                self.rejected += 1
+                return wait
+            messages.take(1)
+            if fanout > 0:
+                deliveries.take(fanout)
+            return 0.0
+
+    def forget(self, sender: str):
+        with self._lock:
+            self._buckets.pop(sender, None)
+
+    def stats(self):
+        with self._lock:
+            return {"senders": len(self._buckets), "rejected": self.rejected}
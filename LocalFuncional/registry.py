@@ -0,0 +1,122 @@
+import threading
+import uuid
+from collections import namedtuple, deque
+from itertools import islice
+from types import MappingProxyType
+
+# retrato imutável do registro: 'version' cresce a cada entrada/saída de cliente
+Snapshot = namedtuple("Snapshot", "version clients")
+# uma mudança de presença: a versão que ela criou, o nome e se o cliente entrou (True) ou saiu
+PresenceChange = namedtuple("PresenceChange", "version name joined")
+# resposta de 'presence_delta': com 'full', 'users' traz o retrato completo; senão 'joined'/'left' o delta
+PresenceDelta = namedtuple("PresenceDelta", "version full users joined left")
+
+
+class ClientRegistry:
+    """
+    Registro de clientes com cópia na escrita (copy-on-write).
+    1. Leitores (broadcast, busca de destinatário, lista de clientes) pegam o retrato atual
+       com uma única leitura de atributo, sem lock, e podem iterá-lo à vontade: ele nunca muda.
+    2. Escritores ('add'/'remove') se serializam em um lock próprio, copiam o dicionário,
+       aplicam a mudança e publicam um novo retrato com a versão seguinte.
+    Entradas e saídas são raras perto de envios, então pagar a cópia na escrita deixa o
+    caminho de leitura livre de disputa.
+    3. Cada mudança fica também em um log das últimas 'changelog' mudanças, para responder
+       "o que mudou desde a versão v" ('changes_since') sem mandar a lista inteira. A 'epoch'
+       (sorteada a cada início do servidor) distingue versões de execuções diferentes.
+    4. 'on_change(change)' é chamado sob o lock do registro, então os observadores recebem as
+       mudanças exatamente na ordem das versões.
+    """
+    def __init__(self, changelog: int = 10000, on_change=None):
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot(0, MappingProxyType({}))
+        self._changes = deque(maxlen=changelog)
+        self.epoch = uuid.uuid4().hex[:12]
+        self.on_change = on_change
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def add(self, name, info) -> bool:
+        """Publica um retrato com 'name' -> 'info'. Retorna False se o nome já existe."""
+        with self._lock:
+            current = self._snapshot
+            if name in current.clients:
+                return False
+            clients = dict(current.clients)
+            clients[name] = info
+            self._snapshot = Snapshot(current.version + 1, MappingProxyType(clients))
+            self._record(PresenceChange(current.version + 1, name, True))
+            return True
+
+    def remove(self, name):
+        """Publica um retrato sem 'name'. Retorna a entrada removida (ou None se não existia)."""
+        with self._lock:
+            current = self._snapshot
+            if name not in current.clients:
+                return None
+            clients = dict(current.clients)
+            info = clients.pop(name)
+            self._snapshot = Snapshot(current.version + 1, MappingProxyType(clients))
+            self._record(PresenceChange(current.version + 1, name, False))
+            return info
+
+    def _record(self, change):
+        # chamado com self._lock adquirido
+        self._changes.append(change)
+        if self.on_change is not None:
+            self.on_change(change)
+
+    def changes_since(self, version: int):
+        """
+        Mudanças depois de 'version', em ordem, como (versão atual, [PresenceChange, ...]).
+        Retorna None se o log não cobre mais o intervalo (ou a versão é de outra execução).
+        """
+        with self._lock:
+            current = self._snapshot.version
+            if version > current or version < 0:
+                return None
+            if version == current:
+                return current, []
+            # as versões no log são consecutivas: a mudança 'version + 1' está em uma posição conhecida
+            oldest = self._changes[0].version
+            if version + 1 < oldest:
+                return None
+            return current, list(islice(self._changes, version + 1 - oldest, None))
+
+    def presence_delta(self, version: int = None, epoch: str = None) -> PresenceDelta:
+        """
+        Presença desde 'version' (da execução 'epoch'), base do 'presence_since' dos servidores.
+        1. Se o log cobre o intervalo, retorna só o delta, já compactado: quem entrou e saiu
+           dentro do intervalo aparece só em 'left'.
+        2. Sem versão, com outra 'epoch' (servidor reiniciado) ou com o intervalo fora do log,
+           retorna o retrato completo em 'users' (full=True).
+        """
+        delta = None
+        if version is not None and epoch == self.epoch:
+            delta = self.changes_since(version)
+        if delta is None:
+            snapshot = self._snapshot
+            return PresenceDelta(snapshot.version, True, list(snapshot.clients), None, None)
+        current, changes = delta
+        last = {}
+        for change in changes:
+            last[change.name] = change.joined
+        return PresenceDelta(current, False, None, [name for name, joined in last.items() if joined],
+                             [name for name, joined in last.items() if not joined])
+
+    def get(self, name, default=None):
+        return self._snapshot.clients.get(name, default)
+
+    def names(self):
+        return list(self._snapshot.clients)
+
+    def __contains__(self, name):
+        return name in self._snapshot.clients
+
+    def __len__(self):
+        return len(self._snapshot.clients)
@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from Pyro5.api import Proxy, locate_ns
+from Pyro5.errors import CommunicationError, NamingError
+from proxy_pool import ProxyPool
+from delivery import DeliveryEngine, DROP_OLDEST
+from codec import CALLBACK_SERIALIZER
+
+log = logging.getLogger("chat.replication")
+
+# tipos de entrada do fluxo de replicação (primário -> standby)
+REPL_MESSAGE = "msg"    # mensagem gravada no histórico; dados = payload codificado
+REPL_JOIN = "join"      # cliente registrado; dados = [nome, URI do callback]
+REPL_LEAVE = "leave"    # cliente saiu; dados = nome
+REPL_PING = "ping"      # heartbeat do primário; sem dados
+
+# papéis de um ChatServer
+PRIMARY = "primary"
+STANDBY = "standby"
+
+# sufixo do nome com que o standby se anuncia no Name Server enquanto espera ("chat.server.standby")
+STANDBY_SUFFIX = ".standby"
+
+
+class Replicator:
+    """
+    Lado primário da replicação: envia ao standby, em ordem, as mudanças de estado.
+    1. 'publish(kind, data)' numera a entrada (seq) e a coloca na fila do standby; a seq é
+       atribuída sob um lock, então a ordem da fila é a ordem das seqs.
+    2. Um único worker (DeliveryEngine) junta as entradas em chamadas 'replicate(entries)',
+       cada entrada [seq, instante do envio, tipo, dados].
+    3. A cada 'interval' segundos entra um REPL_PING: o standby mede o atraso mesmo sem tráfego
+       e, se os pings param, conclui que o primário caiu.
+    4. Sem standby conectado, 'publish' não faz nada. Numa falha ao enviar, o standby é
+       desligado; ele volta com 'attach' e ressincroniza o que perdeu.
+    """
+    def __init__(self, interval: float = 0.5, high_water: int = 100000):
+        self.interval = interval
+        self.standby_uri = None
+        self.seq = 0
+        self.shipped = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self.pool = ProxyPool(timeout=max(1.0, 4 * interval), serializer=CALLBACK_SERIALIZER)
+        self.engine = DeliveryEngine(self._ship, workers=1, high_water=high_water, overflow=DROP_OLDEST,
+                                     batch_size=512, batch_window=0.002)
+        threading.Thread(target=self._ping_loop, name="replication-ping", daemon=True).start()
+
+    def attach(self, uri: str) -> int:
+        """Passa a replicar para 'uri'. Retorna a seq atual: o standby espera a seguinte."""
+        with self._lock:
+            old, self.standby_uri = self.standby_uri, uri
+            # o que estava na fila é de antes do retrato que o standby vai pedir
+            self.engine.discard(STANDBY)
+            seq = self.seq
+        if old is not None and old != uri:
+            self.pool.evict(old)
+        return seq
+
+    def detach(self, uri: str):
+        """Desliga o standby 'uri' (se ainda for o atual)."""
+        with self._lock:
+            if self.standby_uri != uri:
+                return
+            self.standby_uri = None
+            self.engine.discard(STANDBY)
+        self.pool.evict(uri)
+
+    def publish(self, kind: str, data=None):
+        """Enfileira uma entrada para o standby (não bloqueia)."""
+        if self.standby_uri is None:
+            return
+        with self._lock:
+            self.seq += 1
+            self.engine.enqueue(STANDBY, [self.seq, time.time(), kind, data])
+
+    def _ship(self, key, entries):
+        uri = self.standby_uri
+        if uri is None:
+            return
+        try:
+            self.pool.call(uri, "replicate", entries)
+            self.shipped += len(entries)
+        except Exception as e:
+            self.failures += 1
+            log.warning("standby %s indisponível (%s); replicação suspensa até ele voltar", uri, e)
+            self.detach(uri)
+
+    def _ping_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.publish(REPL_PING)
+
+    def stats(self):
+        return {"standby": self.standby_uri, "seq": self.seq, "queued": self.engine.pending,
+                "shipped": self.shipped, "failures": self.failures}
+
+
+class Follower:
+    """
+    Lado standby: acompanha o primário registrado como 'primary_name' e assume o lugar dele.
+    1. Uma thread chama 'attach_standby' no primário e, com a resposta, 'resync(primary, r)'
+       (fornecido pelo servidor) recarrega o estado; as entradas que chegam nesse meio-tempo
+       ficam guardadas e são aplicadas depois, em ordem.
+    2. 'receive(entries)' aplica as entradas na ordem das seqs com 'apply(kind, data)'; uma seq
+       faltando (entradas descartadas pelo primário) marca o standby para ressincronizar.
+    3. O atraso de cada entrada (agora - instante do envio no primário) vai para 'on_lag(s)';
+       os relógios são comparáveis só na mesma máquina (ou com relógios sincronizados).
+    4. Sem notícias do primário por 'failover_timeout' segundos, tenta reconectar; se o primário
+       não responder, chama 'promote()' e registra 'own_uri' no Name Server como 'primary_name'.
+       Um standby que nunca chegou a sincronizar não assume (não há estado para servir).
+    5. Enquanto espera, o standby fica no Name Server como 'primary_name' + STANDBY_SUFFIX
+       (para monitoração); o nome é removido quando ele assume.
+    """
+    def __init__(self, own_uri: str, apply, resync, promote, primary_name: str,
+                 ns_host: str = None, ns_port: int = None, failover_timeout: float = 2.0,
+                 check_interval: float = 0.1, on_lag=None):
+        self.own_uri = str(own_uri)
+        self.apply = apply
+        self.resync = resync
+        self.promote = promote
+        self.primary_name = primary_name
+        self.ns_host = ns_host
+        self.ns_port = ns_port
+        self.failover_timeout = failover_timeout
+        self.check_interval = check_interval
+        self.on_lag = on_lag
+        self.primary_uri = None
+        self.applied = 0
+        self.synced = False
+        self.stale = True
+        self.resyncs = 0
+        self.promoted = False
+        self.failover_s = None
+        self.last_heard = time.monotonic()
+        self._syncing = False
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        locate_ns(host=self.ns_host, port=self.ns_port).register(self.primary_name + STANDBY_SUFFIX, self.own_uri)
+        threading.Thread(target=self._watch, name="replication-follower", daemon=True).start()
+
+    def receive(self, entries):
+        """Entradas enviadas pelo primário ('replicate')."""
+        with self._lock:
+            self.last_heard = time.monotonic()
+            if self.promoted:
+                return
+            if self._syncing:
+                self._buffer.extend(entries)
+                return
+            self._apply_entries(entries)
+
+    def _apply_entries(self, entries):
+        # chamado com self._lock adquirido
+        now = time.time()
+        for seq, sent_at, kind, data in entries:
+            if self.stale or seq <= self.applied:
+                continue
+            if seq != self.applied + 1:
+                log.warning("replicação com buraco (esperava %d, veio %d); ressincronizando",
+                            self.applied + 1, seq)
+                self.stale = True
+                return
+            self.applied = seq
+            if self.on_lag is not None:
+                self.on_lag(now - sent_at)
+            if kind != REPL_PING:
+                self.apply(kind, data)
+
+    def _watch(self):
+        while not self.promoted:
+            silent = time.monotonic() - self.last_heard
+            if self.stale or silent > self.failover_timeout:
+                if not self._sync() and self.synced and time.monotonic() - self.last_heard > self.failover_timeout:
+                    self._promote()
+                    return
+            time.sleep(self.check_interval)
+
+    def _sync(self) -> bool:
+        """Conecta-se ao primário e ressincroniza. Retorna False se o primário não respondeu."""
+        try:
+            uri = locate_ns(host=self.ns_host, port=self.ns_port).lookup(self.primary_name)
+            if str(uri) == self.own_uri:
+                # alguém já registrou este servidor no lugar do primário
+                self._promote()
+                return True
+            with Proxy(uri) as primary:
+                primary._pyroTimeout = self.failover_timeout
+                with self._lock:
+                    self._syncing = True
+                    self._buffer = []
+                r = primary.attach_standby(self.own_uri)
+                if not r.get("ok"):
+                    log.warning("%s recusou o standby: %s", uri, r.get("error"))
+                    with self._lock:
+                        self._syncing = False
+                    return True
+                self.resync(primary, r)
+        except (CommunicationError, NamingError) as e:
+            with self._lock:
+                self._syncing = False
+            log.warning("primário '%s' sem resposta: %s", self.primary_name, e)
+            return False
+        except Exception as e:
+            # o primário respondeu, mas a ressincronização falhou: tenta de novo na próxima volta
+            with self._lock:
+                self._syncing = False
+            log.exception("erro ao ressincronizar com '%s': %s", self.primary_name, e)
+            return True
+        with self._lock:
+            self.applied = r["seq"]
+            self.stale = False
+            self._syncing = False
+            self.last_heard = time.monotonic()
+            buffered, self._buffer = self._buffer, []
+            self._apply_entries(buffered)
+        if not self.synced or self.primary_uri != str(uri):
+            log.info("acompanhando o primário %s (seq %d)", uri, r["seq"])
+        self.primary_uri = str(uri)
+        self.synced = True
+        self.resyncs += 1
+        return True
+
+    def _promote(self):
+        """Assume o papel de primário e toma o nome do primário no Name Server."""
+        with self._lock:
+            if self.promoted:
+                return
+            self.promoted = True
+            silent = time.monotonic() - self.last_heard
+        self.promote()
+        while True:
+            try:
+                ns = locate_ns(host=self.ns_host, port=self.ns_port)
+                ns.register(self.primary_name, self.own_uri)
+                ns.remove(self.primary_name + STANDBY_SUFFIX)
+                break
+            except (CommunicationError, NamingError) as e:
+                log.warning("Name Server indisponível ao assumir '%s': %s", self.primary_name, e)
+                time.sleep(self.check_interval)
+        self.failover_s = time.monotonic() - self.last_heard
+        log.warning("primário sem resposta há %.2fs: este servidor assumiu '%s' (%.2fs após o último contato)",
+                    silent, self.primary_name, self.failover_s)
+
+    def stats(self):
+        return {"primary": self.primary_uri, "applied": self.applied, "synced": self.synced,
+                "stale": self.stale, "resyncs": self.resyncs, "promoted": self.promoted,
+                "silent_s": round(time.monotonic() - self.last_heard, 3),
+                "failover_s": None if self.failover_s is None else round(self.failover_s, 3)}
@@ -0,0 +1,39 @@
+"""
+Sobe, na máquina local, um Name Server e N shards do ChatServer (um processo cada).
+Útil para testar o modo particionado: os clientes localizam o seu shard pelo Name Server.
+
+Uso: python run_shards.py [N] [host]
+Ctrl+C encerra todos os processos.
+"""
+import subprocess
+import sys
+import time
+
+NS_PORT = 9090
+
+
+def main():
+    shards = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    host = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+    procs = [subprocess.Popen([sys.executable, "-m", "Pyro5.nameserver", "-n", host, "-p", str(NS_PORT)])]
+    time.sleep(1.0)  # espera o Name Server aceitar conexões
+    try:
+        for i in range(shards):
+            procs.append(subprocess.Popen([
+                sys.executable, "server.py", "--host", host, "--ns-host", host, "--ns-port", str(NS_PORT),
+                "--shard", str(i), "--shards", str(shards),
+            ]))
+        print(f"[run_shards] Name Server em {host}:{NS_PORT} e {shards} shards em execução (Ctrl+C para sair)")
+        while all(p.poll() is None for p in procs):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+        for p in procs:
+            p.wait()
+
+
+if __name__ == "__main__":
+    main()
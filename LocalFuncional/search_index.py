@@ -0,0 +1,160 @@
+import bisect
+import marshal
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+
+TOKEN_RE = re.compile(r"\w+")
+MIN_TOKEN_LEN = 2
+CHECKPOINT_VERSION = 1
+
+
+def tokenize(text: str):
+    """Palavras do texto em minúsculas e sem acentos ("Ação" e "acao" casam), sem repetição."""
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return {t for t in TOKEN_RE.findall(folded) if len(t) >= MIN_TOKEN_LEN}
+
+
+class InvertedIndex:
+    """
+    Índice invertido do histórico para busca de texto.
+    1. Cada mensagem é identificada pelo seu número de sequência no log (seq).
+    2. Cada palavra do texto aponta para uma lista de postagens: array('Q') com os seqs das
+       mensagens que a contêm. Remetente e destinatário entram como termos especiais
+       ("from:<nome>" e "to:<nome>"), filtrados pelo mesmo mecanismo.
+    3. 'add' é chamado em ordem crescente de seq (sob o lock do log), então as listas já
+       nascem ordenadas e a atualização custa um append por termo.
+    4. 'search' intersecta as listas de trás para frente, partindo da menor: os resultados
+       saem do mais recente para o mais antigo e a busca para ao juntar 'limit' mensagens.
+       Os timestamps (array('d') por seq) permitem cortar a busca em 'since_ts'.
+    5. Com 'max_messages', só as últimas 'max_messages' mensagens ficam indexadas: quando o índice
+       passa desse número em um quarto, as postagens mais antigas são cortadas de uma vez.
+    6. 'dump' e 'load' salvam e restauram o índice inteiro (checkpoint, ver HistoryLog).
+    """
+    def __init__(self, max_messages: int = 200000):
+        self.max_messages = max_messages
+        self._postings = {}
+        self._ts = array("d")
+        self._base = None
+        self._lock = threading.Lock()
+
+    @property
+    def next_seq(self):
+        """Seq esperado na próxima 'add' (None com o índice vazio)."""
+        with self._lock:
+            return None if self._base is None else self._base + len(self._ts)
+
+    def add(self, seq: int, msg: dict):
+        terms = tokenize(msg["text"])
+        terms.add("from:" + msg["from"])
+        terms.add("to:" + msg["to"])
+        with self._lock:
+            if self._base is None:
+                self._base = seq
+            self._ts.append(msg["ts"])
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array("Q")
+                postings.append(seq)
+            if self.max_messages and len(self._ts) > self.max_messages + self.max_messages // 4:
+                self._trim(self._base + len(self._ts) - self.max_messages)
+
+    def _trim(self, first_seq):
+        """
+        Descarta as postagens com seq menor que 'first_seq' (chamado com o lock). As listas
+        cortadas são trocadas por cópias, não alteradas: uma busca em curso segue com as antigas.
+        """
+        self._ts = self._ts[first_seq - self._base:]
+        self._base = first_seq
+        postings = {}
+        for term, seqs in self._postings.items():
+            i = bisect.bisect_left(seqs, first_seq)
+            if i < len(seqs):
+                postings[term] = seqs[i:] if i else seqs
+        self._postings = postings
+
+    def reset(self):
+        with self._lock:
+            self._postings = {}
+            self._ts = array("d")
+            self._base = None
+
+    def dump(self) -> bytes:
+        """Retrato do índice para 'load' (copiado sob o lock; a serialização roda fora dele)."""
+        with self._lock:
+            state = (CHECKPOINT_VERSION, self._base, self._ts.tobytes(),
+                     {term: seqs.tobytes() for term, seqs in self._postings.items()})
+        return marshal.dumps(state)
+
+    def load(self, data: bytes):
+        """Restaura um retrato de 'dump'. Retorna o próximo seq esperado (None se o retrato não serve)."""
+        try:
+            version, base, ts, postings = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+        if version != CHECKPOINT_VERSION or base is None:
+            return None
+        with self._lock:
+            self._base = base
+            self._ts = array("d", ts)
+            self._postings = {term: array("Q", seqs) for term, seqs in postings.items()}
+            if self.max_messages and len(self._ts) > self.max_messages:
+                self._trim(self._base + len(self._ts) - self.max_messages)
+            return self._base + len(self._ts)
+
+    def __len__(self):
+        return len(self._ts)
+
+    def search(self, query: str = "", sender: str = None, recipient: str = None,
+               since_ts: float = None, limit: int = 50):
+        """Seqs das mensagens que contêm todas as palavras de 'query' (e casam os filtros), mais recentes primeiro."""
+        terms = tokenize(query or "")
+        if sender is not None:
+            terms.add("from:" + sender)
+        if recipient is not None:
+            terms.add("to:" + recipient)
+        if not terms or limit <= 0:
+            return []
+        # sob o lock só se copiam as referências e os tamanhos atuais das listas; como elas
+        # apenas crescem (o corte de 'max_messages' as troca por cópias), a interseção roda sem
+        # bloquear quem está gravando no histórico
+        with self._lock:
+            lists = []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    return []
+                lists.append((postings, len(postings)))
+            min_seq = 0
+            if since_ts is not None:
+                min_seq = self._base + bisect.bisect_right(self._ts, since_ts)
+        lists.sort(key=lambda pl: pl[1])
+        (shortest, n), others = lists[0], lists[1:]
+        out = []
+        for i in range(n - 1, -1, -1):
+            seq = shortest[i]
+            if seq < min_seq:
+                break
+            if all(self._contains(other, size, seq) for other, size in others):
+                out.append(seq)
+                if len(out) >= limit:
+                    break
+        return out
+
+    @staticmethod
+    def _contains(postings, size, seq):
+        i = bisect.bisect_left(postings, seq, 0, size)
+        return i < size and postings[i] == seq
+
+    def stats(self):
+        """Tamanho do índice: termos, postagens e bytes ocupados (listas, termos e dicionário)."""
+        with self._lock:
+            postings = sum(len(p) for p in self._postings.values())
+            nbytes = (sys.getsizeof(self._postings) + sys.getsizeof(self._ts)
+                      + sum(sys.getsizeof(t) + sys.getsizeof(p) for t, p in self._postings.items()))
+            return {"messages": len(self._ts), "first_seq": self._base, "terms": len(self._postings),
+                    "postings": postings, "bytes": nbytes}
@@ -1,125 +1,1076 @@
+from Pyro5 import config
 from Pyro5.api import expose, behavior, Daemon, locate_ns
+from Pyro5.errors import CommunicationError, NamingError
+import argparse
+import logging
+import os
 import threading
 import time
+import serpent
+from proxy_pool import ProxyPool
+from delivery import DeliveryEngine, DISCONNECT, DROP_OLDEST
+from codec import (CALLBACK_SERIALIZER, COMPRESS_THRESHOLD, COMPRESSION_ZLIB, FrameCache, WireFormat,
+                   decode_message, message_fields, negotiate)
+from history_log import HistoryLog
+from columnar import ColumnarHistory
+from presence import LeaseManager
+from sharding import ShardRelay, SERVER_NAME
+from metrics import Metrics
+from registry import ClientRegistry
+from search_index import InvertedIndex
+from offline_store import OfflineStore
+from ratelimit import SenderLimiter
+from slow_consumers import ConsumerTracker, SLOW_BATCH, SLOW_DROP_PUBLIC, SLOW_DISCONNECT, SLOW_POLICIES
+from logs import configure_logging
+from netconfig import add_network_arguments, configure_daemon, MULTIPLEX
+from replication import Replicator, Follower, REPL_MESSAGE, REPL_JOIN, REPL_LEAVE, PRIMARY, STANDBY
+from attachments import AttachmentStore
+
+log = logging.getLogger("chat.server")
+
+# formas de entrega suportadas por um callback, da mais eficiente para a mais antiga
+CALLBACK_COMPACT = "compact"  # receive_compact(frames): formato compacto negociado no registro
+CALLBACK_ENCODED = "encoded"  # receive_encoded(payloads): mensagens já codificadas uma única vez
+CALLBACK_BATCH = "batch"      # receive_batch(msgs)
+CALLBACK_SINGLE = "single"    # receive(msg)
+# forma seguinte quando o callback não expõe o método da atual (AttributeError)
+CALLBACK_FALLBACK = {"receive_compact": CALLBACK_ENCODED, "receive_encoded": CALLBACK_BATCH,
+                     "receive_batch": CALLBACK_SINGLE}
+
+# mensagens por chamada 'get_history' quando um standby copia o histórico do primário
+RESYNC_PAGE = 1000
 
 @expose
 @behavior(instance_mode="single")
 class ChatServer:
-    def __init__(self):
+    def __init__(self, delivery_workers: int = 8, queue_high_water: int = 1000, overflow_policy: str = DISCONNECT,
+                 batch_size: int = 64, batch_window: float = 0.005,
+                 history_dir: str = "history", history_cache: int = 10000,
+                 lease_seconds: float = 15.0, heartbeat_interval: float = 5.0,
+                 relay: ShardRelay = None, stats_file: str = None, stats_interval: float = 10.0,
+                 search_index: bool = True, search_max: int = 200000, offline_dir: str = "offline", offline_memory: int = 256,
+                 offline_max: int = 10000, offline_ttl: float = 24 * 3600.0,
+                 rate_limit: float = 20.0, rate_burst: float = 40.0, fanout_rate: float = 2000.0,
+                 fanout_burst: float = 5000.0, admission_depth: int = 100000, admission_retry: float = 1.0,
+                 slow_policy: str = SLOW_BATCH, slow_threshold: float = 0.5, slow_batch_factor: int = 4,
+                 presence_changelog: int = 10000, announce_presence: bool = True,
+                 standby: bool = False, replication_interval: float = 0.5, failover_timeout: float = 2.0,
+                 attachments_dir: str = "attachments", attachment_chunk: int = 256 * 1024,
+                 attachment_max_size: int = 64 * 1024 * 1024, compress_threshold: int = COMPRESS_THRESHOLD):
         # clientes: nome -> {'uri': uri_str, 'last_seen': timestamp}
         # uri (o endereço remoto do objeto callback do cliente) e last_seen (timestamp da última atualização/registro)
-        self.clients = {    }
+        # O registro publica um retrato imutável e versionado a cada entrada/saída: broadcasts
+        # e buscas de destinatário leem o retrato sem lock nenhum.
+        # As últimas 'presence_changelog' entradas/saídas ficam registradas para 'presence_since',
+        # e cada uma é publicada (em ordem de versão) para os inscritos em 'subscribe_presence'.
+        # Com 'announce_presence=False', entradas/saídas não viram mais mensagens SYSTEM no chat.
+        self.clients = ClientRegistry(changelog=presence_changelog, on_change=self._publish_presence)
+        self.announce_presence = announce_presence
+
+        # replicação primário -> standby: cada mensagem gravada no histórico e cada entrada/saída
+        # de cliente vira uma entrada numerada, enviada em ordem ao standby conectado (se houver),
+        # junto com um ping a cada 'replication_interval' segundos. Com 'standby=True' este servidor
+        # começa como standby: recusa clientes, aplica o que o primário envia e, se o primário
+        # ficar 'failover_timeout' segundos sem responder, assume o nome dele no Name Server ('follow').
+        self.role = STANDBY if standby else PRIMARY
+        self.replication = Replicator(interval=replication_interval)
+        self.follower = None
+        self.failover_timeout = failover_timeout
+
+        # histórico durável: log append-only em disco ('history_dir'), com índice esparso
+        # por timestamp e as últimas 'history_cache' mensagens {from, to, text, ts} em memória.
+        # Tem seu próprio lock, então ler/gravar o histórico não disputa 'self.lock'.
+        # O índice invertido (palavra -> seqs das mensagens) é atualizado a cada gravação e
+        # atende 'search_history' nas últimas 'search_max' mensagens; com 'search_index=False' a
+        # busca fica desativada. O log salva o índice periodicamente e, ao reiniciar, relê só a cauda.
+        self.search = InvertedIndex(max_messages=search_max) if search_index else None
+        self.history = HistoryLog(history_dir, cache_size=history_cache, index=self.search,
+                                  on_append=self._replicate_message)
 
-        # histórico como lista de dicionários: {from, to, text, ts}
-        # Armazena todas as mensagens
-        self.history = [    ]
+        # salas: índice sala -> membros e índice reverso membro -> salas, para que o
+        # fanout de uma mensagem de sala custe o tamanho da sala, não o total de usuários.
+        # Cada sala guarda também uma janela das suas últimas 'history_cache' mensagens.
+        self.rooms = {}
+        self.member_rooms = {}
+        self.room_history = {}
+        self.history_cache = history_cache
+        # serializa gravação no log + janela da sala, mantendo os timestamps da janela em ordem
+        self.room_history_lock = threading.Lock()
 
-        # Bloqueio para evitar condições de corrida
+        # Bloqueio dos índices de salas (a presença tem o lock do registro e o histórico, o seu)
         self.lock = threading.Lock()
 
-    def register_client(self, name: str, callback_uri: str):
+        # proxies persistentes para os callbacks dos clientes (um por URI); o marshal
+        # envia os payloads pré-codificados como bytes, sem nova codificação por destinatário
+        self.pool = ProxyPool(timeout=5, serializer=CALLBACK_SERIALIZER)
+
+        # pool fixo de threads de entrega com uma fila ordenada por destinatário;
+        # um cliente cuja fila passa de 'queue_high_water' sofre a 'overflow_policy';
+        # mensagens para o mesmo cliente dentro de 'batch_window' segundos (até 'batch_size')
+        # seguem juntas em uma única chamada 'receive_batch'
+        self.delivery = DeliveryEngine(
+            self._deliver_batch,
+            workers=delivery_workers,
+            high_water=queue_high_water,
+            overflow=overflow_policy,
+            on_overflow=self._on_queue_overflow,
+            batch_size=batch_size,
+            batch_window=batch_window,
+        )
+
+        # eventos de presença estruturados: inscrito -> URI do callback; cada evento vai para a fila
+        # do inscrito em um motor de entrega próprio (eventos próximos seguem juntos em uma chamada
+        # 'presence_update(events)'). Se a fila estourar, os mais antigos são descartados e o
+        # cliente, ao ver o buraco na sequência de versões, pede o delta com 'presence_since'.
+        self.presence_subscribers = {}
+        self.presence_feed = DeliveryEngine(
+            self._deliver_presence,
+            workers=2,
+            high_water=queue_high_water,
+            overflow=DROP_OLDEST,
+            batch_size=256,
+            batch_window=0.05,
+        )
+
+        # forma de entrega de cada callback: uri -> CALLBACK_*; clientes antigos são
+        # rebaixados para CALLBACK_BATCH ou CALLBACK_SINGLE na primeira falha
+        self.callback_modes = {}
+
+        # formato compacto: callbacks que o negociaram no registro (uri -> WireFormat) recebem
+        # frames posicionais ('receive_compact'), comprimidos acima de 'compress_threshold' bytes.
+        # Cada frame é montado uma vez por formato e reaproveitado entre destinatários (FrameCache).
+        self.wire_formats = {}
+        self.frames = FrameCache()
+        self.compress_threshold = compress_threshold
+        self.default_wire = WireFormat("marshal", COMPRESSION_ZLIB, compress_threshold)
+
+        # presença por lease: cada cliente deve chamar 'heartbeat' a cada 'heartbeat_interval'
+        # segundos; quem ficar 'lease_seconds' sem renovar é removido pela roda de tempo,
+        # antes que um broadcast perca tempo (timeout) tentando entregar para ele
+        self.heartbeat_interval = heartbeat_interval
+        self.leases = LeaseManager(self._on_lease_expired, lease=lease_seconds, tick=min(1.0, lease_seconds / 4))
+
+        # modo particionado: ligação com os outros shards (None = servidor único). Os repasses
+        # entre shards são chamadas síncronas, incompatíveis com o Daemon 'multiplex' (ver ShardRelay).
+        if relay is not None and config.SERVERTYPE == MULTIPLEX:
+            raise ValueError("o modo particionado não funciona com o servidor 'multiplex'")
+        self.relay = relay
+
+        # store-and-forward: mensagens que não puderam ser entregues (falha de comunicação ou
+        # lease expirado) ficam na caixa do usuário (até 'offline_memory' em memória, o resto em
+        # disco, no máximo 'offline_max' por usuário, por até 'offline_ttl' segundos). Enquanto o
+        # usuário está em 'suspended', tudo o que chega para ele vai para a caixa, na ordem; um
+        # heartbeat ou novo registro coloca um marcador na fila dele e, quando o worker chega ao
+        # marcador, a caixa é esvaziada antes das mensagens seguintes.
+        self.offline = OfflineStore(offline_dir, memory_limit=offline_memory,
+                                    max_messages=offline_max, ttl=offline_ttl)
+        self.suspended = set(self.offline.keys())
+
+        # controle de admissão: cada remetente tem um balde de 'rate_limit' mensagens/s (rajadas
+        # de 'rate_burst') e outro de 'fanout_rate' entregas/s (até 'fanout_burst') cobrado pelo
+        # tamanho do fanout de broadcasts e mensagens de sala ('rate_limit=0' desliga). Com mais
+        # de 'admission_depth' mensagens nas filas de entrega, novos envios são recusados até
+        # as filas baixarem ('retry_after' = 'admission_retry' segundos).
+        self.limiter = SenderLimiter(rate_limit, rate_burst, fanout_rate, fanout_burst) if rate_limit else None
+        self.admission_depth = admission_depth
+        self.admission_retry = admission_retry
+
+        # consumidores lentos: a duração de cada chamada de callback alimenta a EWMA do destinatário
+        # (reduzida a um lote de 'batch_size' quando a chamada leva mais mensagens); quem fica acima
+        # de 'slow_threshold' segundos é classificado como lento e tratado pela
+        # 'slow_policy': SLOW_BATCH (lotes 'slow_batch_factor' vezes maiores), SLOW_DROP_PUBLIC
+        # (só mensagens privadas) ou SLOW_DISCONNECT (desconectado, pendentes na caixa offline)
+        if slow_policy not in SLOW_POLICIES:
+            raise ValueError(f"política para consumidores lentos inválida: {slow_policy}")
+        self.consumers = ConsumerTracker(threshold=slow_threshold, batch_size=batch_size)
+        self.slow_policy = slow_policy
+        self.slow_batch_size = batch_size * slow_batch_factor
+
+        # anexos: conteúdo endereçado pelo SHA-256 em 'attachments_dir', enviado e baixado em pedaços
+        # de até 'attachment_chunk' bytes (a memória por transferência é de um pedaço). Conteúdo
+        # repetido é gravado uma vez só; a mensagem do chat leva apenas a referência
+        # {"id", "name", "size"}. Os anexos não são replicados para o standby.
+        self.attachments = AttachmentStore(attachments_dir, chunk_size=attachment_chunk,
+                                           max_size=attachment_max_size)
+
+        # métricas: contadores e histogramas atualizados no caminho quente; os medidores
+        # só são calculados quando 'get_stats' é chamado (ou a cada 'stats_interval'
+        # segundos, se 'stats_file' for informado, gravados nesse arquivo JSON)
+        self.metrics = Metrics()
+        self.m_messages_in = self.metrics.counter("messages_in")
+        self.m_messages_out = self.metrics.counter("messages_out")
+        self.m_delivery_failures = self.metrics.counter("delivery_failures")
+        self.m_evictions = self.metrics.counter("evictions")
+        self.m_rate_limited = self.metrics.counter("rate_limited")
+        self.m_shed = self.metrics.counter("shed_overloaded")
+        self.m_slow_dropped = self.metrics.counter("slow_dropped")
+        self.m_send_latency = self.metrics.histogram("send_message")
+        self.m_delivery_latency = self.metrics.histogram("delivery")
+        self.m_replication_lag = self.metrics.histogram("replication_lag")
+        self.metrics.gauge("online_users", lambda: len(self.clients))
+        self.metrics.gauge("registry_version", lambda: self.clients.version)
+        self.metrics.gauge("rooms", lambda: len(self.rooms))
+        self.metrics.gauge("queue_depth", self.delivery.depth)
+        self.metrics.gauge("deepest_queues", lambda: dict(self.delivery.deepest()))
+        self.metrics.gauge("queue_dropped", lambda: self.delivery.dropped)
+        self.metrics.gauge("delivery_batches", lambda: self.delivery.batches)
+        self.metrics.gauge("history_messages", lambda: len(self.history))
+        self.metrics.gauge("leases_expired", lambda: self.leases.expired)
+        self.metrics.gauge("proxy_pool", self.pool.stats)
+        if self.search is not None:
+            self.metrics.gauge("search_index", self.search.stats)
+        self.metrics.gauge("offline", self.offline.stats)
+        self.metrics.gauge("suspended_users", lambda: len(self.suspended))
+        if self.limiter is not None:
+            self.metrics.gauge("rate_limiter", self.limiter.stats)
+        self.metrics.gauge("presence", lambda: {"epoch": self.clients.epoch, "version": self.clients.version,
+                                                "subscribers": len(self.presence_subscribers),
+                                                "queued": self.presence_feed.pending,
+                                                "dropped": self.presence_feed.dropped})
+        self.metrics.gauge("slow_consumers", lambda: dict(self.consumers.stats(), policy=self.slow_policy))
+        self.metrics.gauge("replication", self._replication_stats)
+        self.metrics.gauge("attachments", self.attachments.stats)
+        self.metrics.gauge("wire", lambda: dict(self.frames.stats(), compact_clients=len(self.wire_formats)))
+        if stats_file:
+            self.metrics.start_dump(stats_file, stats_interval)
+
+    def register_client(self, name: str, callback_uri: str, wire: dict = None):
         """
         Registra um cliente (nome e URI do callback).
-        1. Adquire o lock para garantir acesso exclusivo às estruturas de dados.
-        2. Verifica se o 'name' já está em uso; se sim, retorna erro.
-        3. Se não estiver em uso, armazena o 'name' como chave, e a 'callback_uri' e o timestamp atual em 'self.clients'.
-        4. Libera o lock.
-        5. Envia uma mensagem de sistema ("<name> entrou no chat.") para todos os clientes.
-        6. Retorna o status de sucesso.
+        1. Em modo particionado, recusa quem não pertence a este shard (informando o shard certo);
+           um standby recusa todos ("standby") até assumir o lugar do primário.
+        2. Tenta incluir o 'name' no registro (com a 'callback_uri' e o timestamp atual); o registro
+           verifica, sob o seu próprio lock, se o nome já está em uso e, se estiver, retorna erro.
+           Se o nome está registrado com a mesma 'callback_uri' (cliente voltando após um failover,
+           com a presença já replicada), o registro é só renovado: lease, entrega das guardadas e ok.
+        3. A inclusão publica um novo retrato de 'self.clients', visto pelos próximos broadcasts.
+        4. Concede ao cliente um lease de presença.
+        5. Se havia mensagens guardadas para ele (store-and-forward), agenda a entrega delas, em ordem.
+        6. Com 'announce_presence', envia uma mensagem de sistema ("<name> entrou no chat.") para todos;
+           a entrada também gera um evento de presença para os inscritos (ver 'subscribe_presence').
+        7. Retorna o status de sucesso, com a duração do lease e o intervalo de heartbeat esperado.
+        8. Com 'wire' (a oferta do cliente, ver 'codec.wire_offer'), negocia o formato compacto:
+           as entregas passam a ser 'receive_compact(frames)' e a resposta traz "wire", o formato
+           escolhido. Sem 'wire' (clientes antigos), as mensagens seguem como dicionários.
         """
-        with self.lock:
-            if name in self.clients:
+        if self.relay is not None and not self.relay.is_local(name):
+            return {"ok": False, "error": "shard_errado", "shard": self.relay.home(name)}
+        if self.role == STANDBY:
+            return {"ok": False, "error": "standby"}
+        now = time.time()
+        if not self.clients.add(name, {"uri": callback_uri, "last_seen": now}):
+            info = self.clients.get(name)
+            if info is None or str(info["uri"]) != str(callback_uri):
                 return {"ok": False, "error": "nome_ja_em_uso"}
-            self.clients[name] = {"uri": callback_uri, "last_seen": time.time()}
-            print(f"[server] {name} registrado -> {callback_uri}")
-        self._announce_system_message(f"{name} entrou no chat.")
-        return {"ok": True}
+            log.info("%s registrado de novo -> %s", name, callback_uri)
+            info["last_seen"] = now
+            return self._registered(name, info["uri"], wire)
+        log.info("%s registrado -> %s", name, callback_uri)
+        r = self._registered(name, callback_uri, wire)
+        if self.announce_presence:
+            self._announce_system_message(f"{name} entrou no chat.")
+        return r
 
     def unregister_client(self, name: str):
         """
         Desregistra um cliente pelo seu nome.
-        1. Adquire o lock.
-        2. Verifica se o 'name' está em 'self.clients'.
-        3. Se estiver, remove o cliente de 'self.clients' e imprime no console do servidor.
-        4. Se não estiver, retorna erro.
-        5. Libera o lock.
-        6. Envia uma mensagem de sistema ("<name> saiu do chat.") para todos os clientes.
+        1. Remove o 'name' do registro (publicando um novo retrato de 'self.clients').
+        2. Se ele não estava registrado, retorna erro.
+        3. Registra a saída no log do servidor.
+        4. Com o lock das salas, remove o cliente das salas de que participava.
+        5. Revoga o lease, descarta a fila de saída, o proxy do cliente no pool, os seus baldes de envio
+           e a sua classificação de consumidor lento.
+        6. Com 'announce_presence', envia uma mensagem de sistema ("<name> saiu do chat.") para todos;
+           a saída também gera um evento de presença e cancela a inscrição do cliente, se houver.
         7. Retorna o status de sucesso.
         """
+        info = self.clients.remove(name)
+        if info is None:
+            return {"ok": False, "error": "nao_encontrado"}
+        log.info("%s desregistrado", name)
         with self.lock:
-            if name in self.clients:
-                del self.clients[name]
-                print(f"[server] {name} desregistrado")
-            else:
-                return {"ok": False, "error": "nao_encontrado"}
-        self._announce_system_message(f"{name} saiu do chat.")
+            for room in self.member_rooms.pop(name, ()):
+                self._remove_member(room, name)
+        self.leases.revoke(name)
+        self.delivery.discard(name)
+        self.pool.evict(info["uri"])
+        self.callback_modes.pop(info["uri"], None)
+        self.wire_formats.pop(info["uri"], None)
+        if self.limiter is not None:
+            self.limiter.forget(name)
+        if self.consumers.forget(name):
+            self.delivery.set_batch_size(name, None)
+        self.presence_subscribers.pop(name, None)
+        self.presence_feed.discard(name)
+        if self.announce_presence:
+            self._announce_system_message(f"{name} saiu do chat.")
         return {"ok": True}
 
-    def send_message(self, from_name: str, to: str, text: str):
+    def send_message(self, from_name: str, to: str, text: str, room: str = None, attachment=None):
         """
-        Processa e envia uma mensagem (P2P ou Broadcast).
-        1. Cria o dicionário 'msg' com remetente, destinatário, texto e timestamp.
-        2. Adquire o lock e adiciona 'msg' ao 'self.history'.
+        Processa e envia uma mensagem (P2P, Broadcast ou para uma sala).
+        Com 'room', a mensagem vai só para os membros da sala e 'to' vira "#<sala>".
+        0. Passa pelo controle de admissão ('_admit'): se o remetente estourou o seu limite ou as
+           filas de entrega estão cheias, retorna {"ok": False, "error": "rate_limited" ou
+           "overloaded", "retry_after": <segundos>} sem gravar nem entregar nada. Um standby
+           recusa tudo com {"ok": False, "error": "standby"}.
+        1. Cria o dicionário 'msg' com remetente, destinatário, texto e timestamp. Com 'attachment'
+           (a referência devolvida por 'finish_upload' ou 'begin_upload'), 'msg' leva também a
+           referência {"id", "name", "size"}, conferida no armazenamento de anexos (senão,
+           "anexo_nao_encontrado"); o conteúdo é baixado à parte com 'download_chunk'.
+        2. Grava 'msg' no log de histórico, que devolve a mensagem codificada uma única vez
+           ('payload'), reaproveitada por todos os destinatários.
         3. Define a lista de 'targets' (destinatários) com base no campo 'to':
-           a. Se 'to' for "ALL", a lista inclui todos os clientes em 'self.clients'.
+           a. Se 'to' for "ALL", a lista é o retrato atual de 'self.clients' (sem lock).
            b. Se for um nome específico, verifica se o destinatário existe; se existir, a lista inclui apenas ele. Caso contrário, retorna erro.
+           c. Se for uma sala, a lista vem do índice sala -> membros (o remetente precisa ser membro).
+           d. Em modo particionado, mensagens privadas para usuários de outro shard seguem pelo shard
+              casa do destinatário; broadcasts e mensagens de sala são repassados a todos os shards.
         4. Itera sobre os 'targets' e, para cada um:
-           a. Inicia uma nova thread (não bloqueante) para chamar o método '_deliver'.
-           b. O '_deliver' usará a URI de callback do cliente para enviar a mensagem.
-        5. Retorna o status de sucesso.
+           a. Coloca a mensagem na fila de saída do destinatário (não bloqueante).
+           b. Um worker do pool de entrega chamará '_deliver', que usa a URI de callback do cliente.
+        5. Retorna o status de sucesso assim que as mensagens estão enfileiradas.
+        A duração da chamada entra no histograma 'send_message' das métricas.
         """
-        ts = time.time()
-        msg = {"from": from_name, "to": to, "text": text, "ts": ts}
-        with self.lock:
-            self.history.append(msg)
-        if to == "ALL":
-            targets = list(self.clients.items())
-        else:
-            with self.lock:
-                if to not in self.clients:
+        start = time.perf_counter()
+        self.m_messages_in.inc()
+        try:
+            rejected = self._admit(from_name, to, room)
+            if rejected is not None:
+                return rejected
+            if attachment is not None:
+                attachment = self.attachments.ref(attachment)
+                if attachment is None:
+                    return {"ok": False, "error": "anexo_nao_encontrado"}
+            if room is not None:
+                return self._send_room_message(from_name, room, text, attachment)
+            ts = time.time()
+            msg = {"from": from_name, "to": to, "text": text, "ts": ts}
+            if attachment is not None:
+                msg["attachment"] = attachment
+            payload = self.history.append(msg)
+            if to != "ALL" and self.relay is not None and not self.relay.is_local(to):
+                return self.relay.forward_private(msg)
+            if to == "ALL":
+                targets = self.clients.snapshot().clients.items()
+            else:
+                info = self.clients.get(to)
+                if info is None:
                     return {"ok": False, "error": "destinatario_nao_encontrado"}
-                targets = [(to, self.clients[to])]
-        # enviar por callback remoto (não bloqueante em threads)
-        for name, info in targets:
-            threading.Thread(target=self._deliver, args=(info["uri"], msg, name), daemon=True).start()
+                targets = [(to, info)]
+            # enviar por callback remoto (enfileira; os workers do pool fazem a entrega)
+            for name, info in targets:
+                self.delivery.enqueue(name, (info["uri"], msg, payload))
+            if to == "ALL" and self.relay is not None:
+                self.relay.broadcast(msg)
+            return {"ok": True}
+        finally:
+            self.m_send_latency.observe(time.perf_counter() - start)
+
+    def send_messages(self, from_name: str, batch):
+        """
+        Envia um lote de mensagens do mesmo remetente em uma única chamada remota.
+        1. Cada item do lote é [seq, to, text, room], com 'seq' crescente atribuído pelo cliente
+           (e, opcionalmente, a referência de um anexo como quinto elemento).
+        2. Os itens são processados em ordem por 'send_message'.
+        3. A confirmação também vem em lote: {"ok": True, "acked": <maior seq processado>,
+           "errors": [[seq, resultado], ...]}, listando só os itens que falharam (ex:
+           'destinatario_nao_encontrado'); todo seq até 'acked' fora de 'errors' foi aceito.
+        4. Itens recusados pelo controle de admissão ('rate_limited'/'overloaded') também vão para
+           'errors', com o 'retry_after'; o cliente decide se reenvia depois.
+        """
+        acked = None
+        errors = []
+        for seq, to, text, room, *attachment in batch:
+            r = self.send_message(from_name, to, text, room, *attachment)
+            if not r.get("ok"):
+                errors.append([seq, r])
+            acked = seq
+        return {"ok": True, "acked": acked, "errors": errors}
+
+    def begin_upload(self, owner: str, name: str, size: int, sha256: str = None):
+        """
+        Começa o envio do anexo 'name', de 'size' bytes, pelo usuário registrado 'owner'.
+        1. Se 'sha256' (hex) foi informado e esse conteúdo já está no servidor, nada precisa ser
+           enviado: retorna {"ok": True, "attachment": referência} na hora (dedup).
+        2. Senão retorna {"ok": True, "upload_id": ..., "chunk_size": ...}; o cliente envia o
+           arquivo em ordem com 'upload_chunk' (pedaços de até 'chunk_size' bytes) e conclui
+           com 'finish_upload'.
+        3. Anexos grandes demais, usuários não registrados e um standby são recusados
+           ({"ok": False, "error": ...}).
+        Os pedaços devem ir pelo serializador marshal (bytes crus); com o serpent eles viajam em base64.
+        """
+        if self.role == STANDBY:
+            return {"ok": False, "error": "standby"}
+        if self.clients.get(owner) is None:
+            return {"ok": False, "error": "nao_registrado"}
+        return self.attachments.begin(owner, name, size, sha256)
+
+    def upload_chunk(self, owner: str, upload_id: str, offset: int, data: bytes):
+        """
+        Grava um pedaço do upload 'upload_id' a partir de 'offset' (direto no arquivo temporário).
+        Retorna {"ok": True, "offset": <próximo offset esperado>}; um pedaço reenviado é
+        confirmado sem ser gravado de novo e um offset fora de ordem é recusado com
+        "offset_invalido" e o offset esperado, para o cliente retomar dali.
+        Só o dono ('owner' de 'begin_upload') grava no upload; para os demais, "upload_desconhecido".
+        """
+        if isinstance(data, dict):
+            # cliente com o serpent: o pedaço chegou como {"data": <base64>, "encoding": "base64"}
+            data = serpent.tobytes(data)
+        return self.attachments.write(owner, upload_id, offset, data)
+
+    def finish_upload(self, owner: str, upload_id: str):
+        """
+        Conclui o upload: confere tamanho e hash e guarda o conteúdo pelo SHA-256 (se ele já
+        existia, a cópia nova é descartada). Retorna {"ok": True, "attachment": {"id", "name", "size"}},
+        a referência a passar em 'send_message(..., attachment=...)'.
+        Como em 'upload_chunk', só o dono do upload pode concluí-lo.
+        """
+        return self.attachments.finish(owner, upload_id)
+
+    def download_chunk(self, attachment_id: str, offset: int = 0, length: int = None, local_only: bool = False):
+        """
+        Lê um pedaço (até o 'chunk_size' do servidor) do anexo 'attachment_id' a partir de 'offset'.
+        1. Retorna {"ok": True, "data": bytes, "offset": <próximo offset>, "size": <tamanho total>};
+           o download termina quando 'offset' chega a 'size'.
+        2. Em modo particionado, um anexo enviado a outro shard é buscado nos demais shards
+           ('local_only' evita que o pedido seja repassado de novo).
+        """
+        r = self.attachments.read(attachment_id, offset, length)
+        if r["ok"] or self.relay is None or local_only:
+            return r
+        for shard in self.relay.peers():
+            try:
+                remote = self.relay.call(shard, "download_chunk", attachment_id, offset, length, True)
+            except (CommunicationError, NamingError):
+                continue
+            if remote.get("ok"):
+                if isinstance(remote["data"], dict):
+                    remote["data"] = serpent.tobytes(remote["data"])
+                return remote
+        return r
+
+    def locate_shard(self, name: str):
+        """Informa qual servidor (nome no Name Server) atende o usuário 'name'."""
+        if self.relay is None:
+            return {"ok": True, "shard": SERVER_NAME}
+        return {"ok": True, "shard": self.relay.home(name)}
+
+    def relay_private(self, msg: dict):
+        """
+        Recebe de outro shard uma mensagem privada para um cliente deste shard.
+        Grava no histórico local e entrega; se o cliente não estiver aqui, devolve o erro ao shard de origem.
+        """
+        info = self.clients.get(msg["to"])
+        if info is None:
+            return {"ok": False, "error": "destinatario_nao_encontrado"}
+        payload = self.history.append(msg)
+        self.delivery.enqueue(msg["to"], (info["uri"], msg, payload))
         return {"ok": True}
 
-    def get_history(self, limit: int = 100):
+    def relay_batch(self, items):
         """
-        Retorna o histórico de mensagens.
-        1. Adquire o lock para garantir que o histórico não seja modificado durante a leitura.
-        2. Retorna uma cópia da porção final da lista 'self.history' (as últimas 'limit' mensagens).
-        3. Libera o lock.
+        Recebe de outro shard um lote de [msg, sala] (broadcasts e mensagens de sala).
+        Cada mensagem é gravada no histórico local e entregue só aos clientes deste shard,
+        sem novo repasse (quem repassa para todos é o shard de origem).
+        """
+        for msg, room in items:
+            if room is not None:
+                self._fanout_room(room, msg)
+                continue
+            payload = self.history.append(msg)
+            for name, info in self.clients.snapshot().clients.items():
+                self.delivery.enqueue(name, (info["uri"], msg, payload))
+
+    def join_room(self, name: str, room: str):
+        """
+        Coloca o cliente 'name' na sala 'room' (a sala é criada se não existir).
+        Atualiza os dois índices e avisa os membros da sala.
         """
         with self.lock:
-            return list(self.history[-limit:])
+            if name not in self.clients:
+                return {"ok": False, "error": "nao_encontrado"}
+            members = self.rooms.setdefault(room, set())
+            if name in members:
+                return {"ok": True}
+            members.add(name)
+            self.member_rooms.setdefault(name, set()).add(room)
+        with self.room_history_lock:
+            if room not in self.room_history:
+                self.room_history[room] = ColumnarHistory(max_messages=self.history_cache)
+        self._send_room_message("SYSTEM", room, f"{name} entrou na sala.")
+        return {"ok": True}
+
+    def leave_room(self, name: str, room: str):
+        """Retira o cliente 'name' da sala 'room' e avisa os membros restantes."""
+        with self.lock:
+            if name not in self.rooms.get(room, ()):
+                return {"ok": False, "error": "nao_membro_da_sala"}
+            self._remove_member(room, name)
+            rooms = self.member_rooms.get(name)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self.member_rooms[name]
+        self._send_room_message("SYSTEM", room, f"{name} saiu da sala.")
+        return {"ok": True}
+
+    def list_rooms(self):
+        """Retorna {sala: número de membros}."""
+        with self.lock:
+            return {room: len(members) for room, members in self.rooms.items()}
+
+    def get_room_history(self, room: str, limit: int = 100, before_ts: float = None, since_ts: float = None):
+        """
+        Histórico de uma sala, com a mesma paginação de 'get_history'.
+        1. Consulta a janela em memória da sala (busca binária pelos timestamps).
+        2. Se a janela não cobre a consulta (mensagens antigas ou anteriores ao último
+           reinício), busca no log em disco filtrando pelo destinatário "#<sala>".
+        """
+        with self.room_history_lock:
+            window = self.room_history.get(room)
+            if window is not None and len(window) and limit > 0:
+                oldest_ts = window.ts(0)
+                if since_ts is not None and before_ts is None:
+                    if since_ts >= oldest_ts:
+                        lo = window.index_after(since_ts)
+                        return window.slice(lo, lo + limit)
+                else:
+                    hi = len(window) if before_ts is None else window.index_before(before_ts)
+                    lo = 0 if since_ts is None else window.index_after(since_ts)
+                    if lo > 0 or hi - lo >= limit:
+                        return window.slice(max(lo, hi - limit), hi)
+        return self.history.query(limit, before_ts=before_ts, since_ts=since_ts, to=f"#{room}")
+
+    def get_history(self, limit: int = 100, before_ts: float = None, since_ts: float = None):
+        """
+        Retorna o histórico de mensagens em ordem cronológica, com paginação por cursor.
+        1. Sem cursores, retorna as últimas 'limit' mensagens.
+        2. Com 'before_ts', retorna as últimas 'limit' mensagens anteriores a ele (use o 'ts'
+           da mensagem mais antiga recebida para buscar a página anterior).
+        3. Com 'since_ts', retorna as primeiras 'limit' mensagens posteriores a ele (use o 'ts'
+           da mais nova recebida para continuar a sincronização).
+        4. Consultas recentes saem do cache em memória; as demais, do log em disco.
+        """
+        return self.history.query(limit, before_ts=before_ts, since_ts=since_ts)
+
+    def get_history_packed(self, name: str, limit: int = 100, before_ts: float = None, since_ts: float = None):
+        """
+        Como 'get_history', mas a página inteira vem em um único frame compacto (bytes): a lista
+        das mensagens na forma posicional, no formato negociado por 'name' no registro (marshal
+        com zlib, se ele não negociou), comprimida quando passa do limite.
+        Deve ser chamado pelo serializador marshal (com o serpent, os bytes vão em base64).
+        """
+        info = self.clients.get(name)
+        fmt = self.wire_formats.get(info["uri"]) if info is not None else None
+        page = self.history.query(limit, before_ts=before_ts, since_ts=since_ts)
+        return (fmt or self.default_wire).pack([message_fields(msg) for msg in page])
+
+    def search_history(self, query: str = "", sender: str = None, recipient: str = None,
+                       since_ts: float = None, limit: int = 50):
+        """
+        Busca no histórico as mensagens que contêm todas as palavras de 'query'.
+        1. A busca ignora maiúsculas e acentos e casa palavras inteiras.
+        2. 'sender' e 'recipient' filtram por remetente e destinatário ("ALL", um nome ou "#<sala>");
+           'since_ts' limita a mensagens posteriores a esse timestamp.
+        3. Os resultados vêm do índice invertido, ordenados do mais recente para o mais antigo,
+           no máximo 'limit' mensagens; o texto é lido do cache em memória ou do log em disco.
+        4. O índice cobre as últimas 'search_max' mensagens do histórico.
+        """
+        if self.search is None:
+            return {"ok": False, "error": "busca_desativada"}
+        seqs = self.search.search(query, sender=sender, recipient=recipient, since_ts=since_ts, limit=limit)
+        return {"ok": True, "results": self.history.read(seqs)}
 
     def list_clients(self):
         """
         Retorna uma lista dos nomes de todos os clientes registrados.
-        1. Adquire o lock.
-        2. Retorna uma lista (cópia) das chaves (nomes) do dicionário 'self.clients'.
-        3. Libera o lock.
+        1. Retorna uma lista dos nomes do retrato atual de 'self.clients'.
+        2. Em modo particionado, acrescenta os clientes dos outros shards ('local_clients').
+        """
+        users = self.local_clients()
+        if self.relay is not None:
+            for shard in self.relay.peers():
+                try:
+                    users.extend(self.relay.call(shard, "local_clients"))
+                except (CommunicationError, NamingError):
+                    pass
+        return users
+
+    def local_clients(self):
+        """Nomes dos clientes registrados neste servidor (ou shard)."""
+        return self.clients.names()
+
+    def presence_since(self, version: int = None, epoch: str = None):
+        """
+        Presença incremental deste servidor (ou shard).
+        1. O cliente informa a última 'version' (e 'epoch') que conhece.
+        2. Se o log de mudanças ainda cobre o intervalo, retorna só o delta:
+           {"ok": True, "epoch", "version": <atual>, "full": False, "joined": [...], "left": [...]},
+           já compactado (quem entrou e saiu dentro do intervalo aparece só em 'left').
+        3. Sem versão, com epoch diferente (servidor reiniciou) ou com o intervalo fora do log,
+           retorna o retrato completo: {"ok": True, "epoch", "version", "full": True, "users": [...]}.
         """
+        delta = self.clients.presence_delta(version, epoch)
+        if delta.full:
+            return {"ok": True, "epoch": self.clients.epoch, "version": delta.version, "full": True, "users": delta.users}
+        return {"ok": True, "epoch": self.clients.epoch, "version": delta.version, "full": False,
+                "joined": delta.joined, "left": delta.left}
+
+    def subscribe_presence(self, name: str, enabled: bool = True):
+        """
+        Inscreve (ou, com enabled=False, desinscreve) o cliente 'name' nos eventos de presença.
+        1. O cliente precisa estar registrado; os eventos vão para o seu callback
+           'presence_update(events)', cada evento {"epoch", "version", "name", "online"}.
+        2. A inscrição vem antes do retrato devolvido, então nenhuma mudança se perde: eventos
+           com versão menor ou igual à do retrato já estão nele e podem ser ignorados.
+        3. Retorna o retrato completo (como 'presence_since' sem versão) para montar a lista local.
+        4. Não disponível em modo particionado (a presença de cada shard é independente).
+        """
+        if self.relay is not None:
+            # cada shard tem o seu próprio registro e versão; no modo particionado vale 'list_clients'
+            return {"ok": False, "error": "particionado"}
+        if not enabled:
+            self.presence_subscribers.pop(name, None)
+            self.presence_feed.discard(name)
+            return {"ok": True}
+        info = self.clients.get(name)
+        if info is None:
+            return {"ok": False, "error": "nao_registrado"}
+        self.presence_subscribers[name] = info["uri"]
+        return self.presence_since()
+
+    def heartbeat(self, name: str):
+        """
+        Renova o lease de presença do cliente.
+        Atualiza também o 'last_seen' do cliente (um único campo da entrada, sem lock).
+        Se as entregas para o cliente estavam suspensas (falha de comunicação), o heartbeat prova
+        que ele voltou: as mensagens guardadas são entregues.
+        Retorna {"ok": True}, ou {"ok": False, "error": "nao_registrado"} se o lease já expirou
+        (ex: rede fora por mais de um lease): o cliente deve se registrar de novo, o que também
+        entrega o que ficou guardado para ele enquanto isso.
+        """
+        if not self.leases.renew(name):
+            return {"ok": False, "error": "nao_registrado"}
+        info = self.clients.get(name)
+        if info is None:
+            return {"ok": False, "error": "nao_registrado"}
+        info["last_seen"] = time.time()
+        if name in self.suspended:
+            self._resume(name, info["uri"])
+        return {"ok": True}
+
+    def get_pool_stats(self):
+        """Retorna os contadores do pool de proxies de callback (acertos, erros, reconexões)."""
+        return self.pool.stats()
+
+    def get_stats(self):
+        """
+        Retorna um retrato das métricas do servidor:
+        1. 'counters': mensagens recebidas/entregues, falhas de entrega e clientes removidos.
+        2. 'histograms': latência de 'send_message' e da entrega (do envio até o callback
+           confirmar), com média, p50/p95/p99 e máximo em milissegundos.
+        3. 'gauges': usuários online, profundidade das filas, tamanho do histórico e o pool de proxies.
+        """
+        return self.metrics.snapshot()
+
+    def attach_standby(self, standby_uri: str):
+        """
+        Conecta um standby a este primário (chamado pelo próprio standby).
+        1. A partir daqui, mensagens gravadas e entradas/saídas vão para 'standby_uri' em ordem
+           (um standby anterior é substituído).
+        2. Retorna {"ok": True, "seq": <última seq antes do retrato>, "clients": {nome: URI do callback}};
+           o standby copia o histórico com 'get_history(since_ts=...)' e aplica as entradas com
+           seq maior que 'seq'. Entradas já refletidas no retrato são reaplicadas sem efeito.
+        3. Um servidor que ainda é standby recusa ("standby"): não há encadeamento de réplicas.
+        """
+        if self.role == STANDBY:
+            return {"ok": False, "error": "standby"}
+        seq = self.replication.attach(standby_uri)
+        log.info("standby conectado: %s (seq %d)", standby_uri, seq)
+        clients = {name: str(info["uri"]) for name, info in self.clients.snapshot().clients.items()}
+        return {"ok": True, "seq": seq, "clients": clients}
+
+    def replicate(self, entries):
+        """Recebe do primário um lote de entradas de replicação (só em um standby)."""
+        if self.follower is None:
+            return {"ok": False, "error": "nao_standby"}
+        self.follower.receive(entries)
+        return {"ok": True}
+
+    def follow(self, own_uri: str, primary_name: str = SERVER_NAME, ns_host: str = None, ns_port: int = None):
+        """
+        Começa a acompanhar o primário registrado como 'primary_name' (só em um standby).
+        'own_uri' é a URI deste servidor, que vai para o Name Server se ele assumir.
+        """
+        if self.role != STANDBY or self.follower is not None:
+            return {"ok": False, "error": "nao_standby"}
+        self.follower = Follower(own_uri, self._apply_replicated, self._resync, self._promote, primary_name,
+                                 ns_host=ns_host, ns_port=ns_port, failover_timeout=self.failover_timeout,
+                                 on_lag=self.m_replication_lag.observe)
+        self.follower.start()
+        return {"ok": True}
+
+    def _admit(self, from_name, to, room):
+        """
+        Controle de admissão de uma mensagem: None se ela pode seguir, senão o erro estruturado.
+        1. Mensagens do sistema (SYSTEM) sempre passam (salvo em um standby, que recusa tudo).
+        2. Carga global: com 'admission_depth' ou mais mensagens pendentes nas filas de entrega,
+           recusa com 'overloaded' (protege o servidor, seja qual for o remetente).
+        3. Por remetente: cobra 1 mensagem e, em broadcasts e salas, o fanout atual (usuários
+           online ou membros da sala); sem fichas, recusa com 'rate_limited' e o tempo de espera.
+        """
+        if self.role == STANDBY:
+            return {"ok": False, "error": "standby"}
+        if from_name == "SYSTEM":
+            return None
+        if self.admission_depth and self.delivery.pending >= self.admission_depth:
+            self.m_shed.inc()
+            return {"ok": False, "error": "overloaded", "retry_after": self.admission_retry}
+        if self.limiter is None:
+            return None
+        if room is not None:
+            fanout = len(self.rooms.get(room, ()))
+        elif to == "ALL":
+            fanout = len(self.clients)
+        else:
+            fanout = 0
+        wait = self.limiter.admit(from_name, fanout)
+        if wait > 0:
+            self.m_rate_limited.inc()
+            log.info("envio de %s limitado (retry_after=%.2fs)", from_name, wait)
+            return {"ok": False, "error": "rate_limited", "retry_after": round(wait, 3)}
+        return None
+
+    def _send_room_message(self, from_name, room, text, attachment=None):
+        """Grava e entrega uma mensagem de sala apenas para os membros dela (em todos os shards)."""
         with self.lock:
-            return list(self.clients.keys())
+            members = self.rooms.get(room)
+            if members is None:
+                return {"ok": False, "error": "sala_nao_encontrada"}
+            if from_name != "SYSTEM" and from_name not in members:
+                return {"ok": False, "error": "nao_membro_da_sala"}
+        msg = {"from": from_name, "to": f"#{room}", "text": text, "ts": time.time()}
+        if attachment is not None:
+            msg["attachment"] = attachment
+        self._fanout_room(room, msg)
+        if self.relay is not None:
+            self.relay.broadcast(msg, room)
+        return {"ok": True}
+
+    def _fanout_room(self, room, msg):
+        """Grava a mensagem de sala e a entrega aos membros locais da sala."""
+        clients = self.clients.snapshot().clients
+        with self.lock:
+            targets = [(name, clients[name]) for name in self.rooms.get(room, ()) if name in clients]
+        with self.room_history_lock:
+            payload = self.history.append(msg)
+            window = self.room_history.get(room)
+            if window is not None:
+                window.append(msg)
+        for name, info in targets:
+            self.delivery.enqueue(name, (info["uri"], msg, payload))
+
+    def _remove_member(self, room, name):
+        """Retira 'name' do índice sala -> membros (chamado com o lock); salas vazias são apagadas."""
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(name)
+            if not members:
+                del self.rooms[room]
+
+    def _on_lease_expired(self, name):
+        """Chamado pela roda de tempo quando o cliente ficou sem heartbeat por um lease inteiro."""
+        log.info("lease de %s expirou; removendo", name)
+        self.m_evictions.inc()
+        pending = self.delivery.discard(name)
+        if pending:
+            self._suspend(name, pending)
+        self.unregister_client(name)
+
+    def _on_queue_overflow(self, name):
+        """Chamado pelo motor de entrega quando a fila de um cliente estoura (política DISCONNECT)."""
+        log.warning("fila de saída de %s estourou; desconectando", name)
+        self.m_evictions.inc()
+        self.unregister_client(name)
+
+    def _deliver_batch(self, target_name, items):
+        """
+        Entrega um lote de mensagens enfileiradas para um cliente (executada por um worker do pool de entrega).
+        1. Cada item é (callback_uri, msg, payload); itens consecutivos com a mesma URI formam um lote.
+        2. Por padrão chama 'receive_encoded(payloads)' com os bytes já codificados em 'send_message'.
+        2a. Callbacks que negociaram o formato compacto recebem 'receive_compact(frames)', com os frames
+            posicionais de cada mensagem (montados uma vez por formato, ver FrameCache); se o método
+            não existir, voltam para 'receive_encoded'.
+        3. Se o cliente não expõe esse método (AttributeError), a URI passa a usar 'receive_batch(msgs)';
+           se também não existir, 'receive(msg)' para cada mensagem.
+        4. Lotes de uma única mensagem em clientes sem 'receive_encoded' usam direto 'receive(msg)'.
+        5. Em falha de comunicação, o lote que falhou e os seguintes vão para a caixa store-and-forward
+           do cliente, e as entregas para ele ficam suspensas até um heartbeat ou novo registro.
+        6. A duração de cada chamada alimenta a classificação de consumidor lento ('_observe');
+           para um cliente lento sob SLOW_DROP_PUBLIC, só as mensagens privadas são entregues.
+        """
+        if target_name in self.suspended or any(msg is None for _, msg, _ in items):
+            items = self._apply_offline(target_name, items)
+        if self.slow_policy == SLOW_DROP_PUBLIC and self.consumers.is_slow(target_name):
+            kept = [item for item in items if item[1]["to"] == target_name]
+            self.m_slow_dropped.inc(len(items) - len(kept))
+            items = kept
+        limit = self.delivery.batch_limit(target_name)
+        i = 0
+        while i < len(items):
+            callback_uri = items[i][0]
+            j = i
+            while j < len(items) and items[j][0] == callback_uri and j - i < limit:
+                j += 1
+            batch = items[i:j]
+            start, i = i, j
+            mode = self.callback_modes.get(callback_uri, CALLBACK_ENCODED)
+            call = self._batch_call(callback_uri, mode, batch)
+            while call is not None:
+                method, args = call
+                try:
+                    t0 = time.perf_counter()
+                    self.pool.call(callback_uri, method, args)
+                    self._observe(target_name, time.perf_counter() - t0, len(batch))
+                    self._delivered(batch)
+                except AttributeError:
+                    # o cliente não expõe 'method': a URI passa para a forma seguinte
+                    mode = self.callback_modes[callback_uri] = CALLBACK_FALLBACK[method]
+                    call = self._batch_call(callback_uri, mode, batch)
+                    continue
+                except CommunicationError as e:
+                    self._delivery_failed(target_name, len(items) - start, e)
+                    self._suspend(target_name, items[start:])
+                    return
+                except Exception as e:
+                    self._delivery_failed(target_name, len(batch), e)
+                break
+            if call is not None:
+                continue
+            for k, (_, msg, _) in enumerate(batch):
+                if not self._deliver(callback_uri, msg, target_name):
+                    self._suspend(target_name, items[start + k:])
+                    return
+
+    def _apply_offline(self, target_name, items):
+        """
+        Aplica o store-and-forward a um lote (executado pelo worker do cliente, em ordem).
+        1. Enquanto o cliente está suspenso, cada mensagem vai para a sua caixa.
+        2. Ao encontrar o marcador de retomada (msg None), a suspensão termina e o conteúdo
+           da caixa entra no lugar do marcador, seguido das mensagens posteriores.
+        """
+        out = []
+        for item in items:
+            callback_uri, msg, payload = item
+            if msg is None:
+                if target_name in self.suspended:
+                    self.suspended.discard(target_name)
+                    for stored in self.offline.take(target_name):
+                        out.append((callback_uri, decode_message(stored), stored))
+            elif target_name in self.suspended:
+                self.offline.put(target_name, [payload])
+            else:
+                out.append(item)
+        return out
+
+    def _suspend(self, target_name, items):
+        """Suspende as entregas para o cliente e guarda 'items' na caixa dele."""
+        self.suspended.add(target_name)
+        self.offline.put(target_name, [payload for _, msg, payload in items if msg is not None])
+
+    def _resume(self, target_name, callback_uri):
+        """Enfileira o marcador que libera as mensagens guardadas para o cliente."""
+        self.suspended.add(target_name)
+        self.delivery.enqueue(target_name, (callback_uri, None, None))
+
+    def _batch_call(self, callback_uri, mode, batch):
+        """
+        Método e argumento da chamada em lote para 'mode': (método, argumento), ou None quando o
+        lote vai mensagem a mensagem por 'receive(msg)'. Sem formato negociado, o modo compacto
+        usa 'receive_encoded'.
+        """
+        if mode == CALLBACK_COMPACT:
+            fmt = self.wire_formats.get(callback_uri)
+            if fmt is not None:
+                return "receive_compact", [self.frames.get(fmt, msg, payload) for _, msg, payload in batch]
+            mode = CALLBACK_ENCODED
+        if mode == CALLBACK_ENCODED:
+            return "receive_encoded", [payload for _, _, payload in batch]
+        if mode == CALLBACK_BATCH and len(batch) > 1:
+            return "receive_batch", [msg for _, msg, _ in batch]
+        return None
 
     def _deliver(self, callback_uri, msg, target_name):
         """
-        Função de entrega de mensagem via callback remoto (executada em uma thread separada).
-        1. Tenta criar um 'Proxy' do Pyro5 usando a 'callback_uri' do cliente.
-        2. Define um tempo limite curto ('_pyroTimeout = 5') para a chamada remota.
+        Função de entrega de mensagem via callback remoto (executada por um worker do pool de entrega).
+        1. Obtém do pool o proxy persistente da 'callback_uri' (criado só na primeira entrega).
+        2. O pool aplica o tempo limite curto ('_pyroTimeout = 5') e a posse do proxy pela thread.
         3. Chama o método 'receive(msg)' no objeto remoto do cliente (callback).
-        4. Se a chamada falhar (ex: cliente desconectou), captura a exceção e imprime a falha no console do servidor.
+        4. Se a chamada falhar (ex: cliente desconectou), captura a exceção e registra a falha no log e nas métricas.
+        5. Retorna False só em falha de comunicação (a mensagem pode ser guardada e reenviada).
         """
         try:
-            # obtém proxy e chama receive (o cliente deve ter um objeto remoto com receive)
-            import Pyro5.api as _p
-            proxy = _p.Proxy(callback_uri)
-            proxy._pyroTimeout = 5  # tempo de espera curto para evitar travar o servidor
-            proxy.receive(msg)
+            # o cliente deve ter um objeto remoto com receive
+            t0 = time.perf_counter()
+            self.pool.call(callback_uri, "receive", msg)
+            self._observe(target_name, time.perf_counter() - t0)
+            self._delivered([(callback_uri, msg, None)])
+        except CommunicationError as e:
+            self._delivery_failed(target_name, 1, e)
+            return False
         except Exception as e:
-            print(f"[server] falha ao enviar para {target_name}: {e}")
+            self._delivery_failed(target_name, 1, e)
+        return True
+
+    def _registered(self, name, callback_uri, wire):
+        """Concede o lease, agenda as mensagens guardadas e negocia o formato; monta a resposta do registro."""
+        self.leases.grant(name)
+        if name in self.suspended or name in self.offline:
+            self._resume(name, callback_uri)
+        r = {"ok": True, "lease": self.leases.lease, "heartbeat": self.heartbeat_interval}
+        fmt = negotiate(wire, self.compress_threshold)
+        if fmt is not None:
+            self.wire_formats[callback_uri] = fmt
+            self.callback_modes[callback_uri] = CALLBACK_COMPACT
+            r["wire"] = fmt.spec()
+        elif self.wire_formats.pop(callback_uri, None) is not None:
+            self.callback_modes.pop(callback_uri, None)
+        return r
+
+    def _observe(self, target_name, seconds, messages=1):
+        """
+        Registra a duração de uma chamada de callback com 'messages' mensagens (ver ConsumerTracker)
+        e aplica a política quando a classificação muda.
+        1. Ao virar lento: SLOW_BATCH aumenta o lote do cliente para 'slow_batch_size';
+           SLOW_DISCONNECT guarda as pendentes na caixa offline e desconecta o cliente;
+           SLOW_DROP_PUBLIC passa a filtrar os próximos lotes em '_deliver_batch'.
+        2. Ao se recuperar, o lote volta ao tamanho padrão.
+        """
+        change = self.consumers.observe(target_name, seconds, messages)
+        if change is None:
+            return
+        if not change:
+            log.info("%s voltou ao normal (EWMA %.0f ms)", target_name, self.consumers.ewma(target_name) * 1000)
+            self.delivery.set_batch_size(target_name, None)
+            return
+        log.warning("%s classificado como consumidor lento (EWMA %.0f ms); política %s",
+                    target_name, self.consumers.ewma(target_name) * 1000, self.slow_policy)
+        if self.slow_policy == SLOW_BATCH:
+            self.delivery.set_batch_size(target_name, self.slow_batch_size)
+        elif self.slow_policy == SLOW_DISCONNECT:
+            self.m_evictions.inc()
+            pending = self.delivery.discard(target_name)
+            if pending:
+                self._suspend(target_name, pending)
+            self.unregister_client(target_name)
+
+    def _publish_presence(self, change):
+        """
+        Enfileira a mudança para todos os inscritos e para o standby (chamado pelo registro, sob o
+        lock dele, então a replicação vê as entradas/saídas na ordem das versões).
+        """
+        if change.joined:
+            self.replication.publish(REPL_JOIN, [change.name, str(self.clients.get(change.name)["uri"])])
+        else:
+            self.replication.publish(REPL_LEAVE, change.name)
+        if not self.presence_subscribers:
+            return
+        event = {"epoch": self.clients.epoch, "version": change.version, "name": change.name, "online": change.joined}
+        for name, callback_uri in list(self.presence_subscribers.items()):
+            if name != change.name:
+                self.presence_feed.enqueue(name, (callback_uri, event))
+
+    def _deliver_presence(self, name, items):
+        """Entrega eventos de presença a um inscrito (worker do motor de presença)."""
+        callback_uri = items[0][0]
+        try:
+            self.pool.call(callback_uri, "presence_update", [event for _, event in items])
+        except AttributeError:
+            # o callback não implementa eventos de presença: a inscrição é cancelada
+            self.presence_subscribers.pop(name, None)
+        except Exception as e:
+            # falhas de comunicação são tratadas pelo caminho das mensagens (lease/store-and-forward);
+            # o cliente recupera os eventos perdidos com 'presence_since'
+            log.info("falha ao enviar presença para %s: %s", name, e)
+
+    def _replicate_message(self, seq, msg, payload):
+        """Envia ao standby uma mensagem gravada no histórico (chamado sob o lock do histórico)."""
+        self.replication.publish(REPL_MESSAGE, payload)
+
+    def _apply_replicated(self, kind, data):
+        """
+        Aplica no standby uma entrada vinda do primário.
+        1. REPL_MESSAGE: grava a mensagem no histórico, se for mais nova que a última gravada
+           (a cópia inicial e o fluxo podem trazer a mesma mensagem).
+        2. REPL_JOIN / REPL_LEAVE: inclui ou retira o cliente do registro, sem lease nem aviso;
+           os leases só começam a contar quando o standby assume.
+        """
+        if kind == REPL_MESSAGE:
+            msg = decode_message(data)
+            if msg["ts"] > self.history.last_ts:
+                self.history.append(msg)
+        elif kind == REPL_JOIN:
+            name, callback_uri = data
+            info = self.clients.get(name)
+            if info is not None and str(info["uri"]) != callback_uri:
+                self.clients.remove(name)
+            self.clients.add(name, {"uri": callback_uri, "last_seen": time.time()})
+        elif kind == REPL_LEAVE:
+            self.clients.remove(data)
+
+    def _resync(self, primary, r):
+        """
+        Recarrega o estado do standby a partir do primário (chamado pelo Follower ao se conectar).
+        1. O registro passa a ter exatamente os clientes de r["clients"] (com as mesmas URIs).
+        2. O histórico é copiado em páginas de RESYNC_PAGE, a partir da última mensagem que o
+           standby já tem ('get_history(since_ts=...)').
+        """
+        clients = r["clients"]
+        for name, info in self.clients.snapshot().clients.items():
+            if clients.get(name) != str(info["uri"]):
+                self.clients.remove(name)
+        for name, callback_uri in clients.items():
+            self._apply_replicated(REPL_JOIN, [name, callback_uri])
+        copied = 0
+        while True:
+            page = primary.get_history(RESYNC_PAGE, since_ts=self.history.last_ts)
+            for msg in page:
+                if msg["ts"] > self.history.last_ts:
+                    self.history.append(msg)
+                    copied += 1
+            if len(page) < RESYNC_PAGE:
+                break
+        log.info("standby sincronizado: %d clientes, %d mensagens copiadas", len(clients), copied)
+
+    def _promote(self):
+        """
+        O standby assume o papel de primário (chamado pelo Follower antes de tomar o nome no Name Server).
+        Os clientes replicados ganham um lease: quem voltar ('register_client' com o mesmo callback)
+        continua, quem não voltar expira normalmente; até lá, as mensagens já chegam a todos.
+        """
+        self.role = PRIMARY
+        for name in self.clients.names():
+            self.leases.grant(name)
+        log.warning("assumindo como primário com %d clientes e %d mensagens no histórico",
+                    len(self.clients), len(self.history))
+
+    def _replication_stats(self):
+        stats = {"role": self.role, "primary": self.replication.stats()}
+        if self.follower is not None:
+            stats["standby"] = self.follower.stats()
+        return stats
+
+    def _delivered(self, batch):
+        """Contabiliza um lote entregue: a latência de cada mensagem vai do 'ts' de envio até agora."""
+        now = time.time()
+        self.m_messages_out.inc(len(batch))
+        for _, msg, _ in batch:
+            self.m_delivery_latency.observe(now - msg["ts"])
+
+    def _delivery_failed(self, target_name, count, error):
+        self.m_delivery_failures.inc(count)
+        log.warning("falha ao enviar para %s: %s", target_name, error)
 
     def _announce_system_message(self, text):
         """
@@ -129,10 +1080,76 @@ class ChatServer:
         self.send_message("SYSTEM", "ALL", text)
 
 if __name__ == "__main__":
-    ns = locate_ns()  # procura name server (deve estar rodando)
-    with Daemon(host="192.168.15.3") as daemon:
-        uri = daemon.register(ChatServer())
-        ns.register("chat.server", uri)
-        print("[server] ChatServer registrado no nameserver como 'chat.server'")
-        print("[server] Aguardando requisições...")
+    parser = argparse.ArgumentParser(description="Servidor de chat (Pyro5)")
+    # --host/--port/--servertype/--workers/--ns-host/--ns-port (ou CHAT_HOST, CHAT_PORT, ...);
+    # com --servertype multiplex, milhares de clientes ociosos não ocupam uma thread cada
+    add_network_arguments(parser)
+    parser.add_argument("--shard", type=int, default=None, help="número deste shard (modo particionado)")
+    parser.add_argument("--shards", type=int, default=1, help="total de shards do anel")
+    parser.add_argument("--log-level", default="INFO", help="nível do log (DEBUG, INFO, WARNING, ERROR)")
+    parser.add_argument("--stats-file", default=None, help="arquivo JSON onde as métricas são gravadas periodicamente")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="intervalo (s) entre gravações das métricas")
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="mensagens/s por remetente (0 desliga o limite)")
+    parser.add_argument("--rate-burst", type=float, default=40.0, help="rajada máxima de mensagens por remetente")
+    parser.add_argument("--fanout-rate", type=float, default=2000.0, help="entregas/s por remetente em broadcasts e salas")
+    parser.add_argument("--slow-policy", default=SLOW_BATCH, choices=[SLOW_BATCH, SLOW_DROP_PUBLIC, SLOW_DISCONNECT],
+                        help="o que fazer com clientes lentos: lotes maiores, só privadas ou desconectar")
+    parser.add_argument("--slow-threshold", type=float, default=0.5,
+                        help="EWMA (s) da duração dos callbacks acima da qual o cliente é considerado lento")
+    parser.add_argument("--admission-depth", type=int, default=100000,
+                        help="mensagens pendentes nas filas a partir das quais novos envios são recusados (0 desliga)")
+    parser.add_argument("--standby", action="store_true",
+                        help="sobe como standby do servidor já registrado e assume se ele cair")
+    parser.add_argument("--failover-timeout", type=float, default=2.0,
+                        help="segundos sem notícias do primário até o standby assumir")
+    parser.add_argument("--replication-interval", type=float, default=0.5,
+                        help="intervalo (s) entre pings do primário para o standby")
+    parser.add_argument("--data-dir", default=".",
+                        help="pasta onde ficam 'history', 'offline' e 'attachments' (um standby na mesma máquina usa outra)")
+    parser.add_argument("--attachment-chunk", type=int, default=256,
+                        help="tamanho máximo (KB) de cada pedaço de upload/download de anexos")
+    parser.add_argument("--attachment-max-size", type=int, default=64,
+                        help="tamanho máximo (MB) de um anexo")
+    parser.add_argument("--compress-threshold", type=int, default=COMPRESS_THRESHOLD,
+                        help="bytes a partir dos quais os frames compactos são comprimidos com zlib")
+    parser.add_argument("--search-max", type=int, default=200000,
+                        help="mensagens mais recentes cobertas pelo índice de busca (0 = todas)")
+    args = parser.parse_args()
+    if args.shard is not None and args.servertype == MULTIPLEX:
+        parser.error("--shard exige --servertype thread: os repasses entre shards bloqueariam o laço de eventos")
+    configure_logging(args.log_level)
+    configure_daemon(args.servertype, args.workers)
+
+    ns = locate_ns(host=args.ns_host, port=args.ns_port)  # procura name server (deve estar rodando)
+    options = {"stats_file": args.stats_file, "stats_interval": args.stats_interval,
+             "rate_limit": args.rate_limit, "rate_burst": args.rate_burst,
+             "fanout_rate": args.fanout_rate, "admission_depth": args.admission_depth,
+             "slow_policy": args.slow_policy, "slow_threshold": args.slow_threshold,
+             "standby": args.standby, "failover_timeout": args.failover_timeout,
+             "replication_interval": args.replication_interval,
+             "attachment_chunk": args.attachment_chunk * 1024,
+             "attachment_max_size": args.attachment_max_size * 1024 * 1024,
+             "compress_threshold": args.compress_threshold, "search_max": args.search_max}
+    history_dir = os.path.join(args.data_dir, "history")
+    offline_dir = os.path.join(args.data_dir, "offline")
+    attachments_dir = os.path.join(args.data_dir, "attachments")
+    if args.shard is None:
+        name, server = SERVER_NAME, ChatServer(history_dir=history_dir, offline_dir=offline_dir,
+                                               attachments_dir=attachments_dir, **options)
+    else:
+        relay = ShardRelay(args.shard, args.shards, ns_host=args.ns_host, ns_port=args.ns_port)
+        name, server = relay.name, ChatServer(history_dir=os.path.join(history_dir, relay.name),
+                                              offline_dir=os.path.join(offline_dir, relay.name),
+                                              attachments_dir=os.path.join(attachments_dir, relay.name),
+                                              relay=relay, **options)
+    with Daemon(host=args.host, port=args.port) as daemon:
+        uri = daemon.register(server)
+        if args.standby:
+            # o nome só é tomado no Name Server quando o primário cair (ver 'follow')
+            server.follow(str(uri), name, args.ns_host, args.ns_port)
+            log.info("ChatServer em standby de '%s' (%s, servidor '%s')", name, uri, args.servertype)
+        else:
+            ns.register(name, uri)
+            log.info("ChatServer registrado no nameserver como '%s' (%s, servidor '%s')", name, uri, args.servertype)
+        log.info("Aguardando requisições...")
         daemon.requestLoop()
@@ -0,0 +1,126 @@
+import bisect
+import hashlib
+import logging
+import threading
+from Pyro5.api import locate_ns
+from Pyro5.errors import CommunicationError, NamingError
+from proxy_pool import ProxyPool
+from delivery import DeliveryEngine, DROP_OLDEST
+
+# nome (no Name Server) do servidor único e prefixo dos shards no modo particionado
+SERVER_NAME = "chat.server"
+SHARD_PREFIX = "chat.server.shard-"
+
+log = logging.getLogger("chat.shard")
+
+
+def shard_name(shard_id: int) -> str:
+    return f"{SHARD_PREFIX}{shard_id}"
+
+
+class HashRing:
+    """
+    Anel de hash consistente: decide o shard "casa" de cada usuário.
+    Cada shard ocupa 'vnodes' pontos do anel; o usuário pertence ao primeiro ponto
+    depois do hash do seu nome. Adicionar/remover um shard só move os usuários vizinhos.
+    """
+    def __init__(self, nodes, vnodes: int = 64):
+        points = []
+        for node in nodes:
+            for v in range(vnodes):
+                points.append((self._hash(f"{node}#{v}"), node))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+class ShardRelay:
+    """
+    Ligação de um ChatServer com os demais shards.
+    1. 'home' diz qual shard atende um usuário (anel fixo com os 'shards' shards configurados).
+    2. Mensagens privadas para usuários de outro shard seguem por 'forward_private' (síncrono,
+       para que erros como 'destinatario_nao_encontrado' voltem ao remetente).
+    3. Broadcasts e mensagens de sala vão para todos os outros shards por 'broadcast': uma fila
+       ordenada por shard (DeliveryEngine) agrupa as mensagens em chamadas 'relay_batch'.
+    4. As URIs dos shards vêm do Name Server e ficam em cache até uma falha de comunicação.
+    5. 'forward_private', 'call' (ex: 'list_clients', 'download_chunk' nos outros shards) esperam
+       a resposta do outro shard dentro do método remoto que os chamou. Por isso o modo
+       particionado exige o Daemon 'thread': no 'multiplex' a espera pararia o laço de eventos
+       inteiro, e dois shards repassando um para o outro se travariam até o timeout do proxy.
+       O ChatServer recusa essa combinação. Só 'broadcast' é assíncrono (fila por shard).
+    """
+    def __init__(self, shard_id: int, shards: int, ns_host: str = None, ns_port: int = None):
+        self.shard_id = shard_id
+        self.name = shard_name(shard_id)
+        self.shards = [shard_name(i) for i in range(shards)]
+        self.ring = HashRing(self.shards)
+        self.ns_host = ns_host
+        self.ns_port = ns_port
+        self.pool = ProxyPool(timeout=5)
+        self._uris = {}
+        self._lock = threading.Lock()
+        self.engine = DeliveryEngine(self._relay_batch, workers=max(1, min(4, shards - 1)),
+                                     high_water=100000, overflow=DROP_OLDEST,
+                                     batch_size=256, batch_window=0.005)
+
+    def home(self, user: str) -> str:
+        return self.ring.node_for(user)
+
+    def is_local(self, user: str) -> bool:
+        return self.home(user) == self.name
+
+    def peers(self):
+        return [s for s in self.shards if s != self.name]
+
+    def _uri(self, shard):
+        with self._lock:
+            uri = self._uris.get(shard)
+        if uri is None:
+            ns = locate_ns(host=self.ns_host, port=self.ns_port)
+            uri = ns.lookup(shard)
+            with self._lock:
+                self._uris[shard] = uri
+        return uri
+
+    def _forget(self, shard):
+        """Descarta a URI em cache (o shard pode ter reiniciado em outra porta)."""
+        with self._lock:
+            uri = self._uris.pop(shard, None)
+        if uri is not None:
+            self.pool.evict(uri)
+
+    def call(self, shard, method, *args):
+        """Chamada síncrona a outro shard; em falha a URI é esquecida e a exceção repassada."""
+        try:
+            return self.pool.call(self._uri(shard), method, *args)
+        except (CommunicationError, NamingError):
+            self._forget(shard)
+            raise
+
+    def forward_private(self, msg: dict):
+        """Entrega uma mensagem privada pelo shard casa do destinatário."""
+        shard = self.home(msg["to"])
+        try:
+            return self.call(shard, "relay_private", msg)
+        except (CommunicationError, NamingError) as e:
+            log.warning("%s indisponível: %s", shard, e)
+            return {"ok": False, "error": "shard_indisponivel"}
+
+    def broadcast(self, msg: dict, room: str = None):
+        """Enfileira 'msg' para todos os outros shards (não bloqueia)."""
+        for shard in self.peers():
+            self.engine.enqueue(shard, (msg, room))
+
+    def _relay_batch(self, shard, items):
+        try:
+            self.call(shard, "relay_batch", [[msg, room] for msg, room in items])
+        except (CommunicationError, NamingError) as e:
+            log.warning("falha ao repassar %d mensagens para %s: %s", len(items), shard, e)
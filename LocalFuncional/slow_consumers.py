@@ -0,0 +1,78 @@
+import threading
+
+# políticas para destinatários classificados como lentos
+SLOW_BATCH = "batch"              # entrega em lotes maiores (menos chamadas remotas)
+SLOW_DROP_PUBLIC = "drop_public"  # descarta broadcasts e mensagens de sala; só privadas são entregues
+SLOW_DISCONNECT = "disconnect"    # desconecta (as pendentes vão para a caixa store-and-forward)
+SLOW_POLICIES = (SLOW_BATCH, SLOW_DROP_PUBLIC, SLOW_DISCONNECT)
+
+
+class ConsumerTracker:
+    """
+    Latência de entrega por destinatário (média móvel exponencial, EWMA) e classificação dos lentos.
+    1. 'observe' recebe a duração de cada chamada de callback: ewma = alpha * amostra + (1 - alpha) * ewma.
+    2. Depois de 'min_samples' amostras, um destinatário com ewma acima de 'threshold' segundos
+       passa a ser lento; volta ao normal só quando o ewma cai abaixo de 'threshold * recover'
+       (histerese, para não alternar a cada amostra).
+    3. 'observe' retorna True quando o destinatário acabou de virar lento, False quando acabou de
+       se recuperar e None se a classificação não mudou.
+    4. 'threshold' vale para uma chamada de até 'batch_size' mensagens. A amostra de uma chamada
+       maior ('messages' > 'batch_size') entra como a duração equivalente de um lote normal
+       (segundos / messages * batch_size): os lotes maiores da política SLOW_BATCH não inflam o
+       EWMA, e o destinatário pode se recuperar.
+    """
+    def __init__(self, threshold: float = 0.5, alpha: float = 0.2, recover: float = 0.5, min_samples: int = 3,
+                 batch_size: int = None):
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.recover_below = threshold * recover
+        self.min_samples = min_samples
+        self._ewma = {}
+        self._samples = {}
+        self._slow = set()
+        self._lock = threading.Lock()
+        self.classified = 0
+        self.recovered = 0
+
+    def observe(self, name, seconds: float, messages: int = 1):
+        if self.batch_size and messages > self.batch_size:
+            seconds = seconds / messages * self.batch_size
+        with self._lock:
+            ewma = self._ewma.get(name)
+            ewma = seconds if ewma is None else self.alpha * seconds + (1 - self.alpha) * ewma
+            self._ewma[name] = ewma
+            samples = self._samples[name] = self._samples.get(name, 0) + 1
+            if name in self._slow:
+                if ewma < self.recover_below:
+                    self._slow.discard(name)
+                    self.recovered += 1
+                    return False
+            elif samples >= self.min_samples and ewma > self.threshold:
+                self._slow.add(name)
+                self.classified += 1
+                return True
+            return None
+
+    def is_slow(self, name) -> bool:
+        return name in self._slow
+
+    def ewma(self, name):
+        return self._ewma.get(name)
+
+    def forget(self, name):
+        """Esquece o destinatário (ex: saiu do chat). Retorna True se ele estava classificado como lento."""
+        with self._lock:
+            self._ewma.pop(name, None)
+            self._samples.pop(name, None)
+            if name in self._slow:
+                self._slow.discard(name)
+                return True
+            return False
+
+    def stats(self):
+        """Destinatários lentos com o ewma atual (ms) e os totais de classificações e recuperações."""
+        with self._lock:
+            slow = {name: round(self._ewma[name] * 1000, 1) for name in self._slow}
+            return {"tracked": len(self._ewma), "slow": slow,
+                    "classified": self.classified, "recovered": self.recovered}
@@ -0,0 +1,109 @@
+"""
+Teste de estresse do registro de clientes do ChatServer (entradas, saídas e envios concorrentes).
+
+1. Sobe, no mesmo processo, um ChatServer (chamado diretamente, sem Pyro) e um Daemon com
+   callbacks que só contam as mensagens recebidas.
+2. 'threads' threads repetem 'rounds' vezes: registrar um nome, mandar broadcasts e
+   mensagens privadas para nomes aleatórios (que podem ter acabado de sair), listar os
+   clientes e desregistrar.
+3. Ao mesmo tempo, uma thread leitora confere que cada retrato do registro é consistente
+   (versão nunca diminui; o retrato não muda enquanto é iterado).
+4. No fim verifica que nenhuma chamada levantou exceção, que o registro ficou vazio e que a
+   versão final é exatamente o número de entradas + saídas.
+
+Uso: python stress_registry.py [threads] [rounds]
+"""
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from Pyro5.api import Daemon, expose
+from server import ChatServer
+
+
+@expose
+class CountingCallback:
+    def __init__(self, counter):
+        self.counter = counter
+
+    def receive(self, msg):
+        self.counter.append(1)
+
+    def receive_batch(self, msgs):
+        self.counter.extend([1] * len(msgs))
+
+    def receive_encoded(self, payloads):
+        self.counter.extend([1] * len(payloads))
+
+
+def main(threads=32, rounds=20):
+    history_dir = tempfile.mkdtemp(prefix="chat-stress-")
+    server = ChatServer(history_dir=history_dir, queue_high_water=10 ** 6, batch_window=0.0)
+    received = []
+    daemon = Daemon(host="127.0.0.1")
+    uri = str(daemon.register(CountingCallback(received)))
+    threading.Thread(target=daemon.requestLoop, daemon=True).start()
+
+    names = [f"user{i}" for i in range(threads)]
+    errors = []
+    done = threading.Event()
+
+    def worker(name):
+        rnd = random.Random(name)
+        try:
+            for r in range(rounds):
+                assert server.register_client(name, uri)["ok"]
+                for _ in range(5):
+                    server.send_message(name, "ALL", f"{name} rodada {r}")
+                    server.send_message(name, rnd.choice(names), "oi")
+                server.list_clients()
+                assert server.unregister_client(name)["ok"]
+        except Exception as e:
+            errors.append(f"{name}: {e!r}")
+
+    def reader():
+        last = 0
+        while not done.is_set():
+            snap = server.clients.snapshot()
+            if snap.version < last:
+                errors.append(f"versão voltou de {last} para {snap.version}")
+            last = snap.version
+            size = len(snap.clients)
+            if sum(1 for _ in snap.clients.items()) != size:
+                errors.append("retrato mudou durante a iteração")
+
+    start = time.time()
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    workers = [threading.Thread(target=worker, args=(name,)) for name in names]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    done.set()
+    reader_thread.join()
+    elapsed = time.time() - start
+
+    while server.delivery.depth():
+        time.sleep(0.05)
+    expected_version = 2 * threads * rounds
+    print(f"{threads} threads x {rounds} rodadas em {elapsed:.2f}s")
+    print(f"versão do registro: {server.clients.version} (esperado {expected_version})")
+    print(f"clientes restantes: {len(server.clients)}")
+    print(f"mensagens entregues: {len(received)}")
+    print(f"erros: {len(errors)}")
+    for e in errors[:10]:
+        print("  ", e)
+
+    daemon.shutdown()
+    server.history.close()
+    shutil.rmtree(history_dir, ignore_errors=True)
+    ok = not errors and len(server.clients) == 0 and server.clients.version == expected_version
+    print("OK" if ok else "FALHOU")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(*(int(a) for a in sys.argv[1:3])))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# os módulos do LocalFuncional são importados pelo nome (como quando server.py roda da própria pasta)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,50 @@
+import hashlib
+
+from attachments import AttachmentStore
+
+DATA = bytes(range(256)) * 40
+
+
+def upload(store, owner="ana", sha256=None):
+    r = store.begin(owner, "dados.bin", len(DATA), sha256)
+    assert r["ok"]
+    return r["upload_id"]
+
+
+def test_resume_from_the_offset_the_server_reports(tmp_path):
+    store = AttachmentStore(str(tmp_path), chunk_size=1024)
+    upload_id = upload(store, sha256=hashlib.sha256(DATA).hexdigest())
+    assert store.write("ana", upload_id, 0, DATA[:1024]) == {"ok": True, "offset": 1024}
+    # um pedaço fora de ordem é recusado com o offset esperado, de onde o cliente retoma
+    r = store.write("ana", upload_id, 3072, DATA[3072:4096])
+    assert r == {"ok": False, "error": "offset_invalido", "offset": 1024}
+    offset = r["offset"]
+    while offset < len(DATA):
+        offset = store.write("ana", upload_id, offset, DATA[offset:offset + 1024])["offset"]
+    r = store.finish("ana", upload_id)
+    assert r["ok"] and r["attachment"]["id"] == hashlib.sha256(DATA).hexdigest()
+    assert store.read(r["attachment"]["id"], 0, len(DATA))["data"] == DATA[:1024]
+
+
+def test_resent_chunk_is_acknowledged_without_writing_twice(tmp_path):
+    store = AttachmentStore(str(tmp_path), chunk_size=4096)
+    upload_id = upload(store)
+    store.write("ana", upload_id, 0, DATA[:4096])
+    # reenvio após um timeout: confirma o offset atual e não grava de novo
+    assert store.write("ana", upload_id, 0, DATA[:4096]) == {"ok": True, "offset": 4096}
+    assert store.stats()["bytes_in"] == 4096
+    store.write("ana", upload_id, 4096, DATA[4096:8192])
+    store.write("ana", upload_id, 8192, DATA[8192:])
+    r = store.finish("ana", upload_id)
+    assert r["ok"] and r["attachment"]["size"] == len(DATA)
+
+
+def test_only_the_owner_can_write_or_finish(tmp_path):
+    store = AttachmentStore(str(tmp_path), chunk_size=len(DATA))
+    upload_id = upload(store)
+    assert store.write("bia", upload_id, 0, DATA)["error"] == "upload_desconhecido"
+    assert store.write("ana", upload_id, 0, DATA)["ok"]
+    assert store.finish("bia", upload_id)["error"] == "upload_desconhecido"
+    assert store.finish("ana", upload_id)["ok"]
+    # depois do finish o upload fechou: um pedaço atrasado não é aceito
+    assert store.write("ana", upload_id, 0, DATA)["error"] == "upload_desconhecido"
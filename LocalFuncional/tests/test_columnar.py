@@ -0,0 +1,33 @@
+from columnar import ColumnarHistory
+
+
+def msg(i, sender, to="ALL", **extra):
+    return dict({"from": sender, "to": to, "text": f"mensagem {i} ção", "ts": float(i)}, **extra)
+
+
+def test_window_keeps_the_latest_messages_in_order():
+    store = ColumnarHistory(max_messages=1000)
+    for i in range(5000):
+        store.append(msg(i, f"u{i % 7}", **({"attachment": {"id": i}} if i % 1000 == 999 else {})))
+    assert len(store) == 1000
+    assert [m["ts"] for m in store.slice(0, 3)] == [4000.0, 4001.0, 4002.0]
+    assert store.get(999) == msg(4999, "u1", attachment={"id": 4999})
+    assert store.index_after(4500.0) == 501 and store.index_before(4500.0) == 500
+
+
+def test_name_table_only_keeps_names_still_in_the_window():
+    store = ColumnarHistory(max_messages=1000)
+    # cada mensagem de um remetente novo (nomes efêmeros, ex: convidados)
+    for i in range(20000):
+        store.append(msg(i, f"convidado{i}", to="ALL" if i % 2 else f"convidado{i - 1}"))
+    # sem a reconstrução, a tabela teria os 20000 nomes
+    assert store.names() <= 2 * len(store) + 1
+    for i in range(len(store)):
+        m = store.get(i)
+        n = int(m["ts"])
+        assert m["from"] == f"convidado{n}"
+        assert m["to"] == ("ALL" if n % 2 else f"convidado{n - 1}")
+    # nomes novos depois da reconstrução recebem ids sem colidir com os remapeados
+    store.append(msg(20000, "convidado0"))
+    assert store.get(len(store) - 1)["from"] == "convidado0"
+    assert store.get(len(store) - 2)["from"] == "convidado19999"
@@ -0,0 +1,40 @@
+import time
+
+from offline_store import OfflineStore
+
+
+def test_take_returns_memory_then_disk_in_order(tmp_path):
+    store = OfflineStore(str(tmp_path), memory_limit=2, max_messages=100)
+    store.put("ana", [b"m0", b"m1", b"m2"])
+    store.put("ana", [b"m3"])
+    assert store.stats()["in_memory"] == 2 and store.stats()["on_disk"] == 2
+    assert store.take("ana") == [b"m0", b"m1", b"m2", b"m3"]
+    assert store.take("ana") == [] and store.pending() == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_disk_boxes_survive_a_restart(tmp_path):
+    store = OfflineStore(str(tmp_path), memory_limit=1)
+    store.put("bia", [b"a", b"b", b"c"])
+    # a parte em memória se perde; a do disco volta, em ordem
+    again = OfflineStore(str(tmp_path), memory_limit=1)
+    assert again.pending("bia") == 2
+    assert again.take("bia") == [b"b", b"c"]
+
+
+def test_truncated_record_at_the_end_is_ignored(tmp_path):
+    store = OfflineStore(str(tmp_path), memory_limit=0)
+    store.put("caio", [b"inteira", b"cortada"])
+    path = store._path("caio")
+    with open(path, "rb+") as f:
+        f.truncate(len(f.read()) - 3)
+    assert OfflineStore(str(tmp_path)).take("caio") == [b"inteira"]
+
+
+def test_cap_and_ttl(tmp_path):
+    store = OfflineStore(str(tmp_path), memory_limit=10, max_messages=3, ttl=0.05)
+    assert store.put("ana", [b"1", b"2", b"3", b"4"]) == 3
+    assert store.stats()["dropped"] == 1
+    time.sleep(0.1)
+    assert store.take("ana") == []
+    assert store.stats()["expired"] == 3
@@ -0,0 +1,36 @@
+from ratelimit import SenderLimiter, TokenBucket
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(rate=10.0, capacity=5.0, now=0.0)
+    for _ in range(5):
+        assert bucket.wait_time(1, 0.0) == 0.0
+        bucket.take(1)
+    assert bucket.wait_time(1, 0.0) == 0.1
+    # meio segundo depois há 5 fichas de novo, não mais que a capacidade
+    assert bucket.wait_time(1, 0.5) == 0.0 and bucket.tokens == 5.0
+    assert bucket.wait_time(1, 10.0) == 0.0 and bucket.tokens == 5.0
+
+
+def test_cost_above_capacity_needs_a_full_bucket_and_goes_negative():
+    bucket = TokenBucket(rate=10.0, capacity=5.0, now=0.0)
+    assert bucket.wait_time(50, 0.0) == 0.0
+    bucket.take(50)
+    assert bucket.tokens == -45.0
+    # espera proporcional ao que ficou devendo: (1 + 45) fichas a 10 por segundo
+    assert abs(bucket.wait_time(1, 0.0) - 4.6) < 1e-9
+
+
+def test_limiter_charges_both_buckets_only_when_both_can_pay():
+    limiter = SenderLimiter(rate=100.0, burst=100.0, fanout_rate=1.0, fanout_burst=10.0)
+    assert limiter.admit("ana", fanout=10) == 0.0
+    wait = limiter.admit("ana", fanout=10)
+    assert wait > 0 and limiter.rejected == 1
+    # a mensagem recusada não foi cobrada do balde de mensagens
+    messages, deliveries = limiter._buckets["ana"]
+    assert messages.tokens >= 99.0
+    # mensagens privadas (sem fanout) continuam passando
+    assert limiter.admit("ana") == 0.0
+    limiter.forget("ana")
+    assert limiter.admit("ana", fanout=10) == 0.0
+    assert limiter.stats()["senders"] == 1
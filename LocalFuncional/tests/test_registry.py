@@ -0,0 +1,72 @@
+import threading
+
+from registry import ClientRegistry
+
+
+def test_snapshot_is_not_changed_by_later_writes():
+    registry = ClientRegistry()
+    registry.add("ana", 1)
+    before = registry.snapshot()
+    registry.add("bia", 2)
+    registry.remove("ana")
+    # o retrato antigo continua o mesmo: leitores iteram sem lock
+    assert before.version == 1 and dict(before.clients) == {"ana": 1}
+    assert registry.version == 3 and dict(registry.snapshot().clients) == {"bia": 2}
+
+
+def test_snapshot_is_read_only():
+    registry = ClientRegistry()
+    registry.add("ana", 1)
+    try:
+        registry.snapshot().clients["bia"] = 2
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("o retrato aceitou escrita")
+    assert "bia" not in registry
+
+
+def test_add_existing_name_and_remove_missing_name():
+    registry = ClientRegistry()
+    assert registry.add("ana", 1)
+    assert not registry.add("ana", 2)
+    assert registry.get("ana") == 1
+    assert registry.remove("bia") is None
+    assert registry.remove("ana") == 1
+    assert registry.version == 2
+
+
+def test_changes_since_and_presence_delta():
+    registry = ClientRegistry(changelog=3)
+    for name in ("ana", "bia", "caio"):
+        registry.add(name, name)
+    registry.remove("bia")
+    assert registry.changes_since(registry.version) == (4, [])
+    current, changes = registry.changes_since(2)
+    assert current == 4 and [(c.name, c.joined) for c in changes] == [("caio", True), ("bia", False)]
+    # a versão 0 já saiu do log (só as últimas 3 mudanças ficam)
+    assert registry.changes_since(0) is None
+    delta = registry.presence_delta(1, registry.epoch)
+    assert not delta.full and delta.joined == ["caio"] and delta.left == ["bia"]
+    full = registry.presence_delta(1, "outra")
+    assert full.full and sorted(full.users) == ["ana", "caio"]
+
+
+def test_concurrent_writers_keep_every_change():
+    registry = ClientRegistry()
+    seen = []
+    registry.on_change = seen.append
+
+    def churn(prefix):
+        for i in range(200):
+            registry.add(f"{prefix}{i}", i)
+            registry.remove(f"{prefix}{i}")
+
+    threads = [threading.Thread(target=churn, args=(p,)) for p in "abcd"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert registry.version == 1600 and len(registry) == 0
+    # os observadores recebem as mudanças na ordem das versões, sem buracos
+    assert [c.version for c in seen] == list(range(1, 1601))
@@ -0,0 +1,30 @@
+from slow_consumers import ConsumerTracker
+
+
+def test_classifies_after_min_samples_and_recovers_with_hysteresis():
+    tracker = ConsumerTracker(threshold=0.5, alpha=0.5, min_samples=3)
+    assert tracker.observe("ana", 1.0) is None
+    assert tracker.observe("ana", 1.0) is None
+    assert tracker.observe("ana", 1.0) is True and tracker.is_slow("ana")
+    # abaixo do limite, mas ainda acima da metade dele: continua lento
+    assert tracker.observe("ana", 0.1) is None
+    assert tracker.observe("ana", 0.1) is None and tracker.ewma("ana") < 0.5
+    assert tracker.observe("ana", 0.1) is False and not tracker.is_slow("ana")
+
+
+def test_larger_batches_count_as_a_normal_batch():
+    tracker = ConsumerTracker(threshold=0.5, alpha=0.5, min_samples=1, batch_size=64)
+    assert tracker.observe("ana", 0.8, 64) is True
+    # 4x mais mensagens no mesmo 0,8 s: 0,2 s por lote de 64, o cliente melhorou e se recupera
+    # (medida por chamada, a EWMA ficaria em 0,8 s e ele seria lento para sempre)
+    for _ in range(5):
+        tracker.observe("ana", 0.8, 256)
+    assert not tracker.is_slow("ana")
+    assert abs(tracker.ewma("ana") - 0.2) < 0.05
+
+
+def test_without_batch_size_the_call_time_is_used_as_is():
+    tracker = ConsumerTracker(threshold=0.5, min_samples=1)
+    assert tracker.observe("ana", 1.2, 256) is True
+    assert tracker.stats()["slow"] == {"ana": 1200.0}
+    assert tracker.forget("ana") and tracker.ewma("ana") is None
@@ -0,0 +1,210 @@
+"""
+Benchmark de failover (variante local): atraso da replicação e tempo até os clientes voltarem.
+
+1. Sobe um Name Server local, o primário (LocalFuncional/server.py) e um standby
+   (server.py --standby), cada um com a sua pasta de dados, e espera o standby sincronizar.
+2. N clientes simulados (um Daemon de callback; um ServerLink e um heartbeat por cliente) se
+   registram; o primeiro envia 'rate' broadcasts/s, numerados, durante 'duration' s.
+3. Lê do standby o histograma 'replication_lag' (do envio no primário até a aplicação no standby).
+4. Mata o primário (SIGKILL) e segue enviando por mais 'after' s, medindo a partir do kill:
+   - takeover_s: até o Name Server apontar 'chat.server' para o standby;
+   - first_ack_s: até o primeiro envio confirmado (o ServerLink do remetente faz o failover);
+   - all_received_s: até todos os clientes receberem a primeira mensagem enviada depois do kill;
+   - reregistered_s: até o último cliente se registrar de novo no standby.
+5. Confere quantas mensagens confirmadas pelo primário faltam no histórico do novo primário
+   (a janela de perda da replicação assíncrona) e imprime (ou grava em --out) um JSON.
+
+Uso: python bench_failover.py --clients 20 --rate 50 --duration 5 --after 5 --failover-timeout 2
+"""
+import argparse
+import json
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from bench_load import HOST, LOCAL_DIR, start_name_server, start_server, wait_for_server
+
+sys.path.insert(0, LOCAL_DIR)
+from Pyro5.api import Daemon, Proxy, locate_ns  # noqa: E402
+from Pyro5.errors import CommunicationError, NamingError  # noqa: E402
+from client import ClientCallback, ServerLink, heartbeat_loop  # noqa: E402
+from replication import STANDBY_SUFFIX  # noqa: E402
+from sharding import SERVER_NAME  # noqa: E402
+
+SEQ = re.compile(r"#(\d+)#")
+
+
+def wait_for(fn, timeout, what):
+    """Chama 'fn' até ela devolver algo verdadeiro (ou estoura RuntimeError após 'timeout' s)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            r = fn()
+            if r:
+                return r
+        except (CommunicationError, NamingError):
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{what}: tempo esgotado")
+
+
+def replication_gauge(uri):
+    with Proxy(uri) as server:
+        stats = server.get_stats()
+    return stats["gauges"]["replication"], stats["histograms"]["replication_lag"]
+
+
+def run(args):
+    ns = start_name_server(args.ns_port)
+    time.sleep(1.0)
+    common = ["--rate-limit", "0", "--failover-timeout", str(args.failover_timeout),
+              "--replication-interval", str(args.replication_interval)]
+    primary = start_server("local", args.ns_port, tempfile.mkdtemp(prefix="chat-primary-"), extra=common)
+    standby = None
+    daemon = None
+    stop = threading.Event()
+    try:
+        wait_for_server("local", args.ns_port)
+        standby = start_server("local", args.ns_port, tempfile.mkdtemp(prefix="chat-standby-"),
+                               extra=common + ["--standby"])
+        standby_uri = wait_for(lambda: locate_ns(host=HOST, port=args.ns_port).lookup(SERVER_NAME + STANDBY_SUFFIX),
+                               15.0, "standby no Name Server")
+        wait_for(lambda: replication_gauge(standby_uri)[0]["standby"]["synced"], 15.0, "sincronização do standby")
+
+        # clientes simulados: recebimentos por cliente {seq: instante}
+        received = [dict() for _ in range(args.clients)]
+        reregistered = {}
+        daemon = Daemon(host=HOST)
+        threading.Thread(target=daemon.requestLoop, daemon=True).start()
+        links = []
+        for i in range(args.clients):
+            def on_receive(msg, got=received[i]):
+                m = SEQ.match(msg["text"])
+                if m:
+                    got.setdefault(int(m.group(1)), time.time())
+            name = f"bot{i}"
+            callback_uri = daemon.register(ClientCallback(on_receive))
+            link = ServerLink(name, callback_uri, HOST, args.ns_port,
+                              on_reconnect=lambda server, name=name: reregistered.setdefault(name, time.time()))
+            r = link.register_client(name, callback_uri)
+            if not r.get("ok"):
+                raise RuntimeError(f"registro de {name} falhou: {r}")
+            threading.Thread(target=heartbeat_loop, args=(link, name, args.heartbeat, stop), daemon=True).start()
+            links.append(link)
+
+        sent_at = {}
+        acked = {}
+        errors = []
+
+        def sender(until):
+            link = links[0]
+            interval = 1.0 / args.rate
+            seq = len(sent_at)
+            next_send = time.time()
+            while time.time() < until:
+                time.sleep(max(0.0, next_send - time.time()))
+                next_send += interval
+                seq += 1
+                sent_at[seq] = time.time()
+                try:
+                    r = link.send_message("bot0", "ALL", f"#{seq}# " + "x" * args.size)
+                except CommunicationError as e:
+                    errors.append(str(e))
+                    continue
+                if r.get("ok"):
+                    acked[seq] = time.time()
+
+        sender(time.time() + args.duration)
+        time.sleep(0.5)
+        before, lag = replication_gauge(standby_uri)
+
+        # queda do primário
+        kill_at = time.time()
+        primary.kill()
+        takeover = []
+
+        def watch_ns():
+            ns_proxy = locate_ns(host=HOST, port=args.ns_port)
+            while not takeover:
+                try:
+                    if str(ns_proxy.lookup(SERVER_NAME)) == str(standby_uri):
+                        takeover.append(time.time())
+                        return
+                except (CommunicationError, NamingError):
+                    ns_proxy._pyroRelease()
+                time.sleep(0.01)
+        watcher = threading.Thread(target=watch_ns, daemon=True)
+        watcher.start()
+        first_after = len(sent_at) + 1
+        sender(time.time() + args.after)
+        time.sleep(args.drain)
+        watcher.join(timeout=1)
+        after, _ = replication_gauge(standby_uri)
+
+        # mensagens confirmadas pelo primário que não chegaram ao histórico do novo primário
+        acked_before = {seq for seq, t in acked.items() if t < kill_at}
+        with Proxy(standby_uri) as server:
+            history = server.get_history(len(sent_at) + args.clients * 4)
+        stored = {int(m.group(1)) for m in (SEQ.match(h["text"]) for h in history) if m}
+
+        first_ack = min((t for seq, t in acked.items() if seq >= first_after), default=None)
+        post_kill = [seq for seq in sorted(acked) if seq >= first_after]
+        all_received = None
+        if post_kill:
+            times = [got.get(post_kill[0]) for got in received]
+            if all(t is not None for t in times):
+                all_received = max(times)
+        since = lambda t: None if t is None else round(t - kill_at, 3)
+        return {
+            "config": {k: v for k, v in vars(args).items() if k != "out"},
+            "replication_lag_ms": lag,
+            "replicated_entries": before["standby"]["applied"],
+            "standby_resyncs": before["standby"]["resyncs"],
+            "takeover_s": since(takeover[0] if takeover else None),
+            "server_failover_s": after["standby"]["failover_s"],
+            "first_ack_s": since(first_ack),
+            "all_received_s": since(all_received),
+            "reregistered": len(reregistered),
+            "reregistered_s": since(max(reregistered.values()) if reregistered else None),
+            "sent": len(sent_at),
+            "acked_before_kill": len(acked_before),
+            "lost_after_failover": len(acked_before - stored),
+            "send_errors": len(errors),
+        }
+    finally:
+        stop.set()
+        if daemon is not None:
+            daemon.shutdown()
+        for proc in (standby, primary, ns):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de failover primário -> standby do chat Pyro5")
+    parser.add_argument("--clients", type=int, default=10, help="número de clientes simulados")
+    parser.add_argument("--rate", type=float, default=50.0, help="broadcasts/s enviados pelo primeiro cliente")
+    parser.add_argument("--duration", type=float, default=5.0, help="segundos de envio antes da queda")
+    parser.add_argument("--after", type=float, default=5.0, help="segundos de envio depois da queda")
+    parser.add_argument("--size", type=int, default=64, help="caracteres extras por mensagem")
+    parser.add_argument("--heartbeat", type=float, default=0.5, help="intervalo (s) de heartbeat dos clientes")
+    parser.add_argument("--failover-timeout", type=float, default=2.0, help="repassado ao servidor")
+    parser.add_argument("--replication-interval", type=float, default=0.5, help="repassado ao servidor")
+    parser.add_argument("--drain", type=float, default=1.0, help="segundos de espera por entregas atrasadas")
+    parser.add_argument("--ns-port", type=int, default=9191)
+    parser.add_argument("--out", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
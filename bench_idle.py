@@ -0,0 +1,148 @@
+"""
+Benchmark de clientes ociosos: conexões aceitas, threads e memória do servidor por cliente
+conectado que não faz nada, em cada tipo de servidor do Daemon Pyro5.
+
+1. Para cada modo (--modes, padrão "thread,multiplex") sobe um Name Server local e a variante
+   escolhida do servidor com CHAT_SERVERTYPE/CHAT_WORKERS (ver bench_load.py).
+2. P processos abrem N conexões ociosas no total (um proxy conectado por cliente, sem enviar nada)
+   e as mantêm abertas; conexões recusadas (pool de threads cheio) são contadas.
+3. Com todas abertas, mede RSS e número de threads do servidor e a latência de uma chamada
+   feita por um cliente ativo enquanto os ociosos seguem conectados.
+4. Imprime (ou grava em --out) um JSON por modo com os totais e o custo por cliente ocioso.
+
+Uso: python bench_idle.py --variant local --clients 2000 --procs 4 [--workers 80]
+No modo "thread", cada conexão ocupa uma thread do Daemon até fechar; com --workers menor
+que --clients, as conexões excedentes são recusadas. No modo "multiplex" não há esse limite.
+"""
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+
+from bench_load import start_name_server, start_server, wait_for_server, process_usage
+
+
+def process_threads(pid):
+    """Número de threads do processo (de /proc no Linux; None se indisponível)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("Threads:"))
+    except (OSError, StopIteration):
+        return None
+
+
+def idle_process(server_uri, count, connected, release, results):
+    """Abre 'count' conexões ociosas com o servidor e as mantém até 'release'."""
+    from Pyro5.api import Proxy
+    from Pyro5.errors import CommunicationError
+    proxies = []
+    refused = 0
+    for _ in range(count):
+        proxy = Proxy(server_uri)
+        try:
+            proxy._pyroBind()
+            proxies.append(proxy)
+        except CommunicationError:
+            refused += 1
+    results.put({"connected": len(proxies), "refused": refused})
+    connected.wait()
+    release.wait()
+    for proxy in proxies:
+        proxy._pyroRelease()
+
+
+def measure_mode(args, mode):
+    workdir = tempfile.mkdtemp(prefix="chat-idle-")
+    ns = start_name_server(args.ns_port)
+    time.sleep(1.0)
+    env = {"CHAT_SERVERTYPE": mode, "CHAT_WORKERS": str(args.workers or args.clients + 32)}
+    server = start_server(args.variant, args.ns_port, workdir, env)
+    procs = []
+    try:
+        server_uri = str(wait_for_server(args.variant, args.ns_port))
+        time.sleep(0.5)
+        _, rss0 = process_usage(server.pid)
+        threads0 = process_threads(server.pid)
+        per_proc = [args.clients // args.procs + (1 if i < args.clients % args.procs else 0) for i in range(args.procs)]
+        connected = multiprocessing.Barrier(args.procs + 1)
+        release = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        t0 = time.time()
+        for count in per_proc:
+            p = multiprocessing.Process(target=idle_process, args=(server_uri, count, connected, release, results))
+            p.start()
+            procs.append(p)
+        totals = [results.get() for _ in procs]
+        connect_s = time.time() - t0
+        connected.wait()
+        time.sleep(1.0)
+        _, rss1 = process_usage(server.pid)
+        threads1 = process_threads(server.pid)
+        call_ms = active_call_ms(server_uri)
+        release.set()
+    finally:
+        for p in procs:
+            p.join(timeout=10)
+        server.terminate()
+        ns.terminate()
+        server.wait()
+        ns.wait()
+
+    accepted = sum(t["connected"] for t in totals)
+    per_client = lambda a, b, scale=1: None if a is None or b is None or not accepted else round((b - a) * scale / accepted, 3)
+    return {
+        "servertype": mode,
+        "workers": int(env["CHAT_WORKERS"]) if mode == "thread" else None,
+        "idle_clients": args.clients,
+        "accepted": accepted,
+        "refused": sum(t["refused"] for t in totals),
+        "connect_s": round(connect_s, 3),
+        "server_threads": {"before": threads0, "after": threads1, "per_idle_client": per_client(threads0, threads1)},
+        "server_rss_mb": {"before": None if rss0 is None else round(rss0, 1),
+                          "after": None if rss1 is None else round(rss1, 1),
+                          "kb_per_idle_client": per_client(rss0, rss1, 1024)},
+        "active_call_ms": call_ms,
+    }
+
+
+def active_call_ms(server_uri, calls=20):
+    """Latência média (ms) de uma chamada leve de um cliente ativo com os ociosos conectados."""
+    from Pyro5.api import Proxy
+    from Pyro5.errors import CommunicationError
+    try:
+        with Proxy(server_uri) as proxy:
+            proxy._pyroTimeout = 10
+            proxy.list_rooms()
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                proxy.list_rooms()
+            return round((time.perf_counter() - t0) * 1000 / calls, 3)
+    except CommunicationError:
+        return None  # sem thread livre para o cliente ativo (modo thread com o pool esgotado)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de clientes ociosos por tipo de servidor Pyro5")
+    parser.add_argument("--variant", choices=["local", "raiz"], default="local")
+    parser.add_argument("--modes", default="thread,multiplex", help="tipos de servidor, separados por vírgula")
+    parser.add_argument("--clients", type=int, default=1000, help="conexões ociosas")
+    parser.add_argument("--procs", type=int, default=4, help="processos que abrem as conexões")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="threads do Daemon no modo thread (padrão: suficientes para todos os clientes)")
+    parser.add_argument("--ns-port", type=int, default=9191)
+    parser.add_argument("--out", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+    args.procs = max(1, min(args.procs, args.clients))
+
+    report = {"config": {k: v for k, v in vars(args).items() if k != "out"},
+              "results": [measure_mode(args, mode.strip()) for mode in args.modes.split(",") if mode.strip()]}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Benchmark de carga do chat: latência de entrega, vazão e consumo do servidor.
+
+1. Sobe um Name Server local e a variante escolhida do servidor:
+     raiz  -> servidor.py (ChatServer com receive_message)
+     local -> LocalFuncional/server.py (ChatServer com receive/receive_encoded)
+2. Cria N clientes simulados espalhados em P processos; cada processo tem o seu Daemon
+   de callback, e cada cliente o seu proxy para o servidor.
+3. Cada cliente envia 'rate' mensagens/s durante 'duration' s, com a fração 'broadcast'
+   de mensagens públicas e o restante privadas para um cliente aleatório.
+4. O texto de cada mensagem carrega o instante de envio; o callback calcula a latência
+   ponta a ponta ao receber (todos os processos usam o mesmo relógio da máquina).
+5. Ao fim, imprime (ou grava em --out) um JSON com percentis de latência (p50/p95/p99),
+   mensagens/s e CPU/RSS do processo servidor, para comparar execuções.
+
+Uso: python bench_load.py --variant local --clients 50 --procs 4 --duration 10 --rate 2 --broadcast 0.2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DIR = os.path.join(ROOT_DIR, "LocalFuncional")
+HOST = "127.0.0.1"
+SERVER_NAMES = {"raiz": "ChatService.Server", "local": "chat.server"}
+STAMP = re.compile(r"@@(\d+\.\d+)@@")
+
+
+# ------------------------------------------------------------------ processos auxiliares
+
+def start_name_server(port):
+    return subprocess.Popen([sys.executable, "-m", "Pyro5.nameserver", "-n", HOST, "-p", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_server(variant, ns_port, workdir, env=None, extra=()):
+    """
+    Inicia o servidor escolhido escutando em HOST, com a saída descartada
+    ('env': variáveis extras; 'extra': argumentos extras de linha de comando da variante local).
+    """
+    if variant == "raiz":
+        code = (f"import sys; sys.path.insert(0, {ROOT_DIR!r}); import servidor; "
+                f"servidor.NS_HOST = {HOST!r}; servidor.NS_PORT = {ns_port}; "
+                f"servidor.SERVER_HOST = {HOST!r}; servidor.start_server()")
+        cmd = [sys.executable, "-c", code]
+    else:
+        cmd = [sys.executable, os.path.join(LOCAL_DIR, "server.py"),
+               "--host", HOST, "--ns-host", HOST, "--ns-port", str(ns_port), *extra]
+    return subprocess.Popen(cmd, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            env=None if env is None else {**os.environ, **env})
+
+
+def wait_for_server(variant, ns_port, timeout=15.0):
+    from Pyro5.api import locate_ns
+    from Pyro5.errors import NamingError, CommunicationError
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            return locate_ns(host=HOST, port=ns_port).lookup(SERVER_NAMES[variant])
+        except (NamingError, CommunicationError):
+            time.sleep(0.2)
+    raise RuntimeError("servidor não registrou no Name Server a tempo")
+
+
+def process_usage(pid):
+    """(segundos de CPU, RSS em MB) do processo, lidos de /proc (Linux) ou do psutil, se houver."""
+    try:
+        import psutil
+        p = psutil.Process(pid)
+        t = p.cpu_times()
+        return t.user + t.system, p.memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+        return cpu, rss
+    except (OSError, StopIteration):
+        return None, None
+
+
+# ------------------------------------------------------------------ clientes simulados
+
+def client_process(variant, names, all_names, args, server_uri, barrier, results):
+    """Executa um grupo de clientes simulados (um Daemon de callback por processo)."""
+    from Pyro5.api import Daemon, Proxy, expose
+    latencies = []
+    lat_lock = threading.Lock()
+
+    def record(text):
+        m = STAMP.search(text)
+        if m:
+            lat = time.time() - float(m.group(1))
+            with lat_lock:
+                latencies.append(lat)
+
+    if variant == "local":
+        sys.path.insert(0, LOCAL_DIR)
+        from client import ClientCallback
+
+        def make_callback():
+            return ClientCallback(lambda msg: record(msg["text"]))
+    else:
+        sys.path.insert(0, ROOT_DIR)
+        from client import ClienteChatCallback
+
+        @expose
+        class BenchCallback(ClienteChatCallback):
+            def receive_message(self, message, is_private):
+                record(message)
+
+        def make_callback():
+            return BenchCallback("bench")
+
+    daemon = Daemon(host=HOST)
+    threading.Thread(target=daemon.requestLoop, daemon=True).start()
+    for name in names:
+        uri = daemon.register(make_callback())
+        with Proxy(server_uri) as server:
+            server.register_client(name, uri)
+
+    sent = 0
+    sent_lock = threading.Lock()
+
+    def drive(name):
+        nonlocal sent
+        rnd = random.Random(name)
+        interval = 1.0 / args.rate
+        with Proxy(server_uri) as server:
+            start = time.time()
+            next_send = start + rnd.random() * interval
+            last_heartbeat = start
+            n = 0
+            while time.time() - start < args.duration:
+                time.sleep(max(0.0, next_send - time.time()))
+                text = f"@@{time.time():.6f}@@ " + "x" * args.size
+                private = rnd.random() >= args.broadcast
+                to = rnd.choice(all_names) if private else None
+                if variant == "local":
+                    server.send_message(name, to or "ALL", text)
+                else:
+                    server.send_message(name, text, to)
+                n += 1
+                next_send += interval
+                if time.time() - last_heartbeat > 5:
+                    server.heartbeat(name)
+                    last_heartbeat = time.time()
+        with sent_lock:
+            sent += n
+
+    barrier.wait()
+    threads = [threading.Thread(target=drive, args=(name,)) for name in names]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    time.sleep(args.drain)
+    with lat_lock:
+        results.put({"sent": sent, "latencies": list(latencies)})
+    daemon.shutdown()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+# ------------------------------------------------------------------ orquestração
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="chat-bench-")
+    ns = start_name_server(args.ns_port)
+    time.sleep(1.0)
+    server = start_server(args.variant, args.ns_port, workdir)
+    procs = []
+    try:
+        server_uri = wait_for_server(args.variant, args.ns_port)
+        names = [f"bot{i}" for i in range(args.clients)]
+        groups = [names[i::args.procs] for i in range(args.procs)]
+        barrier = multiprocessing.Barrier(args.procs + 1)
+        results = multiprocessing.Queue()
+        for group in groups:
+            p = multiprocessing.Process(target=client_process,
+                                        args=(args.variant, group, names, args, str(server_uri), barrier, results))
+            p.start()
+            procs.append(p)
+        barrier.wait()
+        cpu0, _ = process_usage(server.pid)
+        t0 = time.time()
+        collected = [results.get() for _ in procs]
+        elapsed = time.time() - t0
+        cpu1, rss = process_usage(server.pid)
+    finally:
+        for p in procs:
+            p.join(timeout=5)
+        server.terminate()
+        ns.terminate()
+        server.wait()
+        ns.wait()
+
+    latencies = sorted(lat for r in collected for lat in r["latencies"])
+    sent = sum(r["sent"] for r in collected)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "sent": sent,
+        "delivered": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "sent_per_s": round(sent / args.duration, 1),
+        "delivered_per_s": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+            "mean": ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+        "server": {
+            "cpu_s": None if cpu1 is None else round(cpu1 - cpu0, 3),
+            "cpu_pct": None if cpu1 is None else round(100 * (cpu1 - cpu0) / elapsed, 1),
+            "rss_mb": None if rss is None else round(rss, 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga do chat Pyro5")
+    parser.add_argument("--variant", choices=sorted(SERVER_NAMES), default="local")
+    parser.add_argument("--clients", type=int, default=20, help="número de clientes simulados")
+    parser.add_argument("--procs", type=int, default=2, help="processos que hospedam os clientes")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos de envio")
+    parser.add_argument("--rate", type=float, default=1.0, help="mensagens/s por cliente")
+    parser.add_argument("--broadcast", type=float, default=0.2, help="fração de mensagens públicas (0..1)")
+    parser.add_argument("--size", type=int, default=64, help="caracteres extras por mensagem")
+    parser.add_argument("--drain", type=float, default=2.0, help="segundos de espera por entregas atrasadas")
+    parser.add_argument("--ns-port", type=int, default=9190)
+    parser.add_argument("--out", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+    args.procs = max(1, min(args.procs, args.clients))
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark do formato das mensagens no fio: bytes por mensagem e custo de codificar/decodificar
+cada forma de entrega, sem rede (o mesmo trabalho que o Pyro5 faz em cada chamada).
+
+1. Gera mensagens com textos curtos e longos (palavras sorteadas, semente fixa) e as entrega em
+   lotes de --batch mensagens, como as chamadas de callback dos dois servidores:
+   - local: 'receive_batch' com dicionários, 'receive_encoded' com o JSON já codificado e
+     'receive_compact' com frames posicionais (codec.WireFormat), em cada serializador
+     disponível, com e sem zlib;
+   - raiz: 'receive_batch' com os textos prontos e 'receive_compact' com [quadro, privado] por
+     mensagem (os registros de protocolo.py no mesmo codec.WireFormat), idem.
+2. Um broadcast da raiz para --room destinatários: os textos prontos (o marshal copia o mesmo
+   texto em cada chamada) contra 'receive_compact' com o quadro montado por destinatário ou uma
+   vez só (codec.FrameCache, como em servidor.py); os µs são por destinatário.
+3. Uma página de histórico (--page mensagens): 'get_history' (dicionários, serpent, o serializador
+   padrão do proxy do cliente) contra 'get_history_packed' (um frame, marshal).
+4. Cada caso mede os bytes da chamada serializada e os µs por mensagem para montar + serializar
+   (servidor) e desserializar + decodificar até o texto/dicionário exibido (cliente).
+5. Imprime (ou grava em --out) um JSON por caso.
+
+Uso: python bench_wire.py [--messages 2000] [--batch 16] [--room 1000] [--page 200] [--out wire.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from Pyro5.serializers import serializers
+
+import protocolo
+import codec  # LocalFuncional/codec.py (protocolo.py já põe a pasta no sys.path)
+
+WORDS = ("oi tudo bem com você hoje amanhã reunião às dez horas projeto servidor cliente mensagem "
+         "sala histórico anexo arquivo enviado recebido obrigado até logo combinado certo").split()
+
+
+def make_messages(count, words, rng):
+    users = [f"usuario{i}" for i in range(20)]
+    msgs = []
+    ts = time.time()
+    for i in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(words))
+        to = rng.choice(["ALL", "#geral", rng.choice(users)])
+        msgs.append({"from": rng.choice(users), "to": to, "text": text, "ts": ts + i * 0.01})
+    return msgs
+
+
+def root_fields(msg):
+    """Registro [tipo, remetente, destino, texto] equivalente, para a variante raiz."""
+    if msg["to"] == "ALL":
+        return (protocolo.PUBLICA, msg["from"], None, msg["text"])
+    if msg["to"].startswith("#"):
+        return (protocolo.SALA, msg["from"], msg["to"][1:], msg["text"])
+    return (protocolo.PRIVADA, msg["from"], msg["to"], msg["text"])
+
+
+def batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def measure(name, items, encode, decode, serializer="marshal"):
+    """Serializa cada chamada produzida por 'encode(item)' e a decodifica com 'decode(args)'."""
+    ser = serializers[serializer]
+    count = sum(len(item) if isinstance(item, list) else 1 for item in items)
+    start = time.perf_counter()
+    calls = [ser.dumpsCall("callback", method, args, {}) for method, args in map(encode, items)]
+    encoded = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in calls:
+        _, _, args, _ = ser.loadsCall(data)
+        decode(args)
+    decoded = time.perf_counter() - start
+    total = sum(len(data) for data in calls)
+    return {"case": name, "serializer": serializer, "messages": count, "bytes": total,
+            "bytes_per_message": round(total / count, 1),
+            "encode_us": round(encoded / count * 1e6, 2), "decode_us": round(decoded / count * 1e6, 2)}
+
+
+def delivery_cases(msgs, batch):
+    """Casos de entrega (callbacks) para uma lista de mensagens, em lotes de 'batch'."""
+    lots = batches(msgs, batch)
+    results = [
+        measure("local dicionários (receive_batch)", lots,
+                lambda lot: ("receive_batch", (lot,)), lambda args: list(args[0])),
+        measure("local JSON codificado (receive_encoded)", lots,
+                lambda lot: ("receive_encoded", ([codec.encode_message(m) for m in lot],)),
+                lambda args: [codec.decode_message(p) for p in args[0]]),
+    ]
+    for serializer in codec.available_serializers():
+        for compression in (None, codec.COMPRESSION_ZLIB):
+            fmt = codec.WireFormat(serializer, compression)
+            results.append(measure(
+                f"local compacto {serializer}{'+zlib' if compression else ''} (receive_compact)", lots,
+                lambda lot, fmt=fmt: ("receive_compact", ([fmt.pack(codec.message_fields(m)) for m in lot],)),
+                lambda args: [codec.decode_compact(f) for f in args[0]]))
+
+    root = [[(protocolo.formatar(root_fields(m)), False) for m in lot] for lot in lots]
+    results.append(measure("raiz textos prontos (receive_batch)", root,
+                           lambda lot: ("receive_batch", (lot,)), lambda args: list(args[0])))
+    root = [[[root_fields(m), False] for m in lot] for lot in lots]
+    for serializer in codec.available_serializers():
+        for compression in (None, codec.COMPRESSION_ZLIB):
+            fmt = codec.WireFormat(serializer, compression)
+            results.append(measure(
+                f"raiz compacto {serializer}{'+zlib' if compression else ''} (receive_compact)", root,
+                lambda lot, fmt=fmt: ("receive_compact", ([[fmt.pack(list(c)), p] for c, p in lot],)),
+                lambda args: [protocolo.formatar(codec.unpack_frame(q)) for q, _ in args[0]]))
+    return results
+
+
+def broadcast_cases(msg, room):
+    """Um broadcast da raiz para 'room' destinatários: cada item é uma chamada de callback."""
+    fields = root_fields(msg)
+    text = protocolo.formatar(fields)
+    fmt = codec.WireFormat("marshal", codec.COMPRESSION_ZLIB)
+    cache = codec.FrameCache(fields=list)
+    decode = lambda args: [protocolo.formatar(codec.unpack_frame(q)) for q, _ in args[0]]
+    recipients = list(range(room))
+    return [
+        measure(f"raiz broadcast textos prontos ({room} destinatários)", recipients,
+                lambda _: ("receive_batch", ([(text, False)],)), lambda args: list(args[0])),
+        measure(f"raiz broadcast compacto, quadro por destinatário ({room} destinatários)", recipients,
+                lambda _: ("receive_compact", ([[fmt.pack(list(fields)), False]],)), decode),
+        measure(f"raiz broadcast compacto, quadro único (FrameCache, {room} destinatários)", recipients,
+                lambda _: ("receive_compact", ([[cache.get(fmt, fields, fields), False]],)), decode),
+    ]
+
+
+def history_cases(msgs, page):
+    """Uma página de histórico: dicionários (get_history) contra um frame (get_history_packed)."""
+    pages = [msgs[:page]]
+    fmt = codec.WireFormat("marshal", codec.COMPRESSION_ZLIB)
+    return [
+        measure("histórico dicionários (get_history)", pages,
+                lambda p: ("get_history", (p,)), lambda args: list(args[0]), serializer="serpent"),
+        measure("histórico compacto marshal+zlib (get_history_packed)", pages,
+                lambda p: ("get_history_packed", (fmt.pack([codec.message_fields(m) for m in p]),)),
+                lambda args: [codec.message_from_fields(f) for f in codec.unpack_frame(args[0])]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do formato das mensagens no fio")
+    parser.add_argument("--messages", type=int, default=2000, help="mensagens por tamanho de texto")
+    parser.add_argument("--batch", type=int, default=16, help="mensagens por chamada de callback")
+    parser.add_argument("--room", type=int, default=1000, help="destinatários do broadcast da raiz")
+    parser.add_argument("--page", type=int, default=200, help="mensagens por página de histórico")
+    parser.add_argument("--out", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    results = []
+    for label, words in (("curto", 4), ("longo", 120)):
+        msgs = make_messages(args.messages, words, rng)
+        cases = delivery_cases(msgs, args.batch) + broadcast_cases(msgs[0], args.room) + history_cases(msgs, args.page)
+        for result in cases:
+            result["text"] = label
+            results.append(result)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    else:
+        for result in results:
+            print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
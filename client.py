@@ -2,18 +2,32 @@
 
 import Pyro5.api
 import Pyro5.errors
+import argparse
+import os
 import threading
+import time
 import sys
 
-# Configurações LOCAIS (IP da VPN/LAN do Servidor)
-NS_HOST = "26.84.123.1"
-NS_PORT = 9090
+from protocolo import formatar, unpack_frame, wire_offer
+
+# Configurações de rede: variáveis de ambiente ou linha de comando (python client.py -h).
+# Ex: CHAT_NS_HOST=26.84.123.1 CHAT_CLIENT_HOST=<IP desta máquina na VPN> python client.py
+NS_HOST = os.environ.get("CHAT_NS_HOST", "localhost")      # IP da VPN/LAN do Name Server
+NS_PORT = int(os.environ.get("CHAT_NS_PORT", "9090"))
+CLIENT_HOST = os.environ.get("CHAT_CLIENT_HOST", NS_HOST)  # Onde o Daemon de callback escuta (o servidor conecta aqui)
+HEARTBEAT_INTERVAL = 5.0 # Segundos entre heartbeats (o servidor remove quem fica 15s sem enviar)
+VERIFICAR_LEASE_A_CADA = 3 # Heartbeats entre as confirmações de que o lease continua ativo
+NS_CACHE_TTL = 60.0      # Segundos que a URI do servidor obtida no Name Server fica em cache
+LOTE_MAXIMO = 64         # Mensagens por chamada send_messages
+JANELA_DE_ENVIO = 0.02   # Segundos que uma mensagem espera por outras antes de o lote seguir
+SERVER_NAME = "ChatService.Server"
 
 # 1. Objeto Callback do Cliente (RPC Reversa)
 @Pyro5.api.expose
 class ClienteChatCallback:
-    def __init__(self, nome):
+    def __init__(self, nome, presenca=None):
         self.nome_usuario = nome
+        self.presenca = presenca  # ListaDePresenca atualizada pelos eventos do servidor
 
     def receive_message(self, message: str, is_private: bool): 
         """Recebe e exibe a mensagem enviada pelo servidor."""
@@ -21,71 +35,313 @@ class ClienteChatCallback:
         print(f"\n<< {prefixo} {message} >>")
         sys.stdout.flush() 
 
-# 2. Função de Cleanup Isolada
-def cleanup_servidor(nome_usuario, host, port):
+    def receive_batch(self, messages: list):
+        """Recebe várias mensagens agrupadas pelo servidor: lista de (mensagem, privado)."""
+        for message, is_private in messages:
+            self.receive_message(message, is_private)
+
+    def receive_compact(self, itens):
+        """Recebe um lote no formato compacto: [quadro, privado] por mensagem, cada quadro com um registro."""
+        for quadro, is_private in itens:
+            self.receive_message(formatar(unpack_frame(quadro)), is_private)
+
+    @Pyro5.api.oneway
+    def presence_update(self, eventos: list):
+        """Recebe entradas/saídas de usuários (após subscribe_presence), em ordem de versão."""
+        if self.presenca is not None:
+            self.presenca.aplicar(eventos)
+
+# 1b. Lista Local de Usuários Online
+class ListaDePresenca:
     """
-    Função segura para notificar o servidor da desconexão,
-    isolando a chamada RPC para evitar erros de thread ownership.
+    Usuários online mantidos pelos eventos de presença do servidor, sem perguntar a lista toda.
+    Um evento fora de sequência (perdido, ou de outra execução do servidor) marca a lista
+    como desatualizada; 'usuarios' então pede só o delta com presence_since (ou, se o
+    servidor reiniciou, inscreve-se de novo e recebe a lista completa). Uma resposta de erro
+    (ex: usuário não registrado) não muda a lista, que continua desatualizada até a próxima vez.
     """
-    try:
-        ns_cleanup = Pyro5.api.locate_ns(host=host, port=port)
-        uri_servidor_cleanup = ns_cleanup.lookup("ChatService.Server") 
-        
-        servidor_cleanup = Pyro5.api.Proxy(uri_servidor_cleanup)
-        
-        # Reivindica a posse no thread atual para evitar o erro de ownership
-        servidor_cleanup._pyroClaimOwnership() 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.usuarios_online = set()
+        self.epoca = None
+        self.versao = None
+        self.antecipados = []  # eventos que chegaram antes da primeira lista
+        self.desatualizada = True
 
-        servidor_cleanup.unregister_client(nome_usuario)
-        print(f"[{nome_usuario}] Notificação de desconexão enviada.")
-        
-    except Pyro5.errors.CommunicationError:
-        print("Não foi possível notificar o servidor (servidor fora?).")
-    except Pyro5.errors.NamingError:
-        print("Name Server inacessível durante desconexão.")
-    except Pyro5.errors.PyroError as e:
-        # Captura e trata o erro de ownership para evitar o traceback
-        if "not the owner of this proxy" in str(e):
-             print(f"Aviso: Erro de posse do Proxy capturado durante cleanup.")
+    def carregar(self, resposta):
+        """Aplica a resposta de subscribe_presence/presence_since; False se ela é um erro."""
+        if not resposta.get("ok"):
+            return False
+        with self.lock:
+            if resposta["completo"]:
+                self.usuarios_online = set(resposta["usuarios"])
+            else:
+                self.usuarios_online.difference_update(resposta["sairam"])
+                self.usuarios_online.update(resposta["entraram"])
+            self.epoca, self.versao = resposta["epoca"], resposta["versao"]
+            self.desatualizada = False
+            antecipados, self.antecipados = self.antecipados, []
+            self._aplicar(antecipados)
+        return True
+
+    def aplicar(self, eventos):
+        with self.lock:
+            if self.versao is None:
+                self.antecipados.extend(eventos)
+            else:
+                self._aplicar(eventos)
+
+    def _aplicar(self, eventos):
+        # chamado com self.lock adquirido
+        for evento in eventos:
+            if self.desatualizada:
+                return
+            if evento["epoca"] == self.epoca and evento["versao"] <= self.versao:
+                continue
+            if evento["epoca"] != self.epoca or evento["versao"] != self.versao + 1:
+                self.desatualizada = True
+                return
+            if evento["online"]:
+                self.usuarios_online.add(evento["usuario"])
+            else:
+                self.usuarios_online.discard(evento["usuario"])
+            self.versao = evento["versao"]
+
+    def usuarios(self, sessao):
+        if self.desatualizada:
+            resposta = sessao.chamar("presence_since", self.versao, self.epoca)
+            if not resposta.get("ok") or resposta["epoca"] != self.epoca:
+                resposta = sessao.chamar("subscribe_presence", sessao.nome_usuario)
+            self.carregar(resposta)
+        with self.lock:
+            return sorted(self.usuarios_online)
+
+# 2. Sessão com o Servidor
+class SessaoChat:
+    """
+    Conexão do cliente com o servidor, reaproveitada durante toda a sessão.
+    - Um único proxy de longa duração: cada chamada (da thread principal ou do heartbeat)
+      pega o lock da sessão e reivindica a posse do proxy, então a conexão fica quente
+      e cada mensagem custa uma única chamada remota.
+    - A URI do servidor vem do Name Server e fica em cache por NS_CACHE_TTL segundos.
+    - Se a conexão cair (ex: o servidor reiniciou), a sessão busca a URI de novo,
+      reconecta, registra o usuário outra vez e repete a chamada uma vez.
+    - Com 'formato' (ver codec.wire_offer), o registro pede o formato compacto; servidores
+      antigos não o conhecem e o registro é refeito sem ele.
+    """
+    def __init__(self, nome_usuario, cliente_uri, ns_host=NS_HOST, ns_port=NS_PORT, ns_ttl=NS_CACHE_TTL,
+                 formato=None):
+        self.nome_usuario = nome_usuario
+        self.cliente_uri = cliente_uri
+        self.formato = formato
+        self.formato_acordado = None
+        self.ns_host = ns_host
+        self.ns_port = ns_port
+        self.ns_ttl = ns_ttl
+        self.lock = threading.Lock()
+        self.uri_servidor = None
+        self.uri_validade = 0.0
+        self.proxy = None
+        self.registrado = False
+
+    def _buscar_uri(self, forcar=False):
+        """URI do servidor: do cache, se ainda válida, ou do Name Server."""
+        if forcar or self.uri_servidor is None or time.monotonic() >= self.uri_validade:
+            ns = Pyro5.api.locate_ns(host=self.ns_host, port=self.ns_port)
+            self.uri_servidor = ns.lookup(SERVER_NAME)
+            self.uri_validade = time.monotonic() + self.ns_ttl
+        return self.uri_servidor
+
+    def _conectar(self, forcar_busca=False):
+        """(Re)cria o proxy, trocando-o se a URI do servidor mudou. Chamado com o lock."""
+        uri = self._buscar_uri(forcar_busca)
+        if self.proxy is None or self.proxy._pyroUri != uri:
+            if self.proxy is not None:
+                self.proxy._pyroClaimOwnership()
+                self.proxy._pyroRelease()
+            self.proxy = Pyro5.api.Proxy(uri)
+        self.proxy._pyroClaimOwnership()
+        return self.proxy
+
+    def _registrar(self, servidor):
+        """register_client com a oferta de formato (se houver). Retorna (sucesso, resposta)."""
+        if self.formato is not None:
+            try:
+                resultado = servidor.register_client(self.nome_usuario, self.cliente_uri, self.formato)
+            except TypeError:
+                # servidor sem o formato compacto: register_client só aceita dois argumentos
+                resultado = servidor.register_client(self.nome_usuario, self.cliente_uri)
         else:
-            raise e
+            resultado = servidor.register_client(self.nome_usuario, self.cliente_uri)
+        sucesso, resposta = resultado[0], resultado[1]
+        self.formato_acordado = resultado[2] if len(resultado) > 2 else None
+        return sucesso, resposta
+
+    def registrar(self):
+        """Registra o usuário no servidor. Retorna (sucesso, resposta)."""
+        with self.lock:
+            sucesso, resposta = self._registrar(self._conectar())
+            self.registrado = sucesso
+            return sucesso, resposta
+
+    def chamar(self, metodo, *args):
+        """
+        Chama 'metodo' no servidor pelo proxy da sessão.
+        Em falha de comunicação: libera a conexão, busca a URI de novo no Name Server,
+        reconecta, registra o usuário outra vez (se estava registrado) e repete a chamada.
+        """
+        with self.lock:
+            try:
+                return getattr(self._conectar(), metodo)(*args)
+            except Pyro5.errors.CommunicationError:
+                self.proxy._pyroRelease()
+            servidor = self._conectar(forcar_busca=True)
+            if self.registrado:
+                sucesso, resposta = self._registrar(servidor)
+                if sucesso:
+                    print(f"\n[Reconectado ao servidor: {resposta}]")
+            return getattr(servidor, metodo)(*args)
+
+    def encerrar(self):
+        """Desregistra o usuário (se registrado) e fecha a conexão."""
+        with self.lock:
+            if self.proxy is None:
+                return
+            try:
+                if self.registrado:
+                    self._conectar().unregister_client(self.nome_usuario)
+                    self.registrado = False
+                    print(f"[{self.nome_usuario}] Notificação de desconexão enviada.")
+            except Pyro5.errors.CommunicationError:
+                print("Não foi possível notificar o servidor (servidor fora?).")
+            except Pyro5.errors.NamingError:
+                print("Name Server inacessível durante desconexão.")
+            finally:
+                self.proxy._pyroClaimOwnership()
+                self.proxy._pyroRelease()
+                self.proxy = None
 
+# 3. Envio em Lote
+class EnvioEmLote:
+    """
+    Envio em pipeline: 'enviar' numera a mensagem e retorna na hora; uma thread junta as
+    mensagens (até LOTE_MAXIMO ou JANELA_DE_ENVIO segundos) e as manda em uma única chamada
+    send_messages pela sessão. O servidor confirma o lote pelo maior número processado;
+    erros (ex: destinatário não encontrado) continuam chegando pelo callback.
+    """
+    def __init__(self, sessao):
+        self.sessao = sessao
+        self.seq = 0
+        self.confirmado = 0
+        self.pendentes = []
+        self.cond = threading.Condition()
+        self.fechado = False
+        self.thread = threading.Thread(target=self._enviar_lotes, daemon=True)
+        self.thread.start()
+
+    def enviar(self, mensagem, destinatario=None, sala=None):
+        with self.cond:
+            self.seq += 1
+            self.pendentes.append([self.seq, mensagem, destinatario, sala])
+            self.cond.notify_all()
+            return self.seq
+
+    def fechar(self, timeout=5.0):
+        """Espera a confirmação de tudo o que foi enviado e encerra a thread."""
+        with self.cond:
+            self.fechado = True
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: self.confirmado >= self.seq, timeout)
+        self.thread.join(timeout)
 
-# 3. Lógica Principal do Cliente
-def iniciar_cliente():
+    def _enviar_lotes(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pendentes or self.fechado)
+                if not self.pendentes:
+                    return
+                if not self.fechado and len(self.pendentes) < LOTE_MAXIMO:
+                    # Janela curta para juntar mensagens digitadas/geradas em sequência
+                    self.cond.wait_for(lambda: len(self.pendentes) >= LOTE_MAXIMO or self.fechado, JANELA_DE_ENVIO)
+                lote = self.pendentes[:LOTE_MAXIMO]
+                del self.pendentes[:LOTE_MAXIMO]
+            try:
+                _, ultimo = self.sessao.chamar("send_messages", self.sessao.nome_usuario, lote)
+            except (Pyro5.errors.CommunicationError, Pyro5.errors.NamingError) as e:
+                print(f"\n[ERRO] {len(lote)} mensagem(ns) não enviada(s): {e}")
+                ultimo = lote[-1][0]
+            with self.cond:
+                self.confirmado = ultimo
+                self.cond.notify_all()
+
+# 4. Thread de Heartbeat
+def enviar_heartbeats(sessao, parar):
+    """
+    Renova periodicamente o lease de presença no servidor.
+    Usa o proxy da sessão (a sessão transfere a posse para esta thread a cada chamada);
+    se o servidor tiver reiniciado, a sessão reconecta e registra o usuário de novo.
+    O heartbeat é oneway; uma vez a cada VERIFICAR_LEASE_A_CADA heartbeats, e logo depois de uma
+    falha, pergunta ao servidor se o lease continua ativo: se expirou durante uma queda curta
+    (heartbeats perdidos não dão erro), registra de novo.
+    """
+    batidas = 0
+    verificar = False
+    while not parar.wait(HEARTBEAT_INTERVAL):
+        batidas += 1
+        try:
+            sessao.chamar("heartbeat", sessao.nome_usuario)
+            if verificar or batidas % VERIFICAR_LEASE_A_CADA == 0:
+                verificar = False
+                if not sessao.chamar("lease_ativo", sessao.nome_usuario):
+                    sucesso, resposta = sessao.registrar()
+                    print(f"\n[Lease expirado; registro refeito: {resposta}]" if sucesso
+                          else f"\n[Lease expirado; registro recusado: {resposta}]")
+        except (Pyro5.errors.CommunicationError, Pyro5.errors.NamingError):
+            verificar = True # Tenta de novo no próximo heartbeat e confirma o lease
+
+
+# 5. Lógica Principal do Cliente
+def iniciar_cliente(ns_host=NS_HOST, ns_port=NS_PORT, cliente_host=CLIENT_HOST):
     nome_usuario = input("Digite seu nome de usuário: ").strip()
     if not nome_usuario:
         print("Nome de usuário inválido.")
         return
 
     cliente_daemon = None
-    uri_servidor = None
+    sessao = None
+    envio = None
+    parar_heartbeat = threading.Event()
     
     try:
         # Inicialização do Daemon
         # Força o Daemon a escutar no IP da VPN (necessário para callback)
-        cliente_daemon = Pyro5.api.Daemon(host=NS_HOST)
+        cliente_daemon = Pyro5.api.Daemon(host=cliente_host)
         
-        cliente_callback = ClienteChatCallback(nome_usuario)
+        presenca = ListaDePresenca()
+        cliente_callback = ClienteChatCallback(nome_usuario, presenca)
         cliente_uri = cliente_daemon.register(cliente_callback)
         
         threading.Thread(target=cliente_daemon.requestLoop, daemon=True).start()
 
-        # 1. Obter o URI do Servidor
+        # 1. Obter o URI do Servidor (Name Server) e abrir a sessão
         print("Buscando Name Server...")
-        ns = Pyro5.api.locate_ns(host=NS_HOST, port=NS_PORT)
-        uri_servidor = ns.lookup("ChatService.Server") 
-            
-        # 2. Registrar o usuário no Servidor (Proxy temporário para registro)
-        servidor_registro = Pyro5.api.Proxy(uri_servidor)
-        sucesso, resposta = servidor_registro.register_client(nome_usuario, cliente_uri) 
-        
+        sessao = SessaoChat(nome_usuario, cliente_uri, ns_host, ns_port, formato=wire_offer())
+
+        # 2. Registrar o usuário no Servidor (pelo proxy da sessão)
+        sucesso, resposta = sessao.registrar()
+
         if not sucesso:
             print(f"Erro ao registrar: {resposta}")
             return
 
+        threading.Thread(target=enviar_heartbeats, args=(sessao, parar_heartbeat), daemon=True).start()
+        # Inscrição nos eventos de presença: '/online' usa a lista local, sem consultar o servidor
+        presenca.carregar(sessao.chamar("subscribe_presence", nome_usuario))
+        envio = EnvioEmLote(sessao)
+
         print("\n--- CHAT CONECTADO ---")
         print("Comandos: 'exit' para sair, '@<usuário> <mensagem>' para mensagem privada.")
+        print("Salas: '/entrar <sala>', '/sair <sala>', '/salas', '#<sala> <mensagem>'. Usuários: '/online'.")
         
         # Loop de Envio de Mensagens
         while True:
@@ -97,13 +353,35 @@ def iniciar_cliente():
             if not mensagem_input:
                 continue
 
-            # 🌟 CORREÇÃO: Crie e reivindique o proxy DENTRO do loop 
-            # para garantir que o Thread Principal seja o proprietário exclusivo 
-            servidor_loop = Pyro5.api.Proxy(uri_servidor)
-            servidor_loop._pyroClaimOwnership() 
+            # Lógica de salas
+            if mensagem_input.startswith('/entrar ') or mensagem_input.startswith('/sair '):
+                comando, _, sala = mensagem_input.partition(' ')
+                sala = sala.strip().lstrip('#')
+                if comando == '/entrar':
+                    _, resposta = sessao.chamar("join_room", nome_usuario, sala)
+                else:
+                    _, resposta = sessao.chamar("leave_room", nome_usuario, sala)
+                print(resposta)
+
+            elif mensagem_input == '/online':
+                print("Online:", ", ".join(presenca.usuarios(sessao)))
+
+            elif mensagem_input == '/salas':
+                print("Salas:", sessao.chamar("list_rooms"))
+
+            elif mensagem_input.startswith('#'):
+                partes = mensagem_input.split(' ', 1)
+                sala = partes[0][1:].strip()
+                mensagem = partes[1] if len(partes) > 1 else ""
+
+                if not sala or not mensagem:
+                    print("Formato inválido para mensagem de sala. Use: #sala <mensagem>")
+                    continue
+
+                envio.enviar(mensagem, None, sala)
 
             # Lógica de mensagens privadas (@usuario mensagem)
-            if mensagem_input.startswith('@'):
+            elif mensagem_input.startswith('@'):
                 partes = mensagem_input.split(' ', 1)
                 destinatario = partes[0][1:].strip() 
                 mensagem = partes[1] if len(partes) > 1 else ""
@@ -112,31 +390,40 @@ def iniciar_cliente():
                     print("Formato inválido para mensagem privada. Use: @usuario <mensagem>")
                     continue
                 
-                servidor_loop.send_message(nome_usuario, mensagem, destinatario) 
+                envio.enviar(mensagem, destinatario)
                 
             else:
                 # Mensagem pública
-                servidor_loop.send_message(nome_usuario, mensagem_input) 
+                envio.enviar(mensagem_input)
 
     except Pyro5.errors.CommunicationError as e:
         print(f"\nERRO: Conexão com o servidor perdida: {e}")
     except Pyro5.errors.NamingError:
         print("\nERRO: Não foi possível localizar o Name Server ou o objeto do chat.")
-        print(f"Certifique-se de que o Name Server ('pyro5-ns -n {NS_HOST} -p {NS_PORT}') e o Servidor estão rodando.")
+        print(f"Certifique-se de que o Name Server ('pyro5-ns -n {ns_host} -p {ns_port}') e o Servidor estão rodando.")
     except Exception as e:
         print(f"\nERRO Inesperado: {e}")
     finally:
-        
+        parar_heartbeat.set()
+        if envio:
+            envio.fechar() # Entrega o que ainda estava no buffer
+
         # 1. ENCERRA O DAEMON DO CLIENTE PRIMEIRO
         if cliente_daemon:
             cliente_daemon.shutdown() 
 
-        # 2. CHAMA A FUNÇÃO DE CLEANUP ISOLADA
-        if nome_usuario and uri_servidor:
-            cleanup_servidor(nome_usuario, NS_HOST, NS_PORT)
+        # 2. DESREGISTRA E FECHA A SESSÃO (mesmo proxy, sem nova busca no Name Server)
+        if sessao:
+            sessao.encerrar()
         
         print("Desconectado. Pressione Enter para sair.")
 
 
 if __name__ == "__main__":
-    iniciar_cliente()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Cliente de chat (Pyro5)")
+    parser.add_argument("--ns-host", default=NS_HOST, help="endereço do Name Server (env CHAT_NS_HOST)")
+    parser.add_argument("--ns-port", type=int, default=NS_PORT, help="porta do Name Server (env CHAT_NS_PORT)")
+    parser.add_argument("--host", default=CLIENT_HOST,
+                        help="endereço desta máquina, onde o servidor entrega as mensagens (env CHAT_CLIENT_HOST)")
+    args = parser.parse_args()
+    iniciar_cliente(args.ns_host, args.ns_port, args.host)
\ No newline at end of file
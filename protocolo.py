@@ -0,0 +1,37 @@
+# protocolo.py
+"""
+Registros das mensagens do chat (variante raiz) no formato compacto, negociado no register_client.
+
+Os clientes antigos recebem cada mensagem como texto já decorado ("[MENSAGEM PRIVADA de ana]: oi").
+No formato compacto, cada mensagem é o registro posicional [tipo, remetente, destino, texto] e o
+cliente monta o texto exibido com 'formatar' (o mesmo texto que os clientes antigos recebem).
+O enquadramento (cabeçalho, serializador, zlib), a oferta do cliente e a negociação são os do
+LocalFuncional/codec.py, o mesmo módulo das duas variantes: só o registro é próprio da raiz.
+"""
+import os
+import sys
+
+# no fim do sys.path: os módulos da raiz (client.py, ...) não são encobertos pelos do LocalFuncional
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "LocalFuncional"))
+from codec import FrameCache, WireFormat, available_serializers, negotiate, unpack_frame, wire_offer  # noqa: E402,F401
+
+# Tipos de mensagem (primeiro campo do registro)
+TEXTO, PUBLICA, PRIVADA, ECO, SALA, SISTEMA, ERRO = range(7)
+
+
+def formatar(campos) -> str:
+    """Texto exibido para o registro [tipo, remetente, destino, texto]."""
+    tipo, remetente, destino, texto = campos
+    if tipo == PUBLICA:
+        return f"<{remetente}>: {texto}"
+    if tipo == PRIVADA:
+        return f"[MENSAGEM PRIVADA de {remetente}]: {texto}"
+    if tipo == ECO:
+        return f"[Você -> {destino}]: {texto}"
+    if tipo == SALA:
+        return f"[#{destino}] <{remetente}>: {texto}"
+    if tipo == SISTEMA:
+        return f"[SISTEMA] [#{destino}] {texto}" if destino else f"[SISTEMA] {texto}"
+    if tipo == ERRO:
+        return f"[ERRO] {texto}"
+    return texto
@@ -2,120 +2,737 @@
 
 import Pyro5.api
 import Pyro5.errors
+import argparse
+import json
+import logging
+import os
 import threading
 import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from protocolo import TEXTO, PUBLICA, PRIVADA, ECO, SALA, SISTEMA, ERRO, FrameCache, formatar, negotiate
+# Módulos compartilhados com o LocalFuncional (protocolo.py põe a pasta no sys.path)
+from logs import configure_logging
+from metrics import Metrics
+from offline_store import OfflineStore
+from presence import LeaseManager
+from ratelimit import SenderLimiter
+from slow_consumers import ConsumerTracker
+from registry import ClientRegistry
+from netconfig import env, add_network_arguments, configure_daemon, THREAD
+
+# Configurações de rede: variáveis de ambiente ou linha de comando (python servidor.py -h).
+# Ex: CHAT_HOST=26.84.123.1 CHAT_NS_HOST=26.84.123.1 python servidor.py --servertype multiplex
+NS_HOST = env("CHAT_NS_HOST", "localhost")
+NS_PORT = env("CHAT_NS_PORT", 9090, int)
+SERVER_HOST = env("CHAT_HOST", "localhost")   # Onde o daemon do servidor irá escutar (IP da VPN/LAN)
+SERVER_PORT = env("CHAT_PORT", 0, int)        # 0 = porta livre escolhida pelo sistema
+# "thread": cada conexão de cliente ocupa uma thread do Daemon (no máximo SERVER_WORKERS);
+# "multiplex": um único laço de eventos atende todas as conexões (clientes ociosos não custam threads)
+SERVERTYPE = env("CHAT_SERVERTYPE", THREAD)
+SERVER_WORKERS = env("CHAT_WORKERS", 80, int)
+
+# Configurações de entrega
+DELIVERY_WORKERS = 8         # Threads fixas que fazem as chamadas de callback
+QUEUE_HIGH_WATER = 500       # Máximo de mensagens pendentes por cliente
+OVERFLOW_POLICY = "desconectar" # "desconectar" remove o cliente lento; "descartar" perde a mensagem nova
+BATCH_SIZE = 64              # Máximo de mensagens agrupadas em uma chamada receive_batch
+
+# Configurações de presença
+LEASE_SECONDS = 15.0         # Cliente sem heartbeat por esse tempo é removido
+
+# Configurações de store-and-forward (mensagens de quem caiu são guardadas até ele voltar)
+OFFLINE_DIR = "offline"      # Pasta dos arquivos de mensagens guardadas (um por usuário)
+OFFLINE_MEMORIA = 200        # Mensagens por usuário mantidas em memória; o excedente vai para o disco
+OFFLINE_MAXIMO = 5000        # Máximo de mensagens guardadas por usuário (as seguintes são descartadas)
+OFFLINE_TTL = 24 * 3600.0    # Segundos que uma mensagem guardada continua válida
+
+# Configurações de presença versionada
+PRESENCA_LOG = 10000         # Entradas/saídas guardadas para responder presence_since com um delta
+ANUNCIAR_PRESENCA = True     # False: entradas/saídas não viram mais mensagens [SISTEMA] no chat
+
+# Configurações de clientes lentos (média móvel exponencial da duração de cada entrega)
+LENTO_LIMITE = 0.5           # Segundos de EWMA (por lote de até BATCH_SIZE) acima dos quais o cliente é lento
+LENTO_ALFA = 0.2             # Peso da amostra nova na EWMA
+LENTO_AMOSTRAS = 3           # Entregas medidas antes de classificar
+POLITICA_LENTO = "agrupar"   # "agrupar" (lotes maiores), "descartar_publicas" (só privadas) ou "desconectar"
+LOTE_LENTO = 256             # Tamanho do lote para clientes lentos na política "agrupar"
+
+# Configurações do controle de admissão (limite de envio por remetente e carga global)
+LIMITE_MENSAGENS = 20.0      # Mensagens por segundo por remetente (0 desliga o limite)
+RAJADA_MENSAGENS = 40.0      # Mensagens que um remetente pode mandar de uma vez
+LIMITE_FANOUT = 2000.0       # Entregas por segundo por remetente em broadcasts e salas
+RAJADA_FANOUT = 5000.0       # Entregas de uma vez (um broadcast custa o número de usuários)
+LIMITE_FILAS = 100000        # Mensagens pendentes nas filas a partir das quais novos envios são recusados
+ESPERA_SOBRECARGA = 1.0      # retry_after (s) informado quando o servidor recusa por sobrecarga
+
+# Configurações de log e métricas
+LOG_LEVEL = "INFO"           # DEBUG mostra cada mensagem enviada; WARNING só problemas
+LOG_BURST = 10               # Máximo de logs iguais (mesmo modelo) por LOG_PERIOD segundos
+LOG_PERIOD = 10.0
+STATS_FILE = None            # Ex: "stats.json" grava as métricas a cada STATS_INTERVAL segundos
+STATS_INTERVAL = 10.0
+
+log = logging.getLogger("chat.servidor")
+
+
+# Entrada do registro: o proxy do callback, o lock que dá a uma thread por vez o uso dele e o
+# formato compacto negociado no registro (None = o cliente recebe os textos prontos)
+Conexao = namedtuple("Conexao", "proxy lock formato", defaults=(None,))
+
+# Mensagem na fila de saída: o texto decorado (para clientes antigos) e o registro posicional
+# [tipo, remetente, destino, texto] (formato compacto), montados uma vez para todos os destinatários
+Mensagem = namedtuple("Mensagem", "texto campos")
+
+
+def mensagem(tipo, remetente, destino, texto) -> Mensagem:
+    campos = (tipo, remetente, destino, texto)
+    return Mensagem(formatar(campos), campos)
+
+
+def texto_pronto(texto: str) -> Mensagem:
+    """Mensagem de um texto já decorado (ex: chamadas antigas de broadcast_message)."""
+    return Mensagem(texto, (TEXTO, None, None, texto))
+
+
+def guardada(message: Mensagem, is_private: bool) -> bytes:
+    """Payload de uma mensagem na caixa offline (OfflineStore): [texto, campos, privado] em JSON."""
+    return json.dumps([message.texto, message.campos, is_private], ensure_ascii=False).encode("utf-8")
+
+
+def retirada(payload: bytes):
+    """(Mensagem, privado) de um payload de 'guardada', ou None se ele não é da variante raiz."""
+    try:
+        texto, campos, is_private = json.loads(payload)
+        return Mensagem(texto, tuple(campos)), is_private
+    except (ValueError, TypeError):
+        return None
+
+
+def migrar_caixas_antigas(caixas: OfflineStore, diretorio: str = OFFLINE_DIR):
+    """
+    Passa para 'caixas' as mensagens ainda válidas dos arquivos <usuário em hex>.jsonl do formato
+    anterior (linhas [guardada_em, mensagem, privado], com a mensagem em texto pronto ou
+    [texto, campos]) e apaga os arquivos.
+    """
+    limite = time.time() - OFFLINE_TTL
+    for nome in os.listdir(diretorio):
+        if not nome.endswith(".jsonl"):
+            continue
+        caminho = os.path.join(diretorio, nome)
+        with open(caminho, encoding="utf-8") as f:
+            linhas = [json.loads(linha) for linha in f if linha.strip()]
+        caixas.put(bytes.fromhex(nome[:-6]).decode("utf-8"),
+                   [guardada(Mensagem(message[0], tuple(message[1])) if isinstance(message, list) else texto_pronto(message),
+                             is_private)
+                    for guardada_em, message, is_private in linhas if guardada_em >= limite])
+        os.remove(caminho)
 
-# Configurações LOCAIS (devem corresponder às do cliente)
-NS_HOST = "26.84.123.1"
-NS_PORT = 9090
-SERVER_HOST = "26.84.123.1" # Onde o daemon do servidor irá escutar
 
 @Pyro5.api.expose
 class ChatServer:
     def __init__(self):
-        # Dicionário para armazenar clientes: {username: client_proxy}
-        # O client_proxy é o objeto remoto (callback) do cliente
-        self.clients = {}
-        print("Servidor de Chat inicializado.")
+        # Registro de clientes: {username: Conexao(client_proxy, lock)}
+        # O client_proxy é o objeto remoto (callback) do cliente. Um lock por proxy: o mesmo
+        # proxy é usado por várias threads do Daemon, então cada chamada precisa de acesso
+        # exclusivo e de reivindicar a posse. O registro (registry.py, o mesmo do LocalFuncional)
+        # copia o dicionário na escrita: broadcasts iteram o retrato atual sem lock.
+        # Cada entrada/saída avisa '_presenca_mudou', que a repassa aos inscritos em subscribe_presence
+        self.clients = ClientRegistry(changelog=PRESENCA_LOG, on_change=self._presenca_mudou)
+        # Inscritos nos eventos de presença e os eventos ainda não enviados a eles
+        self.inscritos_presenca = set()
+        self.eventos_presenca = []
+        self.presenca_cond = threading.Condition()
+        # Filas de saída por cliente: {username: deque[(mensagem, privado)]}
+        # Cada fila é esvaziada por no máximo um worker por vez, preservando a ordem.
+        self.outbox = {}
+        self.pendentes = 0  # total de mensagens nas filas (controle de admissão)
+        self.draining = set()
+        self.outbox_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="entrega")
+        # Clientes antigos que não implementam receive_batch
+        self.legacy_clients = set()
+        # Clientes que negociaram o formato compacto mas não implementam receive_compact
+        self.sem_compacto = set()
+        # Quadro compacto de cada registro, montado uma vez por formato e reaproveitado
+        # entre os destinatários (a chave é o próprio registro)
+        self.quadros = FrameCache(fields=list)
+        # Leases de presença (presence.py, o mesmo do LocalFuncional): concedidos no registro,
+        # renovados pelo heartbeat; quem expira é removido por _lease_expirou
+        self.leases = LeaseManager(self._lease_expirou, lease=LEASE_SECONDS)
+        # Salas: {sala: set(usernames)} e o índice reverso {username: set(salas)}
+        self.rooms = {}
+        self.member_rooms = {}
+        self.rooms_lock = threading.Lock()
+        # Métricas (metrics.py, o mesmo módulo do LocalFuncional): contadores e histogramas
+        # criados uma vez aqui e atualizados direto no caminho quente
+        self.metricas = Metrics()
+        self.m_recebidas = self.metricas.counter("mensagens_recebidas")
+        self.m_entregues = self.metricas.counter("mensagens_entregues")
+        self.m_falhas = self.metricas.counter("falhas_de_entrega")
+        self.m_removidos = self.metricas.counter("clientes_removidos")
+        self.m_limitadas = self.metricas.counter("recusadas_por_limite")
+        self.m_sobrecarga = self.metricas.counter("recusadas_por_sobrecarga")
+        self.m_lentos = self.metricas.counter("clientes_lentos")
+        self.m_descartadas = self.metricas.counter("descartadas_cliente_lento")
+        self.m_latencia_envio = self.metricas.histogram("send_message")
+        self.m_latencia_entrega = self.metricas.histogram("entrega")
+        # Mensagens guardadas de quem caiu, entregues quando ele se registrar de novo
+        # (offline_store.py, o mesmo do LocalFuncional; os payloads são as Mensagens em JSON)
+        self.caixas = OfflineStore(OFFLINE_DIR, OFFLINE_MEMORIA, OFFLINE_MAXIMO, OFFLINE_TTL)
+        migrar_caixas_antigas(self.caixas)
+        # Limite de envio por remetente (ratelimit.py, o mesmo do LocalFuncional) e os remetentes já
+        # avisados de que foram limitados (um aviso por rajada recusada, para o próprio aviso não
+        # inundar a fila dele)
+        self.limite = (SenderLimiter(LIMITE_MENSAGENS, RAJADA_MENSAGENS, LIMITE_FANOUT, RAJADA_FANOUT)
+                       if LIMITE_MENSAGENS else None)
+        self.avisados = set()
+        # Clientes lentos: EWMA da duração das entregas e classificação (slow_consumers.py, o mesmo
+        # do LocalFuncional); os lotes de LOTE_LENTO contam como um lote de BATCH_SIZE
+        self.consumidores = ConsumerTracker(threshold=LENTO_LIMITE, alpha=LENTO_ALFA, min_samples=LENTO_AMOSTRAS,
+                                            batch_size=BATCH_SIZE)
+        threading.Thread(target=self._enviar_presenca, daemon=True).start()
+        if STATS_FILE:
+            threading.Thread(target=self._gravar_metricas, daemon=True).start()
+        log.info("Servidor de Chat inicializado.")
 
-    def register_client(self, username: str, client_uri): # Nome corrigido: register_client
-        """Registra um novo cliente e notifica os demais."""
+    def register_client(self, username: str, client_uri, formato: dict = None): # Nome corrigido: register_client
+        """
+        Registra um novo cliente e notifica os demais.
+        Com 'formato' (a oferta do cliente, ver codec.wire_offer), negocia o formato compacto: as
+        entregas passam a ser quadros 'receive_compact' e a resposta ganha um terceiro item com o
+        formato escolhido. Sem 'formato' (clientes antigos), tudo segue com os textos prontos.
+        """
         if username in self.clients:
-            print(f"Usuário {username} tentou se conectar, mas já está online.")
-            return False, f"O usuário '{username}' já está conectado." 
+            log.info("Usuário %s tentou se conectar, mas já está online.", username)
+            return False, f"O usuário '{username}' já está conectado."
 
         try:
             client_proxy = Pyro5.api.Proxy(client_uri)
+            client_proxy._pyroTimeout = 5 # Evita que um cliente travado segure o servidor
+            # marshal (em C) copia a string do broadcast, já formatada uma única vez,
+            # em vez de o serpent reescapá-la em Python a cada destinatário
+            client_proxy._pyroSerializer = "marshal"
         except Exception as e:
              # Se a URI for inválida ou inacessível, retorna erro.
              return False, f"Falha ao criar proxy para o cliente: {e}"
         
 
-        self.clients[username] = client_proxy
-        print(f"Usuário **{username}** conectado. Total: {len(self.clients)}")
+        acordo = negotiate(formato)
+        if not self.clients.add(username, Conexao(client_proxy, threading.Lock(), acordo)):
+            # Outro registro com o mesmo nome venceu a corrida
+            return False, f"O usuário '{username}' já está conectado."
+        self.leases.grant(username)
+        log.info("Usuário %s conectado. Total: %d", username, len(self.clients))
         
+        # Entrega primeiro o que ficou guardado enquanto o usuário estava fora
+        guardadas = [item for item in map(retirada, self.caixas.take(username)) if item is not None]
+        if guardadas:
+            self._enqueue(username, mensagem(SISTEMA, None, None,
+                                             f"{len(guardadas)} mensagem(ns) recebida(s) enquanto você estava fora:"), True)
+            for message, is_private in guardadas:
+                self._enqueue(username, message, is_private)
+
         # Notificar todos sobre o novo usuário
-        self.broadcast_system_message(f"O usuário **{username}** entrou no chat.")
+        if ANUNCIAR_PRESENCA:
+            self.broadcast_system_message(f"O usuário **{username}** entrou no chat.")
+        if acordo is not None:
+            return True, "Registro bem-sucedido.", acordo.spec()
         return True, "Registro bem-sucedido." # Retorna sucesso
 
     def unregister_client(self, username: str): # Nome corrigido: unregister_client
         """Remove um cliente e notifica os demais."""
-        if username in self.clients:
-            del self.clients[username]
-            print(f"Usuário **{username}** desconectado. Total: {len(self.clients)}")
+        conexao = self.clients.remove(username)
+        self.leases.revoke(username)
+        if conexao is not None:
+            with self.rooms_lock:
+                for room in self.member_rooms.pop(username, ()):
+                    self._remove_member(room, username)
+            self.legacy_clients.discard(username)
+            self.sem_compacto.discard(username)
+            if self.limite is not None:
+                self.limite.forget(username)
+            self.avisados.discard(username)
+            self.consumidores.forget(username)
+            with self.outbox_lock:
+                self.pendentes -= len(self.outbox.pop(username, ()))
+            # Fecha a conexão mantida com o cliente; se uma entrega estiver em curso, o pool fecha
+            # depois dela (no modo multiplex, esperar aqui pararia o laço de eventos inteiro)
+            if conexao.lock.acquire(blocking=False):
+                self._fechar_conexao(conexao, travada=True)
+            else:
+                self.executor.submit(self._fechar_conexao, conexao)
+            log.info("Usuário %s desconectado. Total: %d", username, len(self.clients))
             
+            self.inscritos_presenca.discard(username)
             # Notificar todos sobre a saída
-            self.broadcast_system_message(f"O usuário **{username}** saiu do chat.")
+            if ANUNCIAR_PRESENCA:
+                self.broadcast_system_message(f"O usuário **{username}** saiu do chat.")
 
-    def send_message(self, sender: str, message: str, recipient: str = None): # Nome corrigido: send_message, Parâmetro 'recipient' como opcional
+    def send_message(self, sender: str, message: str, recipient: str = None, room: str = None): # Nome corrigido: send_message, Parâmetro 'recipient' como opcional
         """
         Envia uma mensagem. 
         Se 'recipient' for None, envia para todos (broadcast).
+        Se 'room' for informado, envia só para os membros da sala.
+        Antes passa pelo controle de admissão: se o remetente estourou o seu limite ou as filas
+        estão cheias, nada é enviado e retorna {"ok": False, "error": "rate_limited" ou
+        "overloaded", "retry_after": segundos} (o remetente também é avisado pelo callback).
         """
-        if recipient and recipient != "TODOS": # Tratamento para mensagem privada
+        inicio = time.perf_counter()
+        self.m_recebidas.inc()
+        recusa = self._admitir(sender, recipient, room)
+        if recusa is not None:
+            return recusa
+        if room:
+            self.room_message(sender, room, mensagem(SALA, sender, room, message))
+        elif recipient and recipient != "TODOS": # Tratamento para mensagem privada
             # Mensagem Privada
             if recipient in self.clients:
                 
-                # Mensagem que o destinatário vê
-                dest_msg = f"[MENSAGEM PRIVADA de {sender}]: {message}"
-                # Mensagem de confirmação que o remetente vê
-                sender_confirmation = f"[Você -> {recipient}]: {message}"
+                # Mensagem que o destinatário vê ("[MENSAGEM PRIVADA de <remetente>]: ...")
+                dest_msg = mensagem(PRIVADA, sender, recipient, message)
+                # Mensagem de confirmação que o remetente vê ("[Você -> <destinatário>]: ...")
+                sender_confirmation = mensagem(ECO, sender, recipient, message)
 
-                try:
-                    # Envia a mensagem para o destinatário (True = privado)
-                    self.clients[recipient].receive_message(dest_msg, True)
-                    # Envia uma confirmação para o remetente (True = privado/sistema)
-                    self.clients[sender].receive_message(sender_confirmation, True)
-                    print(f"Mensagem privada enviada: {sender} -> {recipient}")
-                except Pyro5.errors.CommunicationError:
-                    print(f"Erro ao enviar para {recipient}. Usuário desconectado.")
-                    self.unregister_client(recipient)
+                # Enfileira a mensagem para o destinatário (True = privado)
+                self._enqueue(recipient, dest_msg, True)
+                # Enfileira uma confirmação para o remetente (True = privado/sistema)
+                self._enqueue(sender, sender_confirmation, True)
+                log.debug("Mensagem privada enviada: %s -> %s", sender, recipient)
             else:
                 # Informa o remetente que o destinatário não foi encontrado
                 if sender in self.clients:
-                    self.clients[sender].receive_message(f"[ERRO] Usuário '{recipient}' não encontrado ou desconectado.", True)
+                    self._enqueue(sender, mensagem(ERRO, None, sender,
+                                                   f"Usuário '{recipient}' não encontrado ou desconectado."), True)
         else:
-            # Mensagem Pública (Broadcast)
-            full_msg = f"<{sender}>: {message}"
+            # Mensagem Pública (Broadcast): "<remetente>: ..."
+            full_msg = mensagem(PUBLICA, sender, None, message)
             self.broadcast_message(sender, full_msg) # Não precisa do 'private=False' aqui
-            print(f"Mensagem de broadcast enviada por {sender}")
+            log.debug("Mensagem de broadcast enviada por %s", sender)
+        self.m_latencia_envio.observe(time.perf_counter() - inicio)
+        return {"ok": True}
+
+    def _admitir(self, sender, recipient, room):
+        """
+        Controle de admissão: None se a mensagem pode seguir, senão o erro estruturado.
+        Com LIMITE_FILAS mensagens pendentes, recusa qualquer envio ('overloaded'); senão cobra
+        do remetente 1 mensagem e, em broadcasts e salas, o fanout atual ('rate_limited').
+        """
+        if LIMITE_FILAS and self.pendentes >= LIMITE_FILAS:
+            self.m_sobrecarga.inc()
+            recusa = {"ok": False, "error": "overloaded", "retry_after": ESPERA_SOBRECARGA}
+        elif self.limite is not None:
+            if room:
+                fanout = len(self.rooms.get(room, ()))
+            elif recipient and recipient != "TODOS":
+                fanout = 0
+            else:
+                fanout = len(self.clients) - 1
+            espera = self.limite.admit(sender, fanout)
+            if not espera:
+                self.avisados.discard(sender)
+                return None
+            self.m_limitadas.inc()
+            recusa = {"ok": False, "error": "rate_limited", "retry_after": round(espera, 3)}
+        else:
+            return None
+        if sender not in self.avisados and sender in self.clients:
+            self.avisados.add(sender)
+            self._enqueue(sender, mensagem(ERRO, None, sender, f"Mensagens recusadas ({recusa['error']}). "
+                                                               f"Tente de novo em {recusa['retry_after']:.2f}s."), True)
+        return recusa
+
+    def send_messages(self, sender: str, lote: list):
+        """
+        Envia um lote de mensagens do mesmo remetente em uma única chamada.
+        Cada item é [seq, mensagem, destinatário, sala] e é processado, em ordem, por send_message.
+        Retorna (True, maior seq processado): a confirmação do lote inteiro. Erros de
+        mensagens individuais (inclusive recusas do controle de admissão) chegam ao
+        remetente pelo callback, como no envio simples.
+        """
+        ultimo = None
+        for seq, message, recipient, room in lote:
+            self.send_message(sender, message, recipient, room)
+            ultimo = seq
+        return True, ultimo
+
+    def join_room(self, username: str, room: str):
+        """Coloca o usuário na sala (criada se não existir) e avisa os membros."""
+        if username not in self.clients:
+            return False, "Usuário não registrado."
+        with self.rooms_lock:
+            self.rooms.setdefault(room, set()).add(username)
+            self.member_rooms.setdefault(username, set()).add(room)
+        self.room_message(None, room, mensagem(SISTEMA, None, room, f"{username} entrou na sala."))
+        return True, f"Você entrou na sala #{room}."
+
+    def leave_room(self, username: str, room: str):
+        """Retira o usuário da sala e avisa os membros restantes."""
+        with self.rooms_lock:
+            if username not in self.rooms.get(room, ()):
+                return False, f"Você não está na sala #{room}."
+            self._remove_member(room, username)
+            self.member_rooms.get(username, set()).discard(room)
+        self.room_message(None, room, mensagem(SISTEMA, None, room, f"{username} saiu da sala."))
+        return True, f"Você saiu da sala #{room}."
+
+    def list_rooms(self):
+        """Retorna {sala: número de membros}."""
+        with self.rooms_lock:
+            return {room: len(members) for room, members in self.rooms.items()}
+
+    def room_message(self, sender, room: str, message: str):
+        """
+        Envia a mensagem só para os membros da sala (o custo depende do tamanho da sala,
+        não do total de usuários). O remetente precisa ser membro; None = sistema.
+        'message' é uma Mensagem ou, em chamadas antigas, o texto já decorado.
+        """
+        if isinstance(message, str):
+            message = texto_pronto(message)
+        with self.rooms_lock:
+            members = list(self.rooms.get(room, ()))
+        if sender is not None and sender not in members:
+            if sender in self.clients:
+                self._enqueue(sender, mensagem(ERRO, None, sender, f"Você não está na sala #{room}."), True)
+            return
+        for username in members:
+            self._enqueue(username, message, False)
+
+    def _remove_member(self, room: str, username: str):
+        """Retira o usuário do índice de salas (chamado com rooms_lock); salas vazias somem."""
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self.rooms[room]
+
+    @Pyro5.api.oneway
+    def heartbeat(self, username: str):
+        """Renova o lease de presença do cliente (oneway: o cliente não espera a ida e volta)."""
+        if username in self.clients:
+            self.leases.renew(username)
+
+    def lease_ativo(self, username: str):
+        """
+        Retorna False se o cliente não está mais registrado (o lease expirou, ex: rede fora por
+        alguns segundos): ele deve se registrar de novo e recebe o que ficou guardado para ele.
+        """
+        return username in self.clients and self.leases.remaining(username) is not None
 
     def get_online_users(self):
         """Retorna a lista de nomes de usuários online."""
-        return list(self.clients.keys())
+        return self.clients.names()
+
+    def presence_since(self, versao: int = None, epoca: str = None):
+        """
+        Presença incremental: o cliente informa a última versão (e época) que conhece e recebe
+        só quem entrou e saiu desde então, já compactado:
+        {"ok": True, "epoca", "versao", "completo": False, "entraram": [...], "sairam": [...]}.
+        Sem versão, com época diferente (servidor reiniciado) ou versão fora do log, recebe a
+        lista inteira: {"ok": True, "epoca", "versao", "completo": True, "usuarios": [...]}.
+        """
+        delta = self.clients.presence_delta(versao, epoca)
+        if delta.full:
+            return {"ok": True, "epoca": self.clients.epoch, "versao": delta.version, "completo": True,
+                    "usuarios": delta.users}
+        return {"ok": True, "epoca": self.clients.epoch, "versao": delta.version, "completo": False,
+                "entraram": delta.joined, "sairam": delta.left}
+
+    def subscribe_presence(self, username: str):
+        """
+        Inscreve o usuário nos eventos de presença: a cada entrada/saída o servidor chama
+        presence_update(eventos) no callback dele (oneway), com eventos
+        {"epoca", "versao", "usuario", "online"} em ordem. Retorna a lista completa atual; a
+        inscrição vem antes dela, então eventos com versão menor ou igual já estão na lista.
+        """
+        if username not in self.clients:
+            return {"ok": False, "error": "nao_registrado"}
+        self.inscritos_presenca.add(username)
+        return self.presence_since()
+
+    def _presenca_mudou(self, mudanca):
+        """Guarda a mudança para a thread de presença (chamado sob o lock do registro)."""
+        if self.inscritos_presenca:
+            with self.presenca_cond:
+                self.eventos_presenca.append({"epoca": self.clients.epoch, "versao": mudanca.version,
+                                              "usuario": mudanca.name, "online": mudanca.joined})
+                self.presenca_cond.notify()
+
+    def _enviar_presenca(self):
+        """
+        Envia os eventos de presença acumulados a cada inscrito em uma única chamada oneway
+        presence_update (o cliente não responde). Se a conexão do inscrito estiver ocupada
+        (entrega de mensagens em curso), os eventos dele esperam a próxima rodada em vez de
+        segurar os outros. Uma thread só: cada inscrito recebe os eventos na ordem das versões.
+        """
+        atrasados = {}  # {username: eventos que esperam a conexão dele ficar livre}
+        while True:
+            with self.presenca_cond:
+                self.presenca_cond.wait_for(lambda: self.eventos_presenca, 0.05 if atrasados else None)
+                eventos, self.eventos_presenca = self.eventos_presenca, []
+            for username in list(self.inscritos_presenca):
+                proprios = atrasados.pop(username, []) + [e for e in eventos if e["usuario"] != username]
+                if not proprios:
+                    continue
+                try:
+                    if not self._call(username, "presence_update", proprios, esperar=False):
+                        atrasados[username] = proprios
+                except AttributeError:
+                    self.inscritos_presenca.discard(username)
+                except Exception as e:
+                    # O cliente recupera o que perdeu com presence_since
+                    log.info("Falha ao enviar presença para %s: %s", username, e)
+            for username in [u for u in atrasados if u not in self.inscritos_presenca]:
+                del atrasados[username]
+
+    def get_stats(self):
+        """
+        Retorna as métricas do servidor no formato de metrics.Metrics (o mesmo do LocalFuncional):
+        'counters' (mensagens recebidas/entregues, falhas, clientes removidos), 'histograms'
+        (latências de send_message e da entrega, do enfileiramento até o callback responder) e,
+        em 'estado', o estado atual (usuários online, filas, salas).
+        """
+        stats = self.metricas.snapshot()
+        with self.outbox_lock:
+            filas = {username: len(fila) for username, fila in self.outbox.items() if fila}
+        stats["estado"] = {
+            "usuarios_online": len(self.clients),
+            "versao_do_registro": self.clients.version,
+            "mensagens_pendentes": sum(filas.values()),
+            "remetentes_limitados": len(self.avisados),
+            "clientes_lentos": self.consumidores.stats()["slow"],
+            "politica_lentos": POLITICA_LENTO,
+            "presenca": {"epoca": self.clients.epoch, "versao": self.clients.version,
+                         "inscritos": len(self.inscritos_presenca)},
+            "maiores_filas": dict(sorted(filas.items(), key=lambda kv: -kv[1])[:5]),
+            "salas": len(self.rooms),
+            "mensagens_guardadas_offline": self.caixas.pending(),
+            "quadros_compactos": self.quadros.stats(),
+        }
+        return stats
+
+    def _gravar_metricas(self):
+        """Grava get_stats() em STATS_FILE a cada STATS_INTERVAL segundos."""
+        while True:
+            time.sleep(STATS_INTERVAL)
+            tmp = STATS_FILE + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.get_stats(), f, indent=2)
+            os.replace(tmp, STATS_FILE)
 
     def broadcast_message(self, sender: str, message: str): # Simplificado
-        """Envia a mensagem para todos os clientes, exceto o remetente."""
-        for username, client_proxy in list(self.clients.items()): 
+        """
+        Envia a mensagem para todos os clientes, exceto o remetente.
+        A mensagem apenas entra na fila de cada cliente; as entregas correm em paralelo
+        no pool, então um cliente lento não atrasa os demais.
+        'message' é uma Mensagem ou, em chamadas antigas, o texto já decorado.
+        """
+        if isinstance(message, str):
+            message = texto_pronto(message)
+        for username in self.clients.snapshot().clients:
             if username != sender:
-                try:
-                    client_proxy.receive_message(message, False) # False para mensagem pública
-                except Pyro5.errors.CommunicationError:
-                    print(f"Erro de comunicação com {username}. Removendo.")
-                    self.unregister_client(username)
+                self._enqueue(username, message, False) # False para mensagem pública
 
     def broadcast_system_message(self, message: str):
         """Envia uma mensagem de sistema para todos."""
-        system_msg = f"[SISTEMA] {message}"
-        # Usa list() para iterar enquanto o unregister_client pode modificar o dicionário
-        for username, client_proxy in list(self.clients.items()): 
+        system_msg = mensagem(SISTEMA, None, None, message)
+        # Itera o retrato atual do registro: entradas/saídas concorrentes publicam outro retrato
+        for username in self.clients.snapshot().clients:
+            # Mensagens de sistema são tratadas como públicas (False)
+            self._enqueue(username, system_msg, False) 
+
+    def _lease_expirou(self, username: str):
+        """Chamado pelo LeaseManager quando o cliente fica LEASE_SECONDS sem heartbeat: remove-o."""
+        log.info("Usuário %s sem heartbeat há %.0fs. Removendo.", username, LEASE_SECONDS)
+        self.m_removidos.inc()
+        self._guardar_pendentes(username)
+        self.unregister_client(username)
+
+    def _enqueue(self, username: str, message: Mensagem, is_private: bool):
+        """
+        Coloca a mensagem na fila de saída do cliente e agenda a entrega, sem bloquear.
+        Se a fila já tiver QUEUE_HIGH_WATER mensagens, aplica a OVERFLOW_POLICY.
+        """
+        with self.outbox_lock:
+            fila = self.outbox.setdefault(username, deque())
+            overflow = len(fila) >= QUEUE_HIGH_WATER
+            if not overflow:
+                fila.append((message, is_private, time.monotonic()))
+                self.pendentes += 1
+                if username not in self.draining:
+                    self.draining.add(username)
+                    self.executor.submit(self._drain, username)
+        if overflow:
+            if OVERFLOW_POLICY == "desconectar":
+                log.warning("Fila de %s cheia (%d). Removendo cliente lento.", username, QUEUE_HIGH_WATER)
+                self.m_removidos.inc()
+                self._guardar_pendentes(username, [(message, is_private, None)])
+                self.unregister_client(username)
+            else:
+                log.warning("Fila de %s cheia (%d). Mensagem descartada.", username, QUEUE_HIGH_WATER)
+
+    def _drain(self, username: str):
+        """
+        Entrega, em ordem, as mensagens pendentes de um cliente (executado no pool).
+        Mensagens que se acumularam enquanto a entrega anterior estava em curso seguem
+        juntas (até BATCH_SIZE) em uma única chamada receive_batch.
+        Cliente lento (ver _medir_entrega): na política "agrupar" os lotes vão até LOTE_LENTO;
+        em "descartar_publicas" só as mensagens privadas são entregues.
+        """
+        while True:
+            with self.outbox_lock:
+                fila = self.outbox.get(username)
+                if not fila:
+                    self.outbox.pop(username, None)
+                    self.draining.discard(username)
+                    return
+                lento = self.consumidores.is_slow(username)
+                tamanho = LOTE_LENTO if lento and POLITICA_LENTO == "agrupar" else BATCH_SIZE
+                lote = [fila.popleft() for _ in range(min(len(fila), tamanho))]
+                self.pendentes -= len(lote)
+            if lento and POLITICA_LENTO == "descartar_publicas":
+                privadas = [item for item in lote if item[1]]
+                self.m_descartadas.inc(len(lote) - len(privadas))
+                lote = privadas
+                if not lote:
+                    continue
             try:
-                # Mensagens de sistema são tratadas como públicas (False)
-                client_proxy.receive_message(system_msg, False) 
-            except Pyro5.errors.CommunicationError as e:
-                # Se o cliente falhar, remove-o
-                print(f"Erro de comunicação com {username} durante msg de sistema. Removendo.")
+                inicio = time.perf_counter()
+                self._deliver_batch(username, [(message, is_private) for message, is_private, _ in lote])
+                self._medir_entrega(username, time.perf_counter() - inicio, len(lote))
+            except Pyro5.errors.CommunicationError:
+                # Se o cliente falhar, guarda o lote e o resto da fila para quando ele
+                # voltar e o remove (quem reconecta se registra de novo e recebe tudo)
+                log.warning("Erro de comunicação com %s. Guardando mensagens e removendo.", username)
+                self._guardar_pendentes(username, lote)
+                self.m_falhas.inc(len(lote))
+                self.m_removidos.inc()
                 self.unregister_client(username)
+                continue
+            agora = time.monotonic()
+            self.m_entregues.inc(len(lote))
+            for _, _, enfileirada in lote:
+                self.m_latencia_entrega.observe(agora - enfileirada)
+
+    def _medir_entrega(self, username: str, segundos: float, mensagens: int = 1):
+        """
+        Atualiza a EWMA da duração das entregas do cliente e a sua classificação (ConsumerTracker).
+        Vira lento acima de LENTO_LIMITE; volta ao normal abaixo da metade (histerese). Um lote
+        maior que BATCH_SIZE conta como a duração equivalente de um lote de BATCH_SIZE.
+        Na política "desconectar", o cliente lento tem as pendentes guardadas e é removido.
+        """
+        mudanca = self.consumidores.observe(username, segundos, mensagens)
+        if mudanca is None:
+            return
+        ewma = (self.consumidores.ewma(username) or 0.0) * 1000
+        if not mudanca:
+            log.info("%s voltou ao normal (EWMA %.0f ms).", username, ewma)
+            return
+        self.m_lentos.inc()
+        log.warning("%s classificado como cliente lento (EWMA %.0f ms); política %s.",
+                    username, ewma, POLITICA_LENTO)
+        if POLITICA_LENTO == "desconectar":
+            self._guardar_pendentes(username)
+            self.m_removidos.inc()
+            self.unregister_client(username)
+
+    def _guardar_pendentes(self, username: str, lote=()):
+        """
+        Passa 'lote' e a fila de saída do cliente, nessa ordem, para a caixa offline: chamado antes
+        de remover um cliente que não saiu por conta própria (lease expirado, fila cheia, falha ou
+        lentidão), que recebe tudo ao se registrar de novo. 'lote' traz itens (mensagem, privado, _).
+        """
+        with self.outbox_lock:
+            resto = list(self.outbox.pop(username, ()))
+            self.pendentes -= len(resto)
+        mensagens = [(message, is_private) for message, is_private, _ in list(lote) + resto]
+        if mensagens:
+            self.caixas.put(username, [guardada(message, is_private) for message, is_private in mensagens])
+
+    def _fechar_conexao(self, conexao, travada=False):
+        """Fecha o proxy de um cliente que saiu (com travada=True, o lock dele já é nosso)."""
+        if not travada:
+            conexao.lock.acquire()
+        try:
+            conexao.proxy._pyroClaimOwnership()
+            conexao.proxy._pyroRelease()
+        finally:
+            conexao.lock.release()
+
+    def _deliver(self, username: str, message: Mensagem, is_private: bool):
+        """Entrega uma única mensagem (o texto pronto) pelo proxy em cache do cliente."""
+        self._call(username, "receive_message", message.texto, is_private)
+
+    def _deliver_batch(self, username: str, lote: list):
+        """
+        Entrega um lote de (Mensagem, privado).
+        Quem negociou o formato compacto recebe 'receive_compact' com [quadro, privado] por mensagem:
+        o quadro do registro posicional (comprimido acima do limite) sai do cache 'quadros', então
+        num broadcast cada mensagem é codificada uma vez por formato, não uma vez por destinatário,
+        e o marshal do proxy só copia os bytes. Os demais recebem
+        os textos prontos: receive_batch quando há mais de uma mensagem e, se o cliente não tiver
+        esse método, receive_message.
+        """
+        conexao = self.clients.get(username)
+        if conexao is not None and conexao.formato is not None and username not in self.sem_compacto:
+            try:
+                itens = [[self.quadros.get(conexao.formato, message.campos, message.campos), is_private]
+                         for message, is_private in lote]
+                self._call(username, "receive_compact", itens)
+                return
+            except AttributeError:
+                self.sem_compacto.add(username)
+        if len(lote) > 1 and username not in self.legacy_clients:
+            try:
+                self._call(username, "receive_batch", [(message.texto, is_private) for message, is_private in lote])
+                return
+            except AttributeError:
+                self.legacy_clients.add(username)
+        for message, is_private in lote:
+            self._deliver(username, message, is_private)
+
+    def _call(self, username: str, method: str, *args, esperar=True):
+        """
+        Chama um método no proxy em cache do cliente.
+        O proxy é reaproveitado entre mensagens (conexão quente); o lock do cliente
+        garante que só uma thread o use por vez, e a posse é transferida para a
+        thread atual antes da chamada. Em falha de comunicação a conexão é
+        liberada para que a próxima chamada reconecte.
+        Com esperar=False, não chama nada e retorna False se outra thread está usando o proxy
+        (e True se a chamada foi feita).
+        """
+        conexao = self.clients.get(username)
+        if conexao is None:
+            return
+        if not conexao.lock.acquire(blocking=esperar):
+            return False
+        try:
+            conexao.proxy._pyroClaimOwnership()
+            resultado = getattr(conexao.proxy, method)(*args)
+        except Pyro5.errors.CommunicationError:
+            conexao.proxy._pyroRelease()
+            raise
+        finally:
+            conexao.lock.release()
+        return resultado if esperar else True
 
 
-def start_server():
+def start_server(host=None, port=None, servertype=None, workers=None, ns_host=None, ns_port=None):
+    """
+    Sobe o servidor. Parâmetros omitidos usam as configurações do topo do arquivo.
+    No modo "multiplex" nenhum método remoto pode bloquear: as entregas já correm no pool
+    de entrega e o fechamento de conexões de quem sai também é feito fora do laço.
+    """
+    configure_logging(LOG_LEVEL, LOG_BURST, LOG_PERIOD)
+    servertype = servertype or SERVERTYPE
+    configure_daemon(servertype, workers or SERVER_WORKERS)
     daemon = None
     try:
         # Inicializa o Name Server Proxy
-        ns = Pyro5.api.locate_ns(host=NS_HOST, port=NS_PORT)
+        ns = Pyro5.api.locate_ns(host=ns_host or NS_HOST, port=ns_port or NS_PORT)
         
-        # Inicializa o Daemon do Servidor de Chat (escutando no host local)
-        daemon = Pyro5.api.Daemon(host=SERVER_HOST)
+        # Inicializa o Daemon do Servidor de Chat
+        daemon = Pyro5.api.Daemon(host=host or SERVER_HOST, port=SERVER_PORT if port is None else port)
         
         # Cria e registra a instância do servidor no Daemon
         chat_server = ChatServer()
@@ -125,21 +742,27 @@ def start_server():
         # NOME DO SERVIÇO CORRIGIDO para "ChatService.Server"
         ns.register("ChatService.Server", uri) 
         
-        print(f"Servidor de Chat em execução em: {uri}")
-        print("Aguardando conexões...")
+        log.info("Servidor de Chat em execução em: %s (servidor '%s')", uri, servertype)
+        log.info("Aguardando conexões...")
         
         # Inicia o loop principal do Daemon
         daemon.requestLoop()
 
     except Pyro5.errors.NamingError:
-        print("\nERRO: Name Server não encontrado.")
-        print("Certifique-se de que o Name Server esteja em execução com 'pyro5-ns -n 127.0.0.1 -p 9090'")
+        log.error("Name Server não encontrado. Certifique-se de que o Name Server esteja em execução "
+                  "com 'pyro5-ns -n 127.0.0.1 -p 9090'")
     except Exception as e:
-        print(f"Erro fatal no servidor: {e}")
+        log.exception("Erro fatal no servidor: %s", e)
     finally:
         if daemon:
             daemon.close()
-        print("Servidor encerrado.")
+        log.info("Servidor encerrado.")
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Servidor de chat (Pyro5)")
+    # As mesmas opções (e variáveis de ambiente CHAT_*) do LocalFuncional (netconfig.py);
+    # sem --ns-host/--ns-port, start_server usa NS_HOST/NS_PORT
+    add_network_arguments(parser, host=SERVER_HOST, port=SERVER_PORT)
+    parser.set_defaults(workers=SERVER_WORKERS)
+    args = parser.parse_args()
+    start_server(args.host, args.port, args.servertype, args.workers, args.ns_host, args.ns_port)
\ No newline at end of file